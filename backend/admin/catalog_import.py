@@ -0,0 +1,291 @@
+'''
+Business: Массовый импорт каталога кейсов с вложенными предметами из JSON или CSV одной транзакцией
+Args: каталог (JSON: {"cases": [{..., "items": [...]}]} или CSV по строке на предмет), режим insert/upsert
+Returns: parse_catalog() с проверкой шансов выпадения и import_catalog() с пакетными вставками и счётчиками изменений
+'''
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Tuple
+from psycopg2.extras import execute_values
+
+RARITIES = ('common', 'rare', 'epic', 'legendary')
+NAME_MAX_LENGTH = 100
+MAX_PRICE = Decimal('99999999.99')
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+CSV_CASE_COLUMNS = {
+    'case_name': 'name',
+    'case_description': 'description',
+    'case_price': 'price',
+    'case_rarity': 'rarity',
+    'case_image_url': 'image_url'
+}
+CSV_ITEM_COLUMNS = {
+    'item_name': 'name',
+    'item_description': 'description',
+    'item_rarity': 'rarity',
+    'drop_chance': 'drop_chance',
+    'item_image_url': 'image_url'
+}
+
+
+class CatalogError(ValueError):
+    def __init__(self, errors: List[str]):
+        super().__init__('Invalid catalog')
+        self.errors = errors[:MAX_REPORTED_ERRORS]
+
+
+def _decimal(value: Any) -> Decimal:
+    if isinstance(value, bool):
+        raise InvalidOperation
+    number = Decimal(str(value).strip())
+    if not number.is_finite():
+        raise InvalidOperation
+    return number
+
+
+def _text(value: Any) -> Any:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _same_value(column: str, first: Any, value: Any) -> bool:
+    if column == 'case_price':
+        try:
+            return _decimal(first) == _decimal(value)
+        except (InvalidOperation, ValueError):
+            pass
+    return first == value
+
+
+def _rows_to_cases(text: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {'case_name', 'case_price', 'item_name', 'drop_chance'} - set(reader.fieldnames or [])
+    if missing:
+        raise CatalogError([f'CSV is missing columns: {", ".join(sorted(missing))}'])
+
+    cases: Dict[str, Dict[str, Any]] = {}
+    # Строка, из которой взято значение поля кейса, — чтобы указать её в сообщении о расхождении
+    sources: Dict[Tuple[str, str], int] = {}
+    errors: List[str] = []
+    for line, row in enumerate(reader, start=2):
+        case_name = (row.get('case_name') or '').strip()
+        case = cases.get(case_name)
+        if case is None:
+            case = cases[case_name] = {'ref': f'row {line}', 'items': []}
+        # Пустая ячейка в следующих строках кейса означает «как выше», другое значение — ошибка
+        for column, field in CSV_CASE_COLUMNS.items():
+            value = _text(row.get(column))
+            if value is None:
+                continue
+            first = _text(case.get(field))
+            if first is None:
+                case[field] = value
+                sources[(case_name, field)] = line
+            elif not _same_value(column, first, value):
+                errors.append(
+                    f'row {line}.{column}: "{value}" conflicts with "{first}" '
+                    f'from row {sources[(case_name, field)]} for case "{case_name}"'
+                )
+        item = {field: row.get(column) for column, field in CSV_ITEM_COLUMNS.items()}
+        item['ref'] = f'row {line}'
+        case['items'].append(item)
+    return list(cases.values()), errors
+
+
+def parse_catalog(catalog: Any, fmt: str = 'json') -> List[Dict[str, Any]]:
+    if fmt == 'csv':
+        if not isinstance(catalog, str):
+            raise CatalogError(['CSV catalog must be a string'])
+        raw_cases, errors = _rows_to_cases(catalog)
+    elif fmt == 'json':
+        raw_cases = catalog.get('cases') if isinstance(catalog, dict) else catalog
+        if not isinstance(raw_cases, list):
+            raise CatalogError(['catalog must be a list of cases or an object with "cases"'])
+        raw_cases = [
+            dict(case, ref=f'cases[{i}]') if isinstance(case, dict) else {'ref': f'cases[{i}]', 'invalid': True}
+            for i, case in enumerate(raw_cases)
+        ]
+        errors = []
+    else:
+        raise CatalogError(['format must be json or csv'])
+
+    if not raw_cases:
+        raise CatalogError(['catalog is empty'])
+
+    cases: List[Dict[str, Any]] = []
+    seen_cases = set()
+    for raw in raw_cases:
+        ref = raw['ref']
+        if raw.get('invalid'):
+            errors.append(f'{ref}: must be an object')
+            continue
+
+        case = {
+            'name': _text(raw.get('name')),
+            'description': _text(raw.get('description')),
+            'rarity': _text(raw.get('rarity')) or 'common',
+            'image_url': _text(raw.get('image_url')),
+            'items': []
+        }
+        if not case['name'] or len(case['name']) > NAME_MAX_LENGTH:
+            errors.append(f'{ref}.name: required, at most {NAME_MAX_LENGTH} characters')
+        elif case['name'] in seen_cases:
+            errors.append(f'{ref}.name: duplicate case "{case["name"]}"')
+        seen_cases.add(case['name'])
+        try:
+            case['price'] = _decimal(raw.get('price'))
+            if not Decimal('0') < case['price'] <= MAX_PRICE or case['price'].as_tuple().exponent < -2:
+                raise InvalidOperation
+        except (InvalidOperation, ValueError):
+            errors.append(f'{ref}.price: must be a positive amount with at most 2 decimal places')
+        if case['rarity'] not in RARITIES:
+            errors.append(f'{ref}.rarity: must be one of {", ".join(RARITIES)}')
+
+        raw_items = raw.get('items')
+        if not isinstance(raw_items, list) or not raw_items:
+            errors.append(f'{ref}.items: at least one item is required')
+            raw_items = []
+
+        total = Decimal('0')
+        chances_valid = True
+        seen_items = set()
+        for j, raw_item in enumerate(raw_items):
+            item_ref = raw_item.get('ref') if isinstance(raw_item, dict) and raw_item.get('ref') else f'{ref}.items[{j}]'
+            if not isinstance(raw_item, dict):
+                errors.append(f'{item_ref}: must be an object')
+                chances_valid = False
+                continue
+            item = {
+                'name': _text(raw_item.get('name')),
+                'description': _text(raw_item.get('description')),
+                'rarity': _text(raw_item.get('rarity')) or 'common',
+                'image_url': _text(raw_item.get('image_url'))
+            }
+            if not item['name'] or len(item['name']) > NAME_MAX_LENGTH:
+                errors.append(f'{item_ref}.name: required, at most {NAME_MAX_LENGTH} characters')
+            elif item['name'] in seen_items:
+                errors.append(f'{item_ref}.name: duplicate item "{item["name"]}" in case')
+            seen_items.add(item['name'])
+            if item['rarity'] not in RARITIES:
+                errors.append(f'{item_ref}.rarity: must be one of {", ".join(RARITIES)}')
+            try:
+                item['drop_chance'] = _decimal(raw_item.get('drop_chance'))
+                if not Decimal('0') < item['drop_chance'] <= 100 or item['drop_chance'].as_tuple().exponent < -2:
+                    raise InvalidOperation
+                total += item['drop_chance']
+            except (InvalidOperation, ValueError):
+                errors.append(f'{item_ref}.drop_chance: must be from 0.01 to 100 with at most 2 decimal places')
+                chances_valid = False
+            case['items'].append(item)
+
+        if raw_items and chances_valid and total != 100:
+            errors.append(f'{ref}: drop_chance values sum to {total}, expected 100')
+        cases.append(case)
+
+    if errors:
+        raise CatalogError(errors)
+    return cases
+
+
+def _existing_cases(cursor, names: List[str]) -> Dict[str, int]:
+    cursor.execute("SELECT id, name FROM cases WHERE name = ANY(%s)", (names,))
+    existing: Dict[str, int] = {}
+    duplicates = []
+    for row in cursor.fetchall():
+        if row['name'] in existing:
+            duplicates.append(row['name'])
+        existing[row['name']] = row['id']
+    if duplicates:
+        raise CatalogError([f'several existing cases are named "{name}", cannot upsert' for name in duplicates])
+    return existing
+
+
+def import_catalog(cursor, cases: List[Dict[str, Any]], upsert: bool = False) -> Dict[str, Any]:
+    existing = _existing_cases(cursor, [case['name'] for case in cases])
+    if existing and not upsert:
+        raise CatalogError([f'case "{name}" already exists, use mode=upsert to update it' for name in existing])
+
+    new_cases = [case for case in cases if case['name'] not in existing]
+    updated_cases = [case for case in cases if case['name'] in existing]
+    case_ids = dict(existing)
+
+    if new_cases:
+        rows = execute_values(cursor, """
+            INSERT INTO cases (name, description, price, rarity, image_url)
+            VALUES %s
+            RETURNING id, name
+        """, [(c['name'], c['description'], c['price'], c['rarity'], c['image_url']) for c in new_cases],
+            page_size=BATCH_SIZE, fetch=True)
+        case_ids.update((row['name'], row['id']) for row in rows)
+
+    if updated_cases:
+        execute_values(cursor, """
+            UPDATE cases c
+            SET description = v.description, price = v.price, rarity = v.rarity, image_url = v.image_url
+            FROM (VALUES %s) AS v(id, description, price, rarity, image_url)
+            WHERE c.id = v.id
+        """, [(existing[c['name']], c['description'], c['price'], c['rarity'], c['image_url']) for c in updated_cases],
+            template='(%s, %s, %s::numeric, %s, %s)', page_size=BATCH_SIZE)
+
+    existing_items: Dict[Tuple[int, str], int] = {}
+    if updated_cases:
+        cursor.execute("""
+            SELECT id, case_id, name FROM case_items WHERE case_id = ANY(%s)
+        """, ([existing[c['name']] for c in updated_cases],))
+        existing_items = {(row['case_id'], row['name']): row['id'] for row in cursor.fetchall()}
+
+    item_inserts = []
+    item_updates = []
+    for case in cases:
+        case_id = case_ids[case['name']]
+        for item in case['items']:
+            item_id = existing_items.get((case_id, item['name']))
+            values = (item['description'], item['rarity'], item['drop_chance'], item['image_url'])
+            if item_id is None:
+                item_inserts.append((case_id, item['name']) + values)
+            else:
+                item_updates.append((item_id,) + values)
+
+    if item_inserts:
+        execute_values(cursor, """
+            INSERT INTO case_items (case_id, name, description, rarity, drop_chance, image_url)
+            VALUES %s
+        """, item_inserts, page_size=BATCH_SIZE)
+
+    if item_updates:
+        execute_values(cursor, """
+            UPDATE case_items ci
+            SET description = v.description, rarity = v.rarity, drop_chance = v.drop_chance, image_url = v.image_url
+            FROM (VALUES %s) AS v(id, description, rarity, drop_chance, image_url)
+            WHERE ci.id = v.id
+        """, item_updates, template='(%s, %s, %s, %s::numeric, %s)', page_size=BATCH_SIZE)
+
+    if updated_cases:
+        cursor.execute("""
+            SELECT c.name, SUM(ci.drop_chance) AS total
+            FROM case_items ci
+            JOIN cases c ON c.id = ci.case_id
+            WHERE ci.case_id = ANY(%s)
+            GROUP BY c.name
+            HAVING SUM(ci.drop_chance) <> 100
+        """, ([existing[c['name']] for c in updated_cases],))
+        unbalanced = cursor.fetchall()
+        if unbalanced:
+            raise CatalogError([
+                f'case "{row["name"]}": drop_chance values sum to {row["total"]} after upsert '
+                f'(items missing from the import are kept), expected 100'
+                for row in unbalanced
+            ])
+
+    return {
+        'cases_created': len(new_cases),
+        'cases_updated': len(updated_cases),
+        'items_created': len(item_inserts),
+        'items_updated': len(item_updates),
+        'case_ids': [case_ids[case['name']] for case in cases]
+    }
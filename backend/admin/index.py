@@ -1,19 +1,94 @@
 '''
 Business: Админ-панель для управления пользователями, кейсами и предметами
-Args: event с httpMethod, body (JSON), headers (X-User-Id для проверки прав)
+Args: event с httpMethod, body (JSON), headers (Authorization: Bearer <токен администратора>);
+      action=users принимает limit, cursor и q (начало имени), action=users_export отдаёт CSV страницами
+      (limit, cursor; заголовок столбцов только на первой странице, следующая — по X-Next-Cursor);
+      action=import_catalog принимает catalog, format (json/csv), mode (insert/upsert) и dry_run
 Returns: HTTP response с результатом операции
 '''
+import csv
+import io
 import json
-import os
-from typing import Dict, Any
-import psycopg2
+from typing import Dict, Any, List, Optional, Tuple
 from psycopg2.extras import RealDictCursor
+import db
+import db_async
+from instrumentation import instrument
+from tokens import authenticate
+import serializer
+from pagination import PaginationError, parse_limit, encode_cursor, decode_cursor, next_page_headers
+from catalog_import import CatalogError, parse_catalog, import_catalog
 
-def check_admin(user_id: int, cursor) -> bool:
-    cursor.execute("SELECT is_admin FROM users WHERE id = %s", (user_id,))
-    result = cursor.fetchone()
-    return result and result['is_admin']
+def bump_catalog_version(cursor) -> None:
+    cursor.execute("""
+        UPDATE t_p36789279_gta_cases_portal.catalog_version
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+    """)
 
+EXPORT_PAGE_SIZE = 5000
+READ_MAX_STALENESS = {'users': 10.0, 'users_export': 60.0, 'stats': 30.0}
+
+def build_users_query(params: Dict[str, Any]) -> Tuple[str, list, str, int]:
+    limit = parse_limit(params.get('limit'))
+    conditions: List[str] = []
+    args: list = []
+    prefix = params.get('q')
+    after = decode_cursor(params.get('cursor'), ('text' if prefix else 'timestamp', 'int'))
+    
+    if prefix:
+        conditions.append('lower(username) COLLATE "C" LIKE %s')
+        args.append(prefix.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if after:
+            conditions.append('(lower(username) COLLATE "C", id) > (%s, %s)')
+            args.extend(after)
+        order = 'lower(username) COLLATE "C" ASC, id ASC'
+        sort_key = 'username'
+    else:
+        if after:
+            conditions.append('(created_at, id) < (%s::timestamp, %s)')
+            args.extend(after)
+        order = 'created_at DESC, id DESC'
+        sort_key = 'created_at'
+    
+    args.append(limit + 1)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    sql = f"""
+        SELECT id, username, email, t_p36789279_gta_cases_portal.user_balance(id) AS balance, is_admin, created_at
+        FROM users
+        {where}
+        ORDER BY {order}
+        LIMIT %s
+    """
+    return sql, args, sort_key, limit
+
+def users_csv_page(cursor, params: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    limit = parse_limit(params.get('limit'), default=EXPORT_PAGE_SIZE, maximum=EXPORT_PAGE_SIZE)
+    after = decode_cursor(params.get('cursor'), ('int',))
+    cursor.execute("""
+        SELECT id, username, email, t_p36789279_gta_cases_portal.user_balance(id) AS balance, is_admin, created_at
+        FROM users
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (after[0] if after else 0, limit + 1))
+    rows = cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['id']])
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if not after:
+        writer.writerow(['id', 'username', 'email', 'balance', 'is_admin', 'created_at'])
+    writer.writerows(
+        (row['id'], row['username'], row['email'], row['balance'], row['is_admin'], row['created_at'])
+        for row in rows
+    )
+    return buffer.getvalue(), next_cursor
+
+@instrument
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -23,75 +98,105 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-DB-Position',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    headers = event.get('headers', {})
-    user_id = headers.get('x-user-id') or headers.get('X-User-Id')
+    claims = authenticate(event)
     
-    if not user_id:
+    if not claims:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': 'Unauthorized'})
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    if not claims['is_admin']:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Access denied'})
+        }
+    
+    params = event.get('queryStringParameters', {}) or {}
+    action = params.get('action')
+    if method == 'GET' and action in READ_MAX_STALENESS:
+        conn = db.acquire_read(READ_MAX_STALENESS[action], db.read_position(event))
+    else:
+        conn = db.acquire()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        if not check_admin(int(user_id), cursor):
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Access denied'})
-            }
-        
-        params = event.get('queryStringParameters', {}) or {}
-        action = params.get('action')
         
         if method == 'GET':
             if action == 'users':
-                cursor.execute("""
-                    SELECT id, username, email, balance, is_admin, created_at
-                    FROM users
-                    ORDER BY created_at DESC
-                """)
-                users = [dict(u) for u in cursor.fetchall()]
-                for u in users:
-                    u['balance'] = float(u['balance'])
+                try:
+                    sql, args, sort_key, limit = build_users_query(params)
+                except PaginationError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
+                
+                cursor.execute(sql, args)
+                users = cursor.fetchall()
+                next_cursor = None
+                if len(users) > limit:
+                    users = users[:limit]
+                    last = users[-1]
+                    key = last['username'].lower() if sort_key == 'username' else last['created_at']
+                    next_cursor = encode_cursor([key, last['id']])
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(users, default=str)
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **next_page_headers(next_cursor)},
+                    'body': serializer.dumps(users)
                 }
             
-            elif action == 'stats':
-                cursor.execute("SELECT COUNT(*) as total_users FROM users")
-                total_users = cursor.fetchone()['total_users']
-                
-                cursor.execute("SELECT COUNT(*) as total_cases FROM cases")
-                total_cases = cursor.fetchone()['total_cases']
+            elif action == 'users_export':
+                # Функция отдаёт ответ одним телом, поэтому выгрузка ограничена страницей, а не всей таблицей
+                try:
+                    body, next_cursor = users_csv_page(cursor, params)
+                except PaginationError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
                 
-                cursor.execute("SELECT COUNT(*) as total_promocodes FROM promocodes")
-                total_promocodes = cursor.fetchone()['total_promocodes']
-                
-                cursor.execute("SELECT SUM(balance) as total_balance FROM users")
-                total_balance = float(cursor.fetchone()['total_balance'] or 0)
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'text/csv; charset=utf-8',
+                        'Content-Disposition': 'attachment; filename="users.csv"',
+                        'Access-Control-Allow-Origin': '*',
+                        **next_page_headers(next_cursor)
+                    },
+                    'body': body
+                }
+            
+            elif action == 'stats':
+                cursor.execute("""
+                    SELECT
+                        COALESCE(SUM(value) FILTER (WHERE name = 'total_users'), 0)::BIGINT AS total_users,
+                        COALESCE(SUM(value) FILTER (WHERE name = 'total_cases'), 0)::BIGINT AS total_cases,
+                        COALESCE(SUM(value) FILTER (WHERE name = 'total_promocodes'), 0)::BIGINT AS total_promocodes,
+                        COALESCE(SUM(value) FILTER (WHERE name = 'total_balance'), 0) AS total_balance
+                    FROM t_p36789279_gta_cases_portal.stats_counters
+                """)
+                stats = cursor.fetchone()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({
-                        'total_users': total_users,
-                        'total_cases': total_cases,
-                        'total_promocodes': total_promocodes,
-                        'total_balance': total_balance
+                        'total_users': stats['total_users'],
+                        'total_cases': stats['total_cases'],
+                        'total_promocodes': stats['total_promocodes'],
+                        'total_balance': float(stats['total_balance'])
                     })
                 }
         
@@ -104,17 +209,154 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 new_balance = body_data.get('balance')
                 
                 cursor.execute(
-                    "UPDATE users SET balance = %s WHERE id = %s",
-                    (new_balance, target_user_id)
+                    "SELECT t_p36789279_gta_cases_portal.ledger_set_balance(%s, %s, 'admin_adjust', 'admin', %s) AS balance",
+                    (target_user_id, new_balance, claims['user_id'])
                 )
+                if cursor.fetchone()['balance'] is None:
+                    conn.rollback()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'User not found'})
+                    }
                 conn.commit()
+                position = db.write_position(conn)
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **position},
                     'body': json.dumps({'success': True})
                 }
             
+            elif action == 'compact_balances':
+                cursor.execute("SELECT t_p36789279_gta_cases_portal.compact_balances() AS compacted")
+                compacted = cursor.fetchone()['compacted']
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True, 'compacted_users': compacted})
+                }
+            
+            elif action == 'verify_balances':
+                cursor.execute("""
+                    SELECT user_id, problem, snapshot_balance, ledger_balance
+                    FROM t_p36789279_gta_cases_portal.verify_balances()
+                    ORDER BY user_id
+                """)
+                problems = cursor.fetchall()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'consistent': not problems,
+                        'problems': [
+                            {
+                                'user_id': row['user_id'],
+                                'problem': row['problem'],
+                                'snapshot_balance': None if row['snapshot_balance'] is None else float(row['snapshot_balance']),
+                                'ledger_balance': None if row['ledger_balance'] is None else float(row['ledger_balance'])
+                            }
+                            for row in problems
+                        ]
+                    })
+                }
+            
+            elif action == 'reconcile_stats':
+                apply = bool(body_data.get('apply', False))
+                cursor.execute(
+                    "SELECT name, counted, actual, drift FROM t_p36789279_gta_cases_portal.reconcile_stats(%s)",
+                    (apply,)
+                )
+                report = [
+                    {
+                        'name': row['name'],
+                        'counted': float(row['counted']),
+                        'actual': float(row['actual']),
+                        'drift': float(row['drift'])
+                    }
+                    for row in cursor.fetchall()
+                ]
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'applied': apply,
+                        'drift_found': any(r['drift'] != 0 for r in report),
+                        'counters': report
+                    })
+                }
+            
+            elif action == 'archive_history':
+                try:
+                    retention_days = int(body_data.get('retention_days', 180))
+                    months_ahead = int(body_data.get('months_ahead', 3))
+                except (TypeError, ValueError):
+                    retention_days = months_ahead = -1
+                if retention_days < 1 or months_ahead < 0:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'retention_days must be a positive integer, months_ahead a non-negative integer'})
+                    }
+                cursor.execute("""
+                    SELECT partitions_created, promocodes_archived, listings_archived
+                    FROM t_p36789279_gta_cases_portal.archive_history(make_interval(days => %s), %s)
+                """, (retention_days, months_ahead))
+                result = cursor.fetchone()
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'partitions_created': result['partitions_created'],
+                        'promocodes_archived': result['promocodes_archived'],
+                        'listings_archived': result['listings_archived']
+                    })
+                }
+            
+            elif action == 'import_catalog':
+                mode = body_data.get('mode', 'insert')
+                dry_run = bool(body_data.get('dry_run'))
+                
+                if mode not in ('insert', 'upsert'):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'mode must be insert or upsert'})
+                    }
+                
+                try:
+                    cases = parse_catalog(body_data.get('catalog'), body_data.get('format', 'json'))
+                    bump_catalog_version(cursor)
+                    summary = import_catalog(cursor, cases, upsert=mode == 'upsert')
+                except CatalogError as e:
+                    conn.rollback()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e), 'details': e.errors}, ensure_ascii=False)
+                    }
+                
+                if dry_run:
+                    conn.rollback()
+                else:
+                    conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(dict(summary, success=True, dry_run=dry_run, mode=mode))
+                }
+            
             elif action == 'create_case':
                 name = body_data.get('name')
                 description = body_data.get('description')
@@ -128,6 +370,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 """, (name, description, price, rarity))
                 
                 case_id = cursor.fetchone()['id']
+                bump_catalog_version(cursor)
                 conn.commit()
                 
                 return {
@@ -148,6 +391,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     SET name = %s, description = %s, price = %s, rarity = %s
                     WHERE id = %s
                 """, (name, description, price, rarity, case_id))
+                bump_catalog_version(cursor)
                 conn.commit()
                 
                 return {
@@ -170,6 +414,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 """, (case_id, name, description, rarity, drop_chance))
                 
                 item_id = cursor.fetchone()['id']
+                bump_catalog_version(cursor)
                 conn.commit()
                 
                 return {
@@ -190,6 +435,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     SET name = %s, description = %s, rarity = %s, drop_chance = %s
                     WHERE id = %s
                 """, (name, description, rarity, drop_chance, item_id))
+                bump_catalog_version(cursor)
                 conn.commit()
                 
                 return {
@@ -206,4 +452,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        db.release(conn)
+
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return await db_async.run(handler, event, context)
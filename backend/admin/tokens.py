@@ -0,0 +1,106 @@
+'''
+Business: Подписанные HMAC-SHA256 токены доступа: id пользователя, флаг админа и срок действия
+Args: TOKEN_SECRETS ("kid:secret,kid:secret", первым идёт ключ для подписи), TOKEN_TTL в секундах
+Returns: issue_token()/verify_token()/authenticate() — проверка без обращения к БД, с кэшем проверенных токенов
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', str(7 * 24 * 3600)))
+VERIFY_CACHE_SIZE = 4096
+
+_cache_lock = threading.Lock()
+_verified: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+_keys: Optional[Tuple[str, Dict[str, bytes]]] = None
+
+
+def _load_keys() -> Tuple[str, Dict[str, bytes]]:
+    global _keys
+    if _keys is None:
+        keys: Dict[str, bytes] = {}
+        active = None
+        for entry in os.environ.get('TOKEN_SECRETS', '').split(','):
+            kid, sep, secret = entry.strip().partition(':')
+            if not sep or not kid or not secret:
+                continue
+            keys[kid] = secret.encode()
+            active = active or kid
+        if active is None:
+            raise RuntimeError('TOKEN_SECRETS is not configured')
+        _keys = (active, keys)
+    return _keys
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(key: bytes, message: str) -> str:
+    return _b64(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, is_admin: bool, ttl: Optional[int] = None) -> str:
+    active, keys = _load_keys()
+    claims = {'uid': user_id, 'adm': bool(is_admin), 'exp': int(time.time()) + (ttl or TOKEN_TTL)}
+    payload = _b64(json.dumps(claims, separators=(',', ':')).encode())
+    message = f'v1.{active}.{payload}'
+    return f'{message}.{_sign(keys[active], message)}'
+
+
+def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    now = time.time()
+    with _cache_lock:
+        claims = _verified.get(token)
+        if claims is not None:
+            if claims['exp'] > now:
+                _verified.move_to_end(token)
+                return claims
+            del _verified[token]
+
+    parts = token.split('.')
+    if len(parts) != 4 or parts[0] != 'v1':
+        return None
+    _, kid, payload, signature = parts
+    key = _load_keys()[1].get(kid)
+    if key is None or not hmac.compare_digest(_sign(key, f'v1.{kid}.{payload}').encode(), signature.encode()):
+        return None
+
+    try:
+        raw = json.loads(_unb64(payload))
+        claims = {'user_id': int(raw['uid']), 'is_admin': bool(raw['adm']), 'exp': int(raw['exp'])}
+    except (ValueError, KeyError, TypeError):
+        return None
+    if claims['exp'] <= now:
+        return None
+
+    with _cache_lock:
+        _verified[token] = claims
+        if len(_verified) > VERIFY_CACHE_SIZE:
+            _verified.popitem(last=False)
+    return claims
+
+
+def token_from_event(event: Dict[str, Any]) -> Optional[str]:
+    for name, value in (event.get('headers') or {}).items():
+        lowered = name.lower()
+        if lowered == 'authorization' and value and value.lower().startswith('bearer '):
+            return value[7:].strip()
+        if lowered == 'x-auth-token' and value:
+            return value.strip()
+    return None
+
+
+def authenticate(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    token = token_from_event(event)
+    return verify_token(token) if token else None
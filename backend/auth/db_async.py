@@ -0,0 +1,327 @@
+'''
+Business: Асинхронный режим обработчиков — пул асинхронных соединений psycopg2 на asyncio и запуск той же бизнес-логики
+Args: DATABASE_URL, DATABASE_URL_REPLICA, DB_POOL_SIZE, DB_HEALTHCHECK_INTERVAL из окружения; синхронный handler функции
+Returns: run(handler, event, context) — корутина; внутри неё db.acquire() отдаёт соединение, ожидающее запросы в event loop;
+         одновременно открыто не больше DB_POOL_SIZE соединений на базу, остальные вызовы ждут освободившееся
+'''
+import asyncio
+import contextvars
+import os
+import sys
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import psycopg2
+from psycopg2 import extensions
+from instrumentation import measure, query_timer
+
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+HEALTHCHECK_INTERVAL = float(os.environ.get('DB_HEALTHCHECK_INTERVAL', '30'))
+
+
+async def _wait(raw) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        state = raw.poll()
+        if state == extensions.POLL_OK:
+            return
+        future = loop.create_future()
+        wake = lambda: future.done() or future.set_result(None)
+        fd = raw.fileno()
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, wake)
+            remove = loop.remove_reader
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, wake)
+            remove = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f'Unexpected poll state {state}')
+        try:
+            await future
+        finally:
+            remove(fd)
+
+
+async def _execute(raw_cursor, query: Any, vars: Any = None) -> None:
+    raw_cursor.execute(query, vars)
+    await _wait(raw_cursor.connection)
+
+
+async def _connect(url_variable: str):
+    raw = psycopg2.connect(
+        os.environ.get(url_variable),
+        async_=True,
+        connect_timeout=5,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3
+    )
+    await _wait(raw)
+    return raw
+
+
+async def _reset(raw) -> bool:
+    if raw.closed:
+        return False
+    status = raw.get_transaction_status()
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            await _execute(raw.cursor(), 'ROLLBACK')
+    except psycopg2.Error:
+        return False
+    return True
+
+
+async def _ping(raw) -> bool:
+    try:
+        await _execute(raw.cursor(), 'SELECT 1')
+        return True
+    except psycopg2.Error:
+        return False
+
+
+class _AsyncPool:
+    def __init__(self, url_variable: str):
+        self.url_variable = url_variable
+        self.slots = asyncio.Semaphore(POOL_SIZE)
+        self.idle: List[Tuple[Any, float]] = []
+        self.counters: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+    async def acquire_raw(self):
+        await self.slots.acquire()
+        try:
+            return await self._take_or_connect()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    async def _take_or_connect(self):
+        now = time.monotonic()
+        while self.idle:
+            raw, released_at = self.idle.pop()
+            if not await _reset(raw) or (now - released_at > HEALTHCHECK_INTERVAL and not await _ping(raw)):
+                raw.close()
+                self.counters['reconnects'] += 1
+                continue
+            self.counters['hits'] += 1
+            return raw
+
+        raw = await _connect(self.url_variable)
+        self.counters['misses'] += 1
+        return raw
+
+    async def release_raw(self, raw) -> None:
+        try:
+            await self._return_to_pool(raw)
+        finally:
+            self.slots.release()
+
+    async def _return_to_pool(self, raw) -> None:
+        if not await _reset(raw):
+            raw.close()
+            self.counters['discarded'] += 1
+            return
+        if len(self.idle) < POOL_SIZE:
+            self.idle.append((raw, time.monotonic()))
+            return
+        self.counters['discarded'] += 1
+        raw.close()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, idle=len(self.idle))
+
+
+_primary = _AsyncPool('DATABASE_URL')
+_replica = _AsyncPool('DATABASE_URL_REPLICA')
+
+
+def stats() -> Dict[str, Any]:
+    result: Dict[str, Any] = _primary.stats()
+    if os.environ.get('DATABASE_URL_REPLICA'):
+        result['replica'] = _replica.stats()
+    return result
+
+
+class _Bridge(greenlet.greenlet if greenlet else object):
+    pass
+
+
+def bridged() -> bool:
+    return greenlet is not None and isinstance(greenlet.getcurrent(), _Bridge)
+
+
+def await_(awaitable: Awaitable) -> Any:
+    current = greenlet.getcurrent()
+    if not isinstance(current, _Bridge):
+        raise RuntimeError('await_() called outside of db_async.run()')
+    return current.parent.switch(awaitable)
+
+
+async def run(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]], event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if greenlet is None:
+        raise RuntimeError('greenlet is not installed')
+    bridge = _Bridge(handler, greenlet.getcurrent())
+    bridge.gr_context = contextvars.copy_context()
+    result = bridge.switch(event, context)
+    while not bridge.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = bridge.throw(*sys.exc_info())
+        else:
+            result = bridge.switch(value)
+    return result
+
+
+class BridgedCursor:
+    def __init__(self, connection: 'BridgedConnection', raw_cursor, name: Optional[str] = None):
+        self.connection = connection
+        self.name = name
+        self.itersize = 2000
+        self._raw = raw_cursor
+        self._declared = False
+        self._buffer: deque = deque()
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._raw, attr)
+
+    # __getattr__ не вызывается для протокола итерации — его нужно объявить, как у курсора psycopg2
+    def __iter__(self) -> 'BridgedCursor':
+        return self
+
+    def __next__(self) -> Any:
+        if self.name is None:
+            return next(self._raw)
+        if not self._buffer:
+            self._buffer.extend(self._fetch(self.itersize))
+            if not self._buffer:
+                raise StopIteration
+        return self._buffer.popleft()
+
+    def __enter__(self) -> 'BridgedCursor':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _run(self, query: Any, vars: Any = None) -> None:
+        with query_timer(query):
+            await_(_execute(self._raw, query, vars))
+
+    def execute(self, query: Any, vars: Any = None) -> None:
+        self.connection._begin()
+        self._buffer.clear()
+        if self.name is None:
+            self._run(query, vars)
+            return
+        statement = self._raw.mogrify(query, vars)
+        self._run(b'DECLARE "' + self.name.encode() + b'" NO SCROLL CURSOR FOR ' + statement)
+        self._declared = True
+
+    def executemany(self, query: Any, vars_list) -> None:
+        for vars in vars_list:
+            self.execute(query, vars)
+
+    def _fetch(self, count: Optional[int]) -> list:
+        direction = 'ALL' if count is None else f'FORWARD {int(count)}'
+        with query_timer(f'FETCH {direction}'):
+            await_(_execute(self._raw, f'FETCH {direction} FROM "{self.name}"'))
+        return self._raw.fetchall()
+
+    def fetchone(self) -> Any:
+        if self.name is None:
+            return self._raw.fetchone()
+        if self._buffer:
+            return self._buffer.popleft()
+        rows = self._fetch(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size: Optional[int] = None) -> list:
+        if self.name is None:
+            return self._raw.fetchmany(size) if size is not None else self._raw.fetchmany()
+        size = size or self.itersize
+        rows = [self._buffer.popleft() for _ in range(min(size, len(self._buffer)))]
+        return rows + self._fetch(size - len(rows)) if len(rows) < size else rows
+
+    def fetchall(self) -> list:
+        if self.name is None:
+            return self._raw.fetchall()
+        rows = list(self._buffer)
+        self._buffer.clear()
+        return rows + self._fetch(None)
+
+    def close(self) -> None:
+        if self._declared and self.connection._in_transaction:
+            try:
+                self._run(f'CLOSE "{self.name}"')
+            except psycopg2.Error:
+                pass
+        self._declared = False
+        self._raw.close()
+
+
+class BridgedConnection:
+    def __init__(self, raw, pool: _AsyncPool):
+        self.raw = raw
+        self.pool = pool
+        self.autocommit = False
+        self._in_transaction = False
+
+    @property
+    def closed(self) -> int:
+        return self.raw.closed
+
+    @property
+    def encoding(self) -> str:
+        return self.raw.encoding
+
+    def get_transaction_status(self) -> int:
+        return self.raw.get_transaction_status()
+
+    def cursor(self, name: Optional[str] = None, cursor_factory: Any = None) -> BridgedCursor:
+        raw_cursor = self.raw.cursor(cursor_factory=cursor_factory) if cursor_factory else self.raw.cursor()
+        return BridgedCursor(self, raw_cursor, name)
+
+    def _begin(self) -> None:
+        if not self.autocommit and not self._in_transaction:
+            with measure('db'):
+                await_(_execute(self.raw.cursor(), 'BEGIN'))
+            self._in_transaction = True
+
+    def _finish(self, statement: str) -> None:
+        if not self._in_transaction:
+            return
+        self._in_transaction = False
+        with measure('db'):
+            await_(_execute(self.raw.cursor(), statement))
+
+    def commit(self) -> None:
+        self._finish('COMMIT')
+
+    def rollback(self) -> None:
+        self._finish('ROLLBACK')
+
+    def close(self) -> None:
+        self.raw.close()
+
+
+def acquire(replica: bool = False) -> BridgedConnection:
+    pool = _replica if replica else _primary
+    return BridgedConnection(await_(pool.acquire_raw()), pool)
+
+
+def release(conn: BridgedConnection) -> None:
+    if conn._in_transaction and not conn.raw.closed:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+    await_(conn.pool.release_raw(conn.raw))
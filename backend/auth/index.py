@@ -1,15 +1,19 @@
 '''
 Business: Авторизация и регистрация пользователей
 Args: event с httpMethod, body (JSON с username, password)
-Returns: HTTP response с токеном или ошибкой
+Returns: HTTP response с подписанным токеном (id, флаг админа, срок действия) или ошибкой
 '''
 import json
-import os
 import hashlib
 import hmac
 from typing import Dict, Any
-import psycopg2
+import db
+import db_async
+from instrumentation import instrument
+from tokens import issue_token
+import rate_limit
 
+@instrument
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -44,11 +48,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Username and password required'})
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    # Корзина на имя и адрес: подбор пароля с одного IP упирается в лимит, а чужие попытки со многих IP
+    # не блокируют вход самому владельцу аккаунта
+    limited = rate_limit.check(action, event, f'{username.lower()}@{rate_limit.client_ip(event)}')
+    if limited:
+        return limited
+    
+    conn = db.acquire()
     cursor = conn.cursor()
     
     try:
+        limited = rate_limit.check_shared(conn)
+        if limited:
+            return limited
+        
         if action == 'register':
             password_hash = hashlib.sha256(password.encode()).hexdigest()
             email = body_data.get('email', f'{username}@gta5rp.local')
@@ -71,7 +84,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             user_id, is_admin = cursor.fetchone()
             conn.commit()
             
-            token = f"{user_id}:{hashlib.sha256(f'{user_id}{username}{password_hash}'.encode()).hexdigest()}"
+            token = issue_token(user_id, is_admin)
             
             return {
                 'statusCode': 200,
@@ -92,7 +105,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             password_hash = hashlib.sha256(password.encode()).hexdigest()
             
             cursor.execute(
-                "SELECT id, username, balance, is_admin FROM users WHERE username = %s AND password_hash = %s",
+                "SELECT id, username, t_p36789279_gta_cases_portal.user_balance(id) AS balance, is_admin FROM users WHERE username = %s AND password_hash = %s",
                 (username, password_hash)
             )
             user = cursor.fetchone()
@@ -105,7 +118,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             user_id, username, balance, is_admin = user
-            token = f"{user_id}:{hashlib.sha256(f'{user_id}{username}{password_hash}'.encode()).hexdigest()}"
+            token = issue_token(user_id, is_admin)
             
             return {
                 'statusCode': 200,
@@ -131,4 +144,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        db.release(conn)
+
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return await db_async.run(handler, event, context)
@@ -0,0 +1,190 @@
+'''
+Business: Замеры внутри вызова функции — число SQL-запросов, время в БД, время сериализации и общее время
+Args: DB_SLOW_QUERY_MS (порог медленного запроса, по умолчанию 200), REQUEST_LOG (0 — не писать строку на каждый вызов)
+Returns: @instrument для handler (заголовок Server-Timing и JSON-строка в лог), measure()/query_timer() и InstrumentedConnection для db.py
+'''
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from psycopg2 import extensions
+
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+SQL_LOG_LIMIT = 2000
+
+
+class Metrics:
+    __slots__ = ('function', 'queries', 'db', 'serialize', 'total')
+
+    def __init__(self, function: Optional[str]):
+        self.function = function
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.total = 0.0
+
+    def server_timing(self) -> str:
+        return (f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries", '
+                f'serialize;dur={self.serialize * 1000:.2f}, '
+                f'total;dur={self.total * 1000:.2f}')
+
+
+_current: ContextVar[Optional[Metrics]] = ContextVar('request_metrics', default=None)
+
+
+def _log(record: Dict[str, Any]) -> None:
+    print(json.dumps(record, ensure_ascii=False), flush=True)
+
+
+def _sql_text(sql: Any) -> str:
+    text = sql.decode(errors='replace') if isinstance(sql, bytes) else str(sql)
+    return ' '.join(text.split())[:SQL_LOG_LIMIT]
+
+
+@contextmanager
+def measure(kind: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current.get()
+        if metrics is not None:
+            setattr(metrics, kind, getattr(metrics, kind) + time.perf_counter() - started)
+
+
+@contextmanager
+def query_timer(sql: Any) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db += elapsed
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            _log({
+                'event': 'slow_query',
+                'function': metrics.function if metrics else None,
+                'duration_ms': round(elapsed * 1000, 2),
+                'sql': _sql_text(sql)
+            })
+
+
+class _TimedCursor:
+    def execute(self, query, vars=None):
+        with query_timer(query):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with query_timer(query):
+            return super().executemany(query, vars_list)
+
+    def callproc(self, procname, parameters=None):
+        with query_timer(procname):
+            return super().callproc(procname, parameters)
+
+    def fetchone(self):
+        if self.name is None:
+            return super().fetchone()
+        with measure('db'):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        if self.name is None:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        with measure('db'):
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+
+    def fetchall(self):
+        if self.name is None:
+            return super().fetchall()
+        with measure('db'):
+            return super().fetchall()
+
+
+_cursor_classes: Dict[type, type] = {}
+_cursor_classes_lock = threading.Lock()
+
+
+def _timed_cursor_class(factory: type) -> type:
+    with _cursor_classes_lock:
+        timed = _cursor_classes.get(factory)
+        if timed is None:
+            timed = _cursor_classes[factory] = type(f'Timed{factory.__name__}', (_TimedCursor, factory), {})
+    return timed
+
+
+class InstrumentedConnection(extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        with measure('db'):
+            return super().commit()
+
+    def rollback(self):
+        with measure('db'):
+            return super().rollback()
+
+
+def _action(event: Dict[str, Any]) -> Optional[str]:
+    action = (event.get('queryStringParameters') or {}).get('action')
+    if action or not event.get('body') or event.get('isBase64Encoded'):
+        return action
+    try:
+        body = json.loads(event['body'])
+    except ValueError:
+        return None
+    return body.get('action') if isinstance(body, dict) else None
+
+
+def _log_request(event: Dict[str, Any], metrics: Metrics, status: Any) -> None:
+    if not REQUEST_LOG:
+        return
+    _log({
+        'event': 'request',
+        'function': metrics.function,
+        'method': event.get('httpMethod'),
+        'action': _action(event),
+        'status': status,
+        'queries': metrics.queries,
+        'db_ms': round(metrics.db * 1000, 2),
+        'serialize_ms': round(metrics.serialize * 1000, 2),
+        'total_ms': round(metrics.total * 1000, 2)
+    })
+
+
+def instrument(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        metrics = Metrics(getattr(context, 'function_name', None))
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = handler(event, context)
+        except Exception:
+            metrics.total = time.perf_counter() - started
+            _log_request(event, metrics, 500)
+            raise
+        finally:
+            _current.reset(token)
+
+        metrics.total = time.perf_counter() - started
+        response['headers'] = dict(
+            response.get('headers') or {},
+            **{'Server-Timing': metrics.server_timing(), 'Timing-Allow-Origin': '*'}
+        )
+        _log_request(event, metrics, response.get('statusCode'))
+        return response
+
+    return wrapper
@@ -1,14 +1,39 @@
 '''
 Business: Получение списка кейсов и их содержимого
-Args: event с httpMethod, queryStringParameters (case_id)
+Args: event с httpMethod, queryStringParameters (case_id), headers (If-None-Match)
 Returns: HTTP response со списком кейсов или предметов кейса
 '''
 import json
-import os
-from typing import Dict, Any
-import psycopg2
+from typing import Dict, Any, Tuple
 from psycopg2.extras import RealDictCursor
+import db
+import db_async
+from instrumentation import instrument
+import serializer
+import catalog_cache
+from http_cache import version_etag, is_not_modified, cache_headers, not_modified_response
 
+RESPONSE_FORMAT = 2
+CASE_LIST_CACHE_CONTROL = 'public, max-age=10, stale-while-revalidate=60'
+CASE_DETAILS_CACHE_CONTROL = 'public, max-age=30, stale-while-revalidate=120'
+CATALOG_MAX_STALENESS = 10.0
+MAX_CASE_ID = 2 ** 31 - 1
+
+def cached_response(event: Dict[str, Any], cached: Tuple[str, str], cache_control: str) -> Dict[str, Any]:
+    etag, body = cached
+    if is_not_modified(event, etag):
+        return not_modified_response(etag, cache_control)
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            **cache_headers(etag, cache_control)
+        },
+        'body': body
+    }
+
+@instrument
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,7 +43,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-DB-Position',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -32,15 +57,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     params = event.get('queryStringParameters', {}) or {}
-    case_id = params.get('case_id')
+    case_id = params.get('case_id') or None
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    if case_id is not None:
+        try:
+            case_id = int(case_id)
+            # 0 и отрицательные id не существуют; без проверки case_id=0 давал бы полный список кейсов
+            if not 0 < case_id <= MAX_CASE_ID:
+                raise ValueError
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid case_id'})
+            }
+    
+    cache_key = f'case:{case_id}' if case_id is not None else 'list'
+    cache_control = CASE_DETAILS_CACHE_CONTROL if case_id is not None else CASE_LIST_CACHE_CONTROL
+    cached = catalog_cache.lookup(cache_key)
+    if cached is not None:
+        return cached_response(event, cached, cache_control)
+    
+    conn = db.acquire_read(CATALOG_MAX_STALENESS, db.read_position(event))
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        if case_id:
-            cursor.execute(f"""
+        version = catalog_cache.refresh(cursor)
+        etag = version_etag(f'v{version}', RESPONSE_FORMAT, cache_key)
+        if is_not_modified(event, etag):
+            return not_modified_response(etag, cache_control)
+        
+        cached = catalog_cache.get(cache_key, version)
+        if cached is not None:
+            return cached_response(event, cached, cache_control)
+        
+        if case_id is not None:
+            cursor.execute("""
                 SELECT c.*, 
                        json_agg(
                            json_build_object(
@@ -54,9 +106,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                        ) as items
                 FROM t_p36789279_gta_cases_portal.cases c
                 LEFT JOIN t_p36789279_gta_cases_portal.case_items ci ON c.id = ci.case_id
-                WHERE c.id = {case_id}
+                WHERE c.id = %s
                 GROUP BY c.id
-            """)
+            """, (case_id,))
             
             case = cursor.fetchone()
             if not case:
@@ -66,14 +118,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Case not found'})
                 }
             
-            result = dict(case)
-            result['price'] = float(result['price'])
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(result, default=str)
-            }
+            result = case
         else:
             cursor.execute("""
                 SELECT id, name, description, price, image_url, rarity, created_at
@@ -81,19 +126,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 ORDER BY price ASC
             """)
             
-            cases = cursor.fetchall()
-            result = []
-            for case in cases:
-                case_dict = dict(case)
-                case_dict['price'] = float(case_dict['price'])
-                result.append(case_dict)
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(result, default=str)
-            }
+            result = cursor.fetchall()
+        
+        cached = (etag, serializer.dumps(result))
+        catalog_cache.put(cache_key, version, cached)
+        
+        return cached_response(event, cached, cache_control)
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        db.release(conn)
+
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return await db_async.run(handler, event, context)
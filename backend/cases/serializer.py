@@ -0,0 +1,44 @@
+'''
+Business: Сериализация ответов в JSON с нативной поддержкой Decimal и datetime
+Args: строки из RealDictCursor и любые JSON-совместимые структуры
+Returns: dumps() — через orjson, если он установлен, иначе через стандартный json
+'''
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Optional
+
+from instrumentation import measure
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def encode_stdlib(obj: Any) -> str:
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def _encode_orjson(obj: Any) -> str:
+    return orjson.dumps(obj, default=_default).decode()
+
+
+encode_orjson: Optional[Callable[[Any], str]] = _encode_orjson if orjson is not None else None
+
+_encode: Callable[[Any], str] = encode_orjson or encode_stdlib
+
+
+def dumps(obj: Any) -> str:
+    with measure('serialize'):
+        return _encode(obj)
@@ -0,0 +1,50 @@
+'''
+Business: Кэш каталога кейсов в памяти тёплого контейнера, сбрасываемый по версии каталога
+Args: CATALOG_CACHE_TTL из окружения — сколько секунд доверять версии без запроса к БД
+Returns: lookup()/refresh()/get()/put() для готовых тел ответов и построенных по каталогу объектов
+'''
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '5'))
+
+_lock = threading.Lock()
+_version: Optional[int] = None
+_checked_at = 0.0
+_entries: Dict[str, Any] = {}
+
+
+def lookup(key: str) -> Optional[Any]:
+    with _lock:
+        if _version is None or time.monotonic() - _checked_at > CATALOG_CACHE_TTL:
+            return None
+        return _entries.get(key)
+
+
+def refresh(cursor) -> int:
+    global _version, _checked_at
+    cursor.execute("SELECT version FROM t_p36789279_gta_cases_portal.catalog_version WHERE id = 1")
+    row = cursor.fetchone()
+    version = int((row['version'] if isinstance(row, dict) else row[0]) if row else 0)
+
+    with _lock:
+        if version != _version:
+            _entries.clear()
+            _version = version
+        _checked_at = time.monotonic()
+    return version
+
+
+def get(key: str, version: int) -> Optional[Any]:
+    with _lock:
+        if version != _version:
+            return None
+        return _entries.get(key)
+
+
+def put(key: str, version: int, value: Any) -> None:
+    with _lock:
+        if version == _version:
+            _entries[key] = value
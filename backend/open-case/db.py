@@ -0,0 +1,252 @@
+'''
+Business: Пул соединений с PostgreSQL, живущий между тёплыми вызовами функции, и чтение с реплики
+Args: DATABASE_URL, DATABASE_URL_REPLICA, DB_POOL_SIZE, DB_HEALTHCHECK_INTERVAL, DB_REPLICA_LAG_CHECK_INTERVAL,
+      DB_REPLICA_RETRY_INTERVAL из окружения
+Returns: acquire()/release() для обработчиков, acquire_read() — соединение с репликой, если она отстаёт не больше
+         допустимого и уже применила записи клиента, иначе с мастером; write_position()/read_position() для
+         заголовка X-DB-Position и stats() со счётчиками пулов; внутри db_async.run() — асинхронные соединения
+'''
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import psycopg2
+from psycopg2 import extensions
+from instrumentation import InstrumentedConnection
+import db_async
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+HEALTHCHECK_INTERVAL = float(os.environ.get('DB_HEALTHCHECK_INTERVAL', '30'))
+REPLICA_CONFIGURED = bool(os.environ.get('DATABASE_URL_REPLICA'))
+LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK_INTERVAL', '1'))
+REPLICA_RETRY_INTERVAL = float(os.environ.get('DB_REPLICA_RETRY_INTERVAL', '30'))
+POSITION_HEADER = 'X-DB-Position'
+
+# Применённая до конца WAL реплика считается свежей, только пока walreceiver получает поток: без него
+# совпадение позиций ничего не говорит о мастере. Тогда отставание — возраст последней применённой
+# транзакции (без роли pg_read_all_stats статус не виден, и реплика без записей на мастере кажется старой)
+REPLICA_STATE_SQL = """
+    SELECT
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                 AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END AS lag,
+        (CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END)::text AS position
+"""
+
+
+class _Pool:
+    def __init__(self, url_variable: str):
+        self.url_variable = url_variable
+        self.lock = threading.Lock()
+        self.idle: List[Tuple[Any, float]] = []
+        self.counters: Dict[str, int] = {'hits': 0, 'misses': 0, 'reconnects': 0, 'discarded': 0}
+
+    def connect(self):
+        conn = psycopg2.connect(
+            os.environ.get(self.url_variable),
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
+            connection_factory=InstrumentedConnection
+        )
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, released_at = self.idle.pop()
+
+            if not _reset(conn) or (now - released_at > HEALTHCHECK_INTERVAL and not _ping(conn)):
+                _close_quietly(conn)
+                with self.lock:
+                    self.counters['reconnects'] += 1
+                continue
+
+            with self.lock:
+                self.counters['hits'] += 1
+            return conn
+
+        conn = self.connect()
+        with self.lock:
+            self.counters['misses'] += 1
+        _log_stats('db_pool_miss')
+        return conn
+
+    def release(self, conn) -> None:
+        if not _reset(conn):
+            _close_quietly(conn)
+            with self.lock:
+                self.counters['discarded'] += 1
+            return
+
+        with self.lock:
+            if len(self.idle) < POOL_SIZE:
+                self.idle.append((conn, time.monotonic()))
+                return
+            self.counters['discarded'] += 1
+        _close_quietly(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            result = dict(self.counters)
+            result['idle'] = len(self.idle)
+        return result
+
+
+_primary = _Pool('DATABASE_URL')
+_replica = _Pool('DATABASE_URL_REPLICA')
+
+_lock = threading.Lock()
+_routing: Dict[str, int] = {'replica_reads': 0, 'primary_fallbacks': 0, 'replica_errors': 0}
+_replica_state: Dict[str, float] = {'lag': float('inf'), 'position': 0, 'checked_at': float('-inf'), 'down_until': 0.0}
+
+
+def _close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _reset(conn) -> bool:
+    if conn.closed:
+        return False
+    status = conn.get_transaction_status()
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        if conn.autocommit:
+            conn.autocommit = False
+    except psycopg2.Error:
+        return False
+    return True
+
+
+def _ping(conn) -> bool:
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _log_stats(event: str) -> None:
+    print(json.dumps({'event': event, 'pool': stats()}), flush=True)
+
+
+def _lsn(value: str) -> int:
+    high, _, low = value.partition('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def acquire():
+    if db_async.bridged():
+        return db_async.acquire()
+    return _primary.acquire()
+
+
+def _fallback(reason: str):
+    with _lock:
+        _routing[reason] += 1
+    return acquire()
+
+
+def _replica_is_fresh(conn, max_staleness: float, position: Optional[int]) -> bool:
+    now = time.monotonic()
+    with _lock:
+        lag, replayed, checked_at = _replica_state['lag'], _replica_state['position'], _replica_state['checked_at']
+
+    if now - checked_at > LAG_CHECK_INTERVAL or (position is not None and replayed < position):
+        with conn.cursor() as cursor:
+            cursor.execute(REPLICA_STATE_SQL)
+            row = cursor.fetchone()
+        lag = float('inf') if row[0] is None else float(row[0])
+        replayed = _lsn(row[1]) if row[1] else 0
+        checked_at = now
+        with _lock:
+            _replica_state.update(lag=lag, position=replayed, checked_at=now)
+
+    # Пока отставание не перепроверено, реплика могла отстать ещё на время с последней проверки
+    if lag + (now - checked_at) > max_staleness:
+        return False
+    return position is None or replayed >= position
+
+
+def acquire_read(max_staleness: float, position: Optional[int] = None):
+    if not REPLICA_CONFIGURED:
+        return acquire()
+    with _lock:
+        down = time.monotonic() < _replica_state['down_until']
+    if down:
+        return _fallback('primary_fallbacks')
+
+    conn = None
+    try:
+        conn = db_async.acquire(replica=True) if db_async.bridged() else _replica.acquire()
+        fresh = _replica_is_fresh(conn, max_staleness, position)
+    except psycopg2.Error:
+        if conn is not None:
+            release(conn)
+        with _lock:
+            _replica_state['down_until'] = time.monotonic() + REPLICA_RETRY_INTERVAL
+        _log_stats('db_replica_unavailable')
+        return _fallback('replica_errors')
+
+    if not fresh:
+        release(conn)
+        return _fallback('primary_fallbacks')
+    with _lock:
+        _routing['replica_reads'] += 1
+    return conn
+
+
+def read_position(event: Dict[str, Any]) -> Optional[int]:
+    headers = event.get('headers') or {}
+    value = headers.get(POSITION_HEADER) or headers.get(POSITION_HEADER.lower())
+    try:
+        return _lsn(value) if value else None
+    except ValueError:
+        return None
+
+
+def write_position(conn) -> Dict[str, str]:
+    if not REPLICA_CONFIGURED:
+        return {}
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT pg_current_wal_insert_lsn()::text')
+        position = cursor.fetchone()[0]
+    return {POSITION_HEADER: position, 'Access-Control-Expose-Headers': POSITION_HEADER}
+
+
+def release(conn) -> None:
+    if conn is None:
+        return
+    if isinstance(conn, db_async.BridgedConnection):
+        db_async.release(conn)
+        return
+    getattr(conn, 'pool', _primary).release(conn)
+
+
+def stats() -> Dict[str, Any]:
+    result: Dict[str, Any] = _primary.stats()
+    if REPLICA_CONFIGURED:
+        with _lock:
+            result.update(_routing)
+            lag = _replica_state['lag']
+        result['replica_lag'] = None if lag == float('inf') else lag
+        result['replica'] = _replica.stats()
+    return result
@@ -1,38 +1,74 @@
 '''
 Business: Открытие кейса с генерацией промокода
-Args: event с httpMethod, body (JSON с user_id, case_id)
-Returns: HTTP response с выпавшим предметом и промокодом
+Args: event с httpMethod, headers (Authorization: Bearer <токен>, необязательный Idempotency-Key),
+      body (JSON с case_id и необязательным count — сколько раз открыть)
+Returns: HTTP response с выпавшими предметами, промокодами и новым балансом
 '''
 import json
-import os
-import random
-import string
-from typing import Dict, Any
-import psycopg2
+from typing import Dict, Any, Optional
 from psycopg2.extras import RealDictCursor
+import db
+import db_async
+from instrumentation import instrument
+from tokens import authenticate
+import serializer
+import catalog_cache
+from sampler import AliasSampler
+import promo_code
+import rate_limit
+import idempotency
 
-def generate_promo_code(length: int = 12) -> str:
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
+MAX_OPEN_COUNT = 100
 
-def select_item_by_chance(items: list) -> dict:
-    if not items:
-        raise ValueError('No items in case')
+OPEN_CASE_SQL = """
+    WITH c AS (
+        SELECT price FROM cases WHERE id = %(case_id)s
+    ), debit AS (
+        SELECT t_p36789279_gta_cases_portal.ledger_debit(
+            %(user_id)s, c.price * %(count)s, 'open_case', 'case', %(case_id)s
+        ) AS balance
+        FROM c
+    ), issued AS (
+        INSERT INTO promocodes (user_id, case_id, item_id, promo_code, item_name, item_rarity)
+        SELECT %(user_id)s, %(case_id)s, t.item_id, t.promo_code, t.item_name, t.item_rarity
+        FROM unnest(%(item_ids)s::int[], %(promo_codes)s::text[], %(item_names)s::text[], %(item_rarities)s::text[])
+             AS t(item_id, promo_code, item_name, item_rarity)
+        WHERE EXISTS (SELECT 1 FROM debit WHERE balance IS NOT NULL)
+        RETURNING id
+    )
+    SELECT
+        (SELECT balance FROM debit) AS new_balance,
+        EXISTS (SELECT 1 FROM c) AS case_exists,
+        EXISTS (SELECT 1 FROM users WHERE id = %(user_id)s) AS user_exists
+"""
+
+def get_case_sampler(case_id: int, cursor) -> Optional[AliasSampler]:
+    cache_key = f'sampler:{case_id}'
+    sampler = catalog_cache.lookup(cache_key)
+    if sampler is not None:
+        return sampler
     
-    total_chance = sum(float(item['drop_chance']) for item in items)
-    if total_chance <= 0:
-        return random.choice(items)
+    version = catalog_cache.refresh(cursor)
+    sampler = catalog_cache.get(cache_key, version)
+    if sampler is not None:
+        return sampler
     
-    rand_value = random.uniform(0, total_chance)
-    cumulative = 0
+    cursor.execute("""
+        SELECT id, name, description, rarity, drop_chance, image_url
+        FROM case_items
+        WHERE case_id = %s
+        ORDER BY id
+    """, (case_id,))
     
-    for item in items:
-        cumulative += float(item['drop_chance'])
-        if rand_value < cumulative:
-            return item
+    items = cursor.fetchall()
+    if not items:
+        return None
     
-    return items[-1]
+    sampler = AliasSampler([dict(item) for item in items])
+    catalog_cache.put(cache_key, version, sampler)
+    return sampler
 
+@instrument
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
     
@@ -42,7 +78,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-DB-Position, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -55,99 +91,153 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
+    claims = authenticate(event)
+    if not claims:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
     body_data = json.loads(event.get('body', '{}'))
-    user_id = body_data.get('user_id')
+    user_id = claims['user_id']
     case_id = body_data.get('case_id')
+    count = body_data.get('count', 1)
+    
+    if body_data.get('user_id') is not None and str(body_data['user_id']) != str(user_id):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Access denied'})
+        }
+    
+    if not case_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'case_id required'})
+        }
+    
+    try:
+        case_id = int(case_id)
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid case_id'})
+        }
+    
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_OPEN_COUNT:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'count must be an integer from 1 to {MAX_OPEN_COUNT}'})
+        }
     
-    if not user_id or not case_id:
+    try:
+        idempotency_key = idempotency.request_key(event, 'open_case', user_id, body_data)
+    except idempotency.IdempotencyKeyError as e:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'user_id and case_id required'})
+            'body': json.dumps({'error': str(e)})
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    limited = rate_limit.check('open_case', event, user_id)
+    if limited and not idempotency_key:
+        return limited
+    
+    conn = db.acquire()
+    # С Idempotency-Key списание и сохранённый ответ фиксируются одной транзакцией
+    conn.autocommit = idempotency_key is None
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        cursor.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        if not user:
+        limited = limited or rate_limit.check_shared(conn)
+        if limited:
+            # Повтор уже выполненного запроса получает сохранённый ответ и сверх лимита
+            return (idempotency_key and idempotency.replay(conn, idempotency_key)) or limited
+        
+        if idempotency_key:
+            replay = idempotency.claim(conn, idempotency_key)
+            if replay:
+                return replay
+        
+        sampler = get_case_sampler(case_id, cursor)
+        if sampler is None:
+            cursor.execute("SELECT 1 FROM cases WHERE id = %s", (case_id,))
+            case_exists = cursor.fetchone() is not None
+            return {
+                'statusCode': 400 if case_exists else 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Case has no items' if case_exists else 'Case not found'})
+            }
+        
+        won_items = sampler.sample_many(count)
+        promo_codes = promo_code.take(cursor, count)
+        
+        cursor.execute(OPEN_CASE_SQL, {
+            'user_id': user_id,
+            'case_id': case_id,
+            'count': count,
+            'item_ids': [item['id'] for item in won_items],
+            'item_names': [item['name'] for item in won_items],
+            'item_rarities': [item['rarity'] for item in won_items],
+            'promo_codes': promo_codes
+        })
+        outcome = cursor.fetchone()
+        
+        if not outcome['user_exists']:
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': 'User not found'})
             }
         
-        cursor.execute("SELECT price FROM cases WHERE id = %s", (case_id,))
-        case = cursor.fetchone()
-        if not case:
+        if not outcome['case_exists']:
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': 'Case not found'})
             }
         
-        balance = float(user['balance'])
-        price = float(case['price'])
-        
-        if balance < price:
+        if outcome['new_balance'] is None:
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': 'Insufficient balance'})
             }
         
-        cursor.execute("""
-            SELECT id, name, description, rarity, drop_chance, image_url
-            FROM case_items
-            WHERE case_id = %s
-        """, (case_id,))
+        new_balance = float(outcome['new_balance'])
         
-        items = cursor.fetchall()
-        if not items:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Case has no items'})
+        results = [
+            {
+                'item': {
+                    'id': item['id'],
+                    'name': item['name'],
+                    'description': item['description'],
+                    'rarity': item['rarity'],
+                    'image_url': item['image_url']
+                },
+                'promo_code': code
             }
+            for item, code in zip(won_items, promo_codes)
+        ]
         
-        won_item = select_item_by_chance(items)
-        promo_code = generate_promo_code()
-        
-        cursor.execute("""
-            INSERT INTO promocodes (user_id, case_id, item_id, promo_code, item_name)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id
-        """, (user_id, case_id, won_item['id'], promo_code, won_item['name']))
-        
-        cursor.execute("""
-            UPDATE users SET balance = balance - %s WHERE id = %s
-        """, (price, user_id))
-        
-        conn.commit()
+        if count == 1:
+            payload = {'success': True, **results[0], 'new_balance': new_balance}
+        else:
+            payload = {'success': True, 'results': results, 'new_balance': new_balance}
         
-        cursor.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
-        new_balance = float(cursor.fetchone()['balance'])
-        
-        return {
+        return idempotency.commit(conn, idempotency_key, {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'item': {
-                    'id': won_item['id'],
-                    'name': won_item['name'],
-                    'description': won_item['description'],
-                    'rarity': won_item['rarity'],
-                    'image_url': won_item['image_url']
-                },
-                'promo_code': promo_code,
-                'new_balance': new_balance
-            }, default=str)
-        }
+            'body': serializer.dumps(payload)
+        })
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        db.release(conn)
+
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return await db_async.run(handler, event, context)
@@ -0,0 +1,106 @@
+'''
+Business: Промокоды без коллизий — номер из последовательности promo_code_seq через ключевую перестановку Фейстеля
+Args: PROMO_CODE_SECRET из окружения (ключ перестановки, менять нельзя — иначе новые коды могут совпасть со старыми)
+Returns: take(cursor, count) — пачка кодов вида 'G' + 12 символов base36; encode()/decode() для проверок
+'''
+import hashlib
+import os
+import threading
+from typing import List, Optional
+
+PREFIX = 'G'
+CODE_LENGTH = 12
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+HALF_BITS = 31
+HALF_MASK = (1 << HALF_BITS) - 1
+MAX_NUMBER = (1 << (2 * HALF_BITS)) - 1
+ROUNDS = 4
+BLOCK_SIZE = 1000
+
+_lock = threading.Lock()
+_rounds: Optional[List['hashlib._Hash']] = None
+_next = 0
+_end = 0
+
+
+def _round_keys() -> List['hashlib._Hash']:
+    global _rounds
+    if _rounds is None:
+        secret = os.environ.get('PROMO_CODE_SECRET', '')
+        if not secret:
+            raise RuntimeError('PROMO_CODE_SECRET is not configured')
+        _rounds = [
+            hashlib.blake2b(digest_size=4, key=secret.encode()[:64], person=f'promo-r{i}'.encode())
+            for i in range(ROUNDS)
+        ]
+    return _rounds
+
+
+def _f(round_key: 'hashlib._Hash', half: int) -> int:
+    h = round_key.copy()
+    h.update(half.to_bytes(4, 'little'))
+    return int.from_bytes(h.digest(), 'little') & HALF_MASK
+
+
+def permute(number: int) -> int:
+    left, right = number >> HALF_BITS, number & HALF_MASK
+    for round_key in _round_keys():
+        left, right = right, left ^ _f(round_key, right)
+    return (left << HALF_BITS) | right
+
+
+def unpermute(value: int) -> int:
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_key in reversed(_round_keys()):
+        left, right = right ^ _f(round_key, left), left
+    return (left << HALF_BITS) | right
+
+
+def encode(number: int) -> str:
+    if not 0 <= number <= MAX_NUMBER:
+        raise ValueError('promo code number out of range')
+    value = permute(number)
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, 36)
+        chars.append(ALPHABET[digit])
+    return PREFIX + ''.join(reversed(chars))
+
+
+def decode(code: str) -> Optional[int]:
+    if len(code) != len(PREFIX) + CODE_LENGTH or not code.startswith(PREFIX):
+        return None
+    try:
+        value = int(code[len(PREFIX):], 36)
+    except ValueError:
+        return None
+    if value > MAX_NUMBER:
+        return None
+    return unpermute(value)
+
+
+def _reserve(cursor, count: int) -> List[int]:
+    global _next, _end
+    numbers: List[int] = []
+    while True:
+        with _lock:
+            taken = min(count - len(numbers), _end - _next)
+            numbers.extend(range(_next, _next + taken))
+            _next += taken
+        if len(numbers) == count:
+            return numbers
+
+        # Запрос идёт без блокировки: в асинхронном режиме на этом потоке ждут другие запросы
+        cursor.execute("SELECT nextval('promo_code_seq') AS block")
+        start = cursor.fetchone()['block'] * BLOCK_SIZE
+        taken = min(count - len(numbers), BLOCK_SIZE)
+        numbers.extend(range(start, start + taken))
+        with _lock:
+            if _end - _next < BLOCK_SIZE - taken:
+                _next, _end = start + taken, start + BLOCK_SIZE
+        if len(numbers) == count:
+            return numbers
+
+
+def take(cursor, count: int) -> List[str]:
+    return [encode(number) for number in _reserve(cursor, count)]
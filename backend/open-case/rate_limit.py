@@ -0,0 +1,169 @@
+'''
+Business: Ограничение частоты запросов — token bucket на пользователя и на IP для каждого действия
+Args: RATE_LIMITS ("действие.область=запросов_в_секунду/запас,..." поверх значений по умолчанию или "off"),
+      RATE_LIMIT_SHARED (0 — не сверяться с общими корзинами в PostgreSQL)
+Returns: check() — ответ 429 с Retry-After без обращения к БД или None; check_shared(conn) — списание
+         того же запроса из таблицы rate_limit_buckets, общей для всех экземпляров функции
+'''
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_LIMITS: Dict[str, Dict[str, Tuple[float, float]]] = {
+    'open_case': {'user': (2.0, 10), 'ip': (5.0, 30)},
+    'sell': {'user': (2.0, 10), 'ip': (5.0, 30)},
+    'list_market': {'user': (1.0, 10), 'ip': (5.0, 30)},
+    'buy_market': {'user': (2.0, 10), 'ip': (5.0, 30)},
+    'login': {'user': (0.2, 5), 'ip': (1.0, 10)},
+    'register': {'ip': (0.1, 3)}
+}
+SHARED = os.environ.get('RATE_LIMIT_SHARED', '1') != '0'
+MAX_LOCAL_KEYS = 10000
+PRUNE_EVERY = 1000
+
+SHARED_SQL = """
+    INSERT INTO t_p36789279_gta_cases_portal.rate_limit_buckets AS b (key, rate, burst, tokens, allowed, updated_at)
+    SELECT k.key, k.rate, k.burst, k.burst - 1, TRUE, clock_timestamp()
+    FROM unnest(%(keys)s::text[], %(rates)s::float8[], %(bursts)s::float8[]) AS k(key, rate, burst)
+    ON CONFLICT (key) DO UPDATE SET
+        rate = EXCLUDED.rate,
+        burst = EXCLUDED.burst,
+        tokens = CASE
+            WHEN LEAST(EXCLUDED.burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * EXCLUDED.rate) >= 1
+            THEN LEAST(EXCLUDED.burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * EXCLUDED.rate) - 1
+            ELSE LEAST(EXCLUDED.burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * EXCLUDED.rate)
+        END,
+        allowed = LEAST(EXCLUDED.burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * EXCLUDED.rate) >= 1,
+        updated_at = clock_timestamp()
+    RETURNING key, rate, tokens, allowed
+"""
+PRUNE_SQL = """
+    DELETE FROM t_p36789279_gta_cases_portal.rate_limit_buckets
+    WHERE updated_at < clock_timestamp() - INTERVAL '1 hour'
+"""
+
+
+def _load_limits() -> Optional[Dict[str, Dict[str, Tuple[float, float]]]]:
+    raw = os.environ.get('RATE_LIMITS', '').strip()
+    if raw == 'off':
+        return None
+    limits = {action: dict(scopes) for action, scopes in DEFAULT_LIMITS.items()}
+    for entry in raw.split(','):
+        name, sep, value = entry.strip().partition('=')
+        action, dot, scope = name.partition('.')
+        rate, slash, burst = value.partition('/')
+        if not sep or not dot or not slash:
+            continue
+        limits.setdefault(action, {})[scope] = (float(rate), float(burst))
+    return limits
+
+
+LIMITS = _load_limits()
+
+_lock = threading.Lock()
+_buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+_pending: ContextVar[Tuple[Tuple[str, float, float], ...]] = ContextVar('rate_limit_pending', default=())
+_shared_checks = 0
+
+
+def client_ip(event: Dict[str, Any]) -> Optional[str]:
+    return ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp') or None
+
+
+def too_many_requests(retry_after: float) -> Dict[str, Any]:
+    seconds = max(1, math.ceil(retry_after))
+    return {
+        'statusCode': 429,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Retry-After',
+            'Retry-After': str(seconds)
+        },
+        'body': json.dumps({'error': 'Too many requests', 'retry_after': seconds})
+    }
+
+
+def _take(key: str, rate: float, burst: float, now: float) -> float:
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = [burst, now]
+        if len(_buckets) > MAX_LOCAL_KEYS:
+            _buckets.popitem(last=False)
+    else:
+        _buckets.move_to_end(key)
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    if bucket[0] < 1:
+        return (1 - bucket[0]) / rate
+    bucket[0] -= 1
+    return 0.0
+
+
+def check(action: str, event: Dict[str, Any], user: Any = None) -> Optional[Dict[str, Any]]:
+    _pending.set(())
+    scopes = LIMITS.get(action) if LIMITS is not None else None
+    if not scopes:
+        return None
+
+    keys = []
+    if user is not None and 'user' in scopes:
+        keys.append((f'{action}:user:{user}',) + scopes['user'])
+    ip = client_ip(event)
+    if ip and 'ip' in scopes:
+        keys.append((f'{action}:ip:{ip}',) + scopes['ip'])
+
+    retry_after = 0.0
+    now = time.monotonic()
+    with _lock:
+        for key, rate, burst in keys:
+            retry_after = max(retry_after, _take(key, rate, burst, now))
+    if retry_after:
+        return too_many_requests(retry_after)
+    # Локальная корзина видит только свой экземпляр: клиент, разнесённый по N экземплярам, получил бы
+    # N-кратный лимит, поэтому каждый пропущенный запрос списывается и из общей корзины
+    if SHARED:
+        _pending.set(tuple(keys))
+    return None
+
+
+def check_shared(conn) -> Optional[Dict[str, Any]]:
+    global _shared_checks
+    pending = _pending.get()
+    if not pending:
+        return None
+    _pending.set(())
+
+    with _lock:
+        _shared_checks += 1
+        prune = _shared_checks % PRUNE_EVERY == 0
+    with conn.cursor() as cursor:
+        cursor.execute(SHARED_SQL, {
+            'keys': [key for key, _, _ in pending],
+            'rates': [rate for _, rate, _ in pending],
+            'bursts': [burst for _, _, burst in pending]
+        })
+        rows = cursor.fetchall()
+        if prune:
+            cursor.execute(PRUNE_SQL)
+    # Корзина общая для всех экземпляров — не держим её строку заблокированной до конца запроса
+    if not conn.autocommit:
+        conn.commit()
+
+    retry_after = 0.0
+    now = time.monotonic()
+    with _lock:
+        for key, rate, tokens, allowed in rows:
+            bucket = _buckets.get(key)
+            if bucket is not None and tokens < bucket[0]:
+                bucket[0], bucket[1] = tokens, now
+            if not allowed:
+                retry_after = max(retry_after, (1 - tokens) / rate)
+    if retry_after:
+        return too_many_requests(retry_after)
+    return None
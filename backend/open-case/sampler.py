@@ -0,0 +1,80 @@
+'''
+Business: Выбор предмета из кейса по drop_chance за O(1) методом алиасов Уолкера–Воуза
+Args: список предметов кейса (dict с drop_chance)
+Returns: AliasSampler с методами sample()/sample_many() и эталонный select_item_by_chance
+'''
+import random
+from decimal import Decimal
+from fractions import Fraction
+from typing import List, Dict, Any
+
+
+def select_item_by_chance(items: list) -> dict:
+    if not items:
+        raise ValueError('No items in case')
+
+    total_chance = sum(float(item['drop_chance']) for item in items)
+    if total_chance <= 0:
+        return random.choice(items)
+
+    rand_value = random.uniform(0, total_chance)
+    cumulative = 0
+
+    for item in items:
+        cumulative += float(item['drop_chance'])
+        if rand_value < cumulative:
+            return item
+
+    return items[-1]
+
+
+def _weight(value: Any) -> Fraction:
+    if value is None:
+        return Fraction(0)
+    weight = Fraction(value if isinstance(value, (int, Decimal, Fraction)) else Decimal(str(value)))
+    return weight if weight > 0 else Fraction(0)
+
+
+class AliasSampler:
+    def __init__(self, items: List[Dict[str, Any]]):
+        if not items:
+            raise ValueError('No items in case')
+
+        self.items = list(items)
+        n = len(self.items)
+        weights = [_weight(item['drop_chance']) for item in self.items]
+        total = sum(weights)
+        if total <= 0:
+            weights = [Fraction(1)] * n
+            total = Fraction(n)
+
+        scaled = [w * n for w in weights]
+        small = [i for i, s in enumerate(scaled) if s < total]
+        large = [i for i, s in enumerate(scaled) if s >= total]
+        prob = [1.0] * n
+        alias = list(range(n))
+
+        while small and large:
+            lo = small.pop()
+            hi = large.pop()
+            prob[lo] = float(scaled[lo] / total)
+            alias[lo] = hi
+            scaled[hi] -= total - scaled[lo]
+            if scaled[hi] < total:
+                small.append(hi)
+            else:
+                large.append(hi)
+
+        self.n = n
+        self.prob = prob
+        self.alias = alias
+
+    def sample(self, rng: random.Random = random) -> Dict[str, Any]:
+        u = rng.random() * self.n
+        i = min(int(u), self.n - 1)
+        if u - i < self.prob[i]:
+            return self.items[i]
+        return self.items[self.alias[i]]
+
+    def sample_many(self, count: int, rng: random.Random = random) -> List[Dict[str, Any]]:
+        return [self.sample(rng) for _ in range(count)]
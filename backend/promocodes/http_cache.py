@@ -0,0 +1,39 @@
+'''
+Business: Условные GET-запросы — строгие ETag, сравнение с If-None-Match и ответ 304
+Args: event с headers, версия содержимого или готовое тело ответа
+Returns: version_etag()/body_etag()/is_not_modified()/not_modified_response()
+'''
+import hashlib
+from typing import Dict, Any
+
+
+def version_etag(*parts: Any) -> str:
+    return '"' + '-'.join(str(p) for p in parts) + '"'
+
+
+def body_etag(body: str) -> str:
+    return '"' + hashlib.blake2b(body.encode(), digest_size=16).hexdigest() + '"'
+
+
+def is_not_modified(event: Dict[str, Any], etag: str) -> bool:
+    headers = event.get('headers') or {}
+    value = headers.get('If-None-Match') or headers.get('if-none-match')
+    if not value:
+        return False
+    for candidate in value.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+def cache_headers(etag: str, cache_control: str) -> Dict[str, str]:
+    return {'ETag': etag, 'Cache-Control': cache_control}
+
+
+def not_modified_response(etag: str, cache_control: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {'Access-Control-Allow-Origin': '*', **cache_headers(etag, cache_control)},
+        'body': ''
+    }
@@ -0,0 +1,166 @@
+'''
+Business: Заголовок Idempotency-Key для операций с деньгами — повтор запроса получает сохранённый ответ
+Args: IDEMPOTENCY_TTL (сколько секунд хранить ответ), IDEMPOTENCY_GC_INTERVAL (период фоновой очистки) из окружения
+Returns: request_key() — ключ из заголовка; claim() — None, если запрос выполняет этот вызов, иначе сохранённый
+         ответ (одновременный повтор ждёт завершения первого запроса); replay() — сохранённый ответ без захвата
+         ключа (для запросов сверх лимита частоты); commit() — фиксация транзакции вместе с ответом
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+import psycopg2
+import db
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+GC_INTERVAL = float(os.environ.get('IDEMPOTENCY_GC_INTERVAL', '300'))
+GC_BATCH = 1000
+
+# Пока транзакция владельца не завершилась, вставка того же ключа ждёт её на уникальном индексе.
+# Строка с истёкшим сроком, которую ещё не удалила очистка, занимается заново
+CLAIM_SQL = """
+    INSERT INTO t_p36789279_gta_cases_portal.idempotency_keys (key_hash, request_hash, expires_at)
+    VALUES (%(key_hash)s, %(request_hash)s, now() + make_interval(secs => %(ttl)s))
+    ON CONFLICT (key_hash) DO UPDATE SET
+        request_hash = EXCLUDED.request_hash,
+        status = NULL,
+        body = NULL,
+        expires_at = EXCLUDED.expires_at
+    WHERE idempotency_keys.expires_at < now()
+    RETURNING TRUE AS claimed
+"""
+STORED_SQL = """
+    SELECT request_hash, status, body
+    FROM t_p36789279_gta_cases_portal.idempotency_keys
+    WHERE key_hash = %(key_hash)s AND expires_at >= now()
+"""
+STORE_SQL = """
+    UPDATE t_p36789279_gta_cases_portal.idempotency_keys
+    SET status = %(status)s, body = %(body)s
+    WHERE key_hash = %(key_hash)s
+"""
+GC_SQL = """
+    DELETE FROM t_p36789279_gta_cases_portal.idempotency_keys
+    WHERE key_hash IN (
+        SELECT key_hash
+        FROM t_p36789279_gta_cases_portal.idempotency_keys
+        WHERE expires_at < now()
+        LIMIT %(batch)s
+        FOR UPDATE SKIP LOCKED
+    )
+"""
+
+
+class IdempotencyKeyError(ValueError):
+    pass
+
+
+class RequestKey(NamedTuple):
+    key_hash: bytes
+    request_hash: bytes
+
+
+_gc_lock = threading.Lock()
+_gc_started = False
+
+
+def _digest(value: str) -> bytes:
+    return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+
+def request_key(event: Dict[str, Any], scope: str, user_id: Any, body_data: Dict[str, Any]) -> Optional[RequestKey]:
+    headers = event.get('headers') or {}
+    key = headers.get(HEADER) or headers.get(HEADER.lower())
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyKeyError(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters')
+    return RequestKey(
+        key_hash=_digest(f'{scope}:{user_id}:{key}'),
+        request_hash=_digest(json.dumps(body_data, sort_keys=True, separators=(',', ':'), default=str))
+    )
+
+
+def claim(conn, key: RequestKey) -> Optional[Dict[str, Any]]:
+    _start_gc()
+    stored = None
+    while stored is None:
+        with conn.cursor() as cursor:
+            cursor.execute(CLAIM_SQL, {'key_hash': key.key_hash, 'request_hash': key.request_hash, 'ttl': TTL})
+            if cursor.fetchone():
+                return None
+            # Строка могла истечь или её удалила очистка между двумя запросами — тогда ключ занимается заново
+            cursor.execute(STORED_SQL, {'key_hash': key.key_hash})
+            stored = cursor.fetchone()
+    conn.rollback()
+    return _stored_response(conn, key, stored)
+
+
+def replay(conn, key: RequestKey) -> Optional[Dict[str, Any]]:
+    with conn.cursor() as cursor:
+        cursor.execute(STORED_SQL, {'key_hash': key.key_hash})
+        stored = cursor.fetchone()
+    if not conn.autocommit:
+        conn.rollback()
+    return _stored_response(conn, key, stored) if stored else None
+
+
+def _stored_response(conn, key: RequestKey, stored: Tuple[Any, int, str]) -> Dict[str, Any]:
+    request_hash, status, body = stored
+    if bytes(request_hash) != key.request_hash:
+        return {
+            'statusCode': 422,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'{HEADER} was already used with a different request'})
+        }
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Idempotent-Replayed': 'true',
+            **db.write_position(conn)
+        },
+        'body': body
+    }
+
+
+def commit(conn, key: Optional[RequestKey], response: Dict[str, Any]) -> Dict[str, Any]:
+    if key is not None:
+        with conn.cursor() as cursor:
+            cursor.execute(STORE_SQL, {'key_hash': key.key_hash, 'status': response['statusCode'], 'body': response['body']})
+    if not conn.autocommit:
+        conn.commit()
+    response['headers'].update(db.write_position(conn))
+    return response
+
+
+def _collect_garbage() -> None:
+    while True:
+        time.sleep(GC_INTERVAL)
+        conn = None
+        try:
+            conn = db.acquire()
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                deleted = GC_BATCH
+                while deleted == GC_BATCH:
+                    cursor.execute(GC_SQL, {'batch': GC_BATCH})
+                    deleted = cursor.rowcount
+        except psycopg2.Error as e:
+            print(json.dumps({'event': 'idempotency_gc_failed', 'error': str(e)}), flush=True)
+        finally:
+            db.release(conn)
+
+
+def _start_gc() -> None:
+    global _gc_started
+    with _gc_lock:
+        if _gc_started:
+            return
+        _gc_started = True
+    threading.Thread(target=_collect_garbage, name='idempotency-gc', daemon=True).start()
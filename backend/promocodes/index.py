@@ -1,14 +1,205 @@
 '''
 Business: Получение промокодов, продажа системе и маркетплейс между игроками
-Args: event с httpMethod, queryStringParameters или body с параметрами
+Args: event с httpMethod, queryStringParameters или body с параметрами;
+      action=market принимает limit, cursor, sort, rarity, min_price, max_price, q;
+      инвентарь принимает limit, cursor, is_used, rarity;
+      всё, кроме action=market, требует заголовок Authorization: Bearer <токен>;
+      продажа и buy_market принимают необязательный заголовок Idempotency-Key
 Returns: HTTP response с данными или результатом операции
 '''
 import json
-import os
-from typing import Dict, Any
-import psycopg2
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Any, Optional, Tuple
 from psycopg2.extras import RealDictCursor
+import db
+import db_async
+from instrumentation import instrument
+from tokens import authenticate
+import serializer
+import catalog_cache
+import rate_limit
+import idempotency
+from http_cache import body_etag, is_not_modified, cache_headers, not_modified_response
+from pagination import PaginationError, parse_limit, encode_cursor, decode_cursor, next_page_headers
 
+MARKET_SORTS = {
+    'newest': ('created_at', 'DESC', 'timestamp'),
+    'price_asc': ('price', 'ASC', 'numeric'),
+    'price_desc': ('price', 'DESC', 'numeric')
+}
+
+# Деньги списываются, только если промокод всё ещё у продавца и не использован: его строка
+# блокируется, поэтому одновременная продажа системе ждёт покупку или проверяется после неё
+BUY_MARKET_SQL = """
+    WITH promo AS (
+        SELECT id
+        FROM promocodes
+        WHERE id = %(promo_id)s AND user_id = %(seller_id)s AND is_used = FALSE
+        FOR UPDATE
+    ), debit AS (
+        SELECT t_p36789279_gta_cases_portal.ledger_debit(
+            %(buyer_id)s, %(price)s, 'market_buy', 'listing', %(market_id)s
+        ) AS balance
+        FROM promo
+    ), credit AS (
+        SELECT t_p36789279_gta_cases_portal.ledger_credit(
+            %(seller_id)s, %(price)s, 'market_sale', 'listing', %(market_id)s
+        ) AS balance
+        FROM debit
+        WHERE debit.balance IS NOT NULL
+    ), transfer AS (
+        UPDATE promocodes
+        SET user_id = %(buyer_id)s
+        WHERE id = %(promo_id)s AND user_id = %(seller_id)s AND is_used = FALSE AND EXISTS (SELECT 1 FROM credit)
+        RETURNING id
+    ), sold AS (
+        UPDATE marketplace
+        SET is_sold = TRUE, buyer_id = %(buyer_id)s, sold_at = CURRENT_TIMESTAMP
+        WHERE id = %(market_id)s AND EXISTS (SELECT 1 FROM credit)
+        RETURNING id
+    )
+    SELECT EXISTS (SELECT 1 FROM promo) AS promo_available, (SELECT balance FROM debit) AS new_balance
+"""
+
+SELL_PROMO_SQL = """
+    WITH used AS (
+        UPDATE promocodes
+        SET is_used = TRUE
+        WHERE id = %(promo_id)s AND user_id = %(user_id)s AND is_used = FALSE
+          AND NOT EXISTS (
+              SELECT 1 FROM marketplace m
+              WHERE m.promo_id = %(promo_id)s AND m.is_sold = FALSE
+          )
+        RETURNING id
+    )
+    SELECT t_p36789279_gta_cases_portal.ledger_credit(
+        %(user_id)s, %(amount)s, 'sell', 'promocode', used.id
+    ) AS new_balance
+    FROM used
+"""
+
+def build_market_query(params: Dict[str, Any]) -> Tuple[str, list, str, int]:
+    sort = params.get('sort') or 'newest'
+    if sort not in MARKET_SORTS:
+        raise PaginationError(f'sort must be one of: {", ".join(MARKET_SORTS)}')
+    column, direction, cast = MARKET_SORTS[sort]
+    limit = parse_limit(params.get('limit'))
+    
+    conditions = ['m.is_sold = FALSE']
+    args: list = []
+    
+    if params.get('rarity'):
+        conditions.append('m.item_rarity = %s')
+        args.append(params['rarity'])
+    if params.get('min_price'):
+        conditions.append('m.price >= %s')
+        args.append(Decimal(params['min_price']))
+    if params.get('max_price'):
+        conditions.append('m.price <= %s')
+        args.append(Decimal(params['max_price']))
+    if params.get('q'):
+        pattern = params['q'].lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append('lower(m.item_name) LIKE %s')
+        args.append(pattern + '%')
+    
+    after = decode_cursor(params.get('cursor'), (cast, 'int'))
+    if after:
+        conditions.append(f"(m.{column}, m.id) {'<' if direction == 'DESC' else '>'} (%s::{cast}, %s)")
+        args.extend(after)
+    
+    args.append(limit + 1)
+    sql = f"""
+        SELECT 
+            m.id,
+            m.price,
+            m.item_name,
+            m.item_rarity,
+            m.item_description,
+            m.created_at,
+            u.username as seller_name
+        FROM marketplace m
+        JOIN users u ON m.seller_id = u.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY m.{column} {direction}, m.id {direction}
+        LIMIT %s
+    """
+    return sql, args, column, limit
+
+INVENTORY_DEFAULT_LIMIT = 100
+
+def build_inventory_query(user_id: int, params: Dict[str, Any]) -> Tuple[str, list, int]:
+    limit = parse_limit(params.get('limit'), default=INVENTORY_DEFAULT_LIMIT)
+    conditions = ['p.user_id = %s']
+    args: list = [user_id]
+    
+    is_used = params.get('is_used')
+    if is_used:
+        if is_used not in ('true', 'false'):
+            raise PaginationError('is_used must be true or false')
+        conditions.append('p.is_used = %s')
+        args.append(is_used == 'true')
+    if params.get('rarity'):
+        conditions.append('p.item_rarity = %s')
+        args.append(params['rarity'])
+    
+    after = decode_cursor(params.get('cursor'), ('timestamp', 'int'))
+    if after:
+        conditions.append('(p.created_at, p.id) < (%s::timestamp, %s)')
+        args.extend(after)
+    
+    args.append(limit + 1)
+    sql = f"""
+        SELECT p.id, p.promo_code, p.item_name, p.is_used, p.created_at, p.item_rarity, p.case_id, p.item_id
+        FROM promocodes p
+        WHERE {' AND '.join(conditions)}
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT %s
+    """
+    return sql, args, limit
+
+def get_catalog_lookup(cursor) -> Dict[str, Dict[int, Tuple[Any, Any]]]:
+    lookup = catalog_cache.lookup('lookup')
+    if lookup is not None:
+        return lookup
+    
+    version = catalog_cache.refresh(cursor)
+    lookup = catalog_cache.get('lookup', version)
+    if lookup is not None:
+        return lookup
+    
+    cursor.execute("SELECT id, name, price FROM cases")
+    cases = {row['id']: (row['name'], float(row['price'])) for row in cursor.fetchall()}
+    cursor.execute("SELECT id, rarity, description FROM case_items")
+    items = {row['id']: (row['rarity'], row['description']) for row in cursor.fetchall()}
+    
+    lookup = {'cases': cases, 'items': items}
+    catalog_cache.put('lookup', version, lookup)
+    return lookup
+
+MARKET_CACHE_CONTROL = 'public, no-cache'
+INVENTORY_CACHE_CONTROL = 'private, no-cache'
+MARKET_MAX_STALENESS = 5.0
+INVENTORY_MAX_STALENESS = 2.0
+
+def page_response(event: Dict[str, Any], rows: list, next_cursor: Optional[str], cache_control: str) -> Dict[str, Any]:
+    body = serializer.dumps(rows)
+    etag = body_etag(body)
+    if is_not_modified(event, etag):
+        response = not_modified_response(etag, cache_control)
+        response['headers'].update(next_page_headers(next_cursor))
+        return response
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            **cache_headers(etag, cache_control),
+            **next_page_headers(next_cursor)
+        },
+        'body': body
+    }
+
+@instrument
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,34 +209,89 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match, X-DB-Position, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    params = event.get('queryStringParameters', {}) or {}
+    body_data = json.loads(event.get('body') or '{}') if method in ('POST', 'PUT') else {}
+    is_public = method == 'GET' and params.get('action') == 'market'
+    claims = None if is_public else authenticate(event)
+    
+    if not is_public and not claims:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
+    requested_user_id = body_data.get('user_id', params.get('user_id'))
+    if claims and requested_user_id is not None and str(requested_user_id) != str(claims['user_id']):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Access denied'})
+        }
+    
+    idempotency_key = None
+    if method == 'POST' or (method == 'PUT' and body_data.get('action') == 'buy_market'):
+        try:
+            idempotency_key = idempotency.request_key(
+                event, 'sell' if method == 'POST' else 'buy_market', claims['user_id'], body_data
+            )
+        except idempotency.IdempotencyKeyError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)})
+            }
+    
+    limited = None
+    if method in ('POST', 'PUT'):
+        limited = rate_limit.check('sell' if method == 'POST' else body_data.get('action'), event, claims['user_id'])
+        if limited and not idempotency_key:
+            return limited
+    
+    if method == 'GET':
+        max_staleness = MARKET_MAX_STALENESS if is_public else INVENTORY_MAX_STALENESS
+        conn = db.acquire_read(max_staleness, db.read_position(event))
+    else:
+        conn = db.acquire()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
+        if method != 'GET':
+            limited = limited or rate_limit.check_shared(conn)
+            if limited:
+                # Повтор уже выполненного запроса получает сохранённый ответ и сверх лимита
+                return (idempotency_key and idempotency.replay(conn, idempotency_key)) or limited
+        
+        if idempotency_key:
+            replay = idempotency.claim(conn, idempotency_key)
+            if replay:
+                return replay
+        
         if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
             promo_id = body_data.get('promo_id')
-            user_id = body_data.get('user_id')
+            user_id = claims['user_id']
             
-            if not promo_id or not user_id:
+            if not promo_id:
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'promo_id and user_id required'})
+                    'body': json.dumps({'error': 'promo_id required'})
                 }
             
+            # Блокировка строки промокода: выставить его на рынок, пока идёт продажа, нельзя,
+            # а проверка лота в SELL_PROMO_SQL увидит лот, выставленный до блокировки
             cursor.execute("""
                 SELECT p.id, p.user_id, p.is_used, c.price
                 FROM promocodes p
                 JOIN cases c ON p.case_id = c.id
                 WHERE p.id = %s
+                FOR UPDATE OF p
             """, (promo_id,))
             
             promo = cursor.fetchone()
@@ -73,14 +319,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             sell_price = float(promo['price']) * 0.5
             
-            cursor.execute("UPDATE users SET balance = balance + %s WHERE id = %s", (sell_price, user_id))
-            cursor.execute("UPDATE promocodes SET is_used = TRUE WHERE id = %s", (promo_id,))
-            conn.commit()
-            
-            cursor.execute("SELECT balance FROM users WHERE id = %s", (user_id,))
-            new_balance = float(cursor.fetchone()['balance'])
+            cursor.execute(SELL_PROMO_SQL, {'promo_id': promo_id, 'user_id': user_id, 'amount': sell_price})
+            sold = cursor.fetchone()
+            if not sold:
+                conn.rollback()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Promocode is listed on the market; cancel the listing first'})
+                }
+            new_balance = float(sold['new_balance'])
             
-            return {
+            return idempotency.commit(conn, idempotency_key, {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
@@ -88,15 +338,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'sold_for': sell_price,
                     'new_balance': new_balance
                 })
-            }
+            })
         
         elif method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
             
             if action == 'list_market':
                 promo_id = body_data.get('promo_id')
-                seller_id = body_data.get('user_id')
+                seller_id = claims['user_id']
                 price = body_data.get('price')
                 
                 if not all([promo_id, seller_id, price]):
@@ -111,6 +360,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     FROM promocodes p
                     LEFT JOIN case_items ci ON p.item_id = ci.id
                     WHERE p.id = %s
+                    FOR UPDATE OF p
                 """, (promo_id,))
                 
                 promo = cursor.fetchone()
@@ -121,6 +371,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Invalid promocode'})
                     }
                 
+                cursor.execute(
+                    "SELECT 1 FROM marketplace WHERE promo_id = %s AND is_sold = FALSE",
+                    (promo_id,)
+                )
+                if cursor.fetchone():
+                    conn.rollback()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Promocode already listed'})
+                    }
+                
                 cursor.execute("""
                     INSERT INTO marketplace (seller_id, promo_id, price, item_name, item_rarity, item_description)
                     VALUES (%s, %s, %s, %s, %s, %s)
@@ -128,26 +390,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 """, (seller_id, promo_id, price, promo['name'], promo['rarity'], promo['description']))
                 
                 conn.commit()
+                position = db.write_position(conn)
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **position},
                     'body': json.dumps({'success': True})
                 }
             
             elif action == 'buy_market':
                 market_id = body_data.get('market_id')
-                buyer_id = body_data.get('user_id')
+                buyer_id = claims['user_id']
                 
                 cursor.execute("""
-                    SELECT m.seller_id, m.promo_id, m.price, m.is_sold, u.balance
-                    FROM marketplace m
-                    JOIN users u ON u.id = %s
-                    WHERE m.id = %s AND m.is_sold = FALSE
-                """, (buyer_id, market_id))
+                    SELECT seller_id, promo_id, price
+                    FROM marketplace
+                    WHERE id = %s AND is_sold = FALSE
+                    FOR UPDATE SKIP LOCKED
+                """, (market_id,))
                 
                 market = cursor.fetchone()
                 if not market:
+                    cursor.execute("SELECT is_sold FROM marketplace WHERE id = %s", (market_id,))
+                    listing = cursor.fetchone()
+                    conn.rollback()
+                    if listing and not listing['is_sold']:
+                        return {
+                            'statusCode': 409,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Item is being bought by another user'})
+                        }
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -155,34 +427,44 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 if market['seller_id'] == buyer_id:
+                    conn.rollback()
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'body': json.dumps({'error': 'Cannot buy your own item'})
                     }
                 
-                if float(market['balance']) < float(market['price']):
+                cursor.execute(BUY_MARKET_SQL, {
+                    'market_id': market_id,
+                    'buyer_id': buyer_id,
+                    'seller_id': market['seller_id'],
+                    'promo_id': market['promo_id'],
+                    'price': market['price']
+                })
+                
+                outcome = cursor.fetchone()
+                if not outcome['promo_available']:
+                    conn.rollback()
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Insufficient balance'})
+                        'body': json.dumps({'error': 'Item not available'})
                     }
                 
-                cursor.execute("UPDATE users SET balance = balance - %s WHERE id = %s", (market['price'], buyer_id))
-                cursor.execute("UPDATE users SET balance = balance + %s WHERE id = %s", (market['price'], market['seller_id']))
-                cursor.execute("UPDATE promocodes SET user_id = %s WHERE id = %s", (buyer_id, market['promo_id']))
-                cursor.execute("UPDATE marketplace SET is_sold = TRUE, buyer_id = %s, sold_at = CURRENT_TIMESTAMP WHERE id = %s", (buyer_id, market_id))
-                
-                conn.commit()
-                
-                cursor.execute("SELECT balance FROM users WHERE id = %s", (buyer_id,))
-                new_balance = float(cursor.fetchone()['balance'])
+                new_balance = outcome['new_balance']
+                if new_balance is None:
+                    conn.rollback()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Insufficient balance'})
+                    }
                 
-                return {
+                return idempotency.commit(conn, idempotency_key, {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'new_balance': new_balance})
-                }
+                    'body': json.dumps({'success': True, 'new_balance': float(new_balance)})
+                })
         
         elif method != 'GET':
             return {
@@ -191,77 +473,67 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Method not allowed'})
             }
         
-        params = event.get('queryStringParameters', {}) or {}
         action = params.get('action')
         
         if action == 'market':
-            cursor.execute("""
-                SELECT 
-                    m.id,
-                    m.price,
-                    m.item_name,
-                    m.item_rarity,
-                    m.item_description,
-                    m.created_at,
-                    u.username as seller_name
-                FROM marketplace m
-                JOIN users u ON m.seller_id = u.id
-                WHERE m.is_sold = FALSE
-                ORDER BY m.created_at DESC
-            """)
+            try:
+                sql, args, sort_column, limit = build_market_query(params)
+            except (PaginationError, InvalidOperation) as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e) if isinstance(e, PaginationError) else 'Invalid price filter'})
+                }
             
-            items = []
-            for item in cursor.fetchall():
-                item_dict = dict(item)
-                item_dict['price'] = float(item_dict['price'])
-                items.append(item_dict)
+            cursor.execute(sql, args)
+            rows = cursor.fetchall()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor([rows[-1][sort_column], rows[-1]['id']])
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(items, default=str)
-            }
+            return page_response(event, rows, next_cursor, MARKET_CACHE_CONTROL)
         
-        user_id = params.get('user_id')
+        user_id = claims['user_id']
         
-        if not user_id:
+        try:
+            sql, args, limit = build_inventory_query(user_id, params)
+        except PaginationError as e:
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id required'})
+                'body': json.dumps({'error': str(e)})
             }
         
-        cursor.execute("""
-            SELECT 
-                p.id,
-                p.promo_code,
-                p.item_name,
-                p.is_used,
-                p.created_at,
-                ci.rarity,
-                ci.description,
-                c.name as case_name,
-                c.price as case_price
-            FROM promocodes p
-            LEFT JOIN case_items ci ON p.item_id = ci.id
-            LEFT JOIN cases c ON p.case_id = c.id
-            WHERE p.user_id = %s
-            ORDER BY p.created_at DESC
-        """, (user_id,))
-        
+        cursor.execute(sql, args)
         promocodes = cursor.fetchall()
+        next_cursor = None
+        if len(promocodes) > limit:
+            promocodes = promocodes[:limit]
+            next_cursor = encode_cursor([promocodes[-1]['created_at'], promocodes[-1]['id']])
+        
+        lookup = get_catalog_lookup(cursor)
         result = []
         for promo in promocodes:
-            promo_dict = dict(promo)
-            promo_dict['case_price'] = float(promo_dict['case_price']) if promo_dict['case_price'] else 0
-            result.append(promo_dict)
+            case_name, case_price = lookup['cases'].get(promo['case_id'], (None, None))
+            item_rarity, item_description = lookup['items'].get(promo['item_id'], (None, None))
+            result.append({
+                'id': promo['id'],
+                'promo_code': promo['promo_code'],
+                'item_name': promo['item_name'],
+                'is_used': promo['is_used'],
+                'created_at': promo['created_at'],
+                'rarity': promo['item_rarity'] or item_rarity,
+                'description': item_description,
+                'case_name': case_name,
+                'case_price': case_price or 0
+            })
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(result, default=str)
-        }
+        return page_response(event, result, next_cursor, INVENTORY_CACHE_CONTROL)
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        db.release(conn)
+
+async def handler_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return await db_async.run(handler, event, context)
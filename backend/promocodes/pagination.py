@@ -0,0 +1,71 @@
+'''
+Business: Курсорная (keyset) пагинация списков — разбор limit и кодирование курсора
+Args: значения ключа сортировки последней строки страницы и параметры запроса
+Returns: encode_cursor()/decode_cursor()/parse_limit() и заголовки ответа со ссылкой на следующую страницу
+'''
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def parse_limit(value: Optional[str], default: int = DEFAULT_LIMIT, maximum: int = MAX_LIMIT) -> int:
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if not 1 <= limit <= maximum:
+        raise PaginationError(f'limit must be from 1 to {maximum}')
+    return limit
+
+
+def encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps([str(v) if not isinstance(v, int) else v for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _parse_value(value: Any, kind: str) -> Any:
+    if kind == 'int':
+        if isinstance(value, bool) or not isinstance(value, int) or abs(value) >= 2 ** 63:
+            raise ValueError(value)
+        return value
+    if not isinstance(value, str):
+        raise ValueError(value)
+    if kind == 'timestamp':
+        return datetime.fromisoformat(value)
+    if kind == 'numeric':
+        number = Decimal(value)
+        if not number.is_finite():
+            raise ValueError(value)
+        return number
+    return value
+
+
+def decode_cursor(cursor: Optional[str], kinds: Sequence[str]) -> Optional[List[Any]]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(kinds):
+            raise ValueError(values)
+        return [_parse_value(value, kind) for value, kind in zip(values, kinds)]
+    except (ValueError, TypeError, InvalidOperation):
+        raise PaginationError('Invalid cursor')
+
+
+def next_page_headers(next_cursor: Optional[str]) -> Dict[str, str]:
+    headers = {'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    return headers
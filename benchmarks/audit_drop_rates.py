@@ -0,0 +1,236 @@
+'''
+Business: Аудит шансов выпадения — десятки миллионов выборок на кейс через NumPy, хи-квадрат, матожидание и маржа
+Args: DATABASE_URL из окружения, --draws, --sampler (alias — как в open-case, reference — select_item_by_chance), --alpha, --seed, --json
+Returns: наблюдаемые и заявленные частоты по предметам, p-значение хи-квадрат, EV и house edge по выкупу (50%)
+         и по медианным ценам маркетплейса, флаги кейсов с суммой drop_chance не равной 100
+'''
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'open-case'))
+
+from sampler import AliasSampler
+
+SELL_BACK_RATE = 0.5
+CHUNK = 5_000_000
+
+
+def gamma_q(a: float, x: float) -> float:
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1.0 / a
+        n = a
+        for _ in range(1000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    b = x + 1 - a
+    c = 1 / 1e-300
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = 1e-300 if abs(d) < 1e-300 else d
+        c = b + an / c
+        c = 1e-300 if abs(c) < 1e-300 else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * h
+
+
+def chi_square(observed: np.ndarray, expected: np.ndarray) -> Dict[str, Any]:
+    possible = expected > 0
+    impossible_draws = int(observed[~possible].sum())
+    stat = float((((observed[possible] - expected[possible]) ** 2) / expected[possible]).sum())
+    df = int(possible.sum()) - 1
+    p_value = 0.0 if impossible_draws else (gamma_q(df / 2, stat / 2) if df > 0 else 1.0)
+    return {'chi2': round(stat, 3), 'df': df, 'p_value': p_value, 'impossible_draws': impossible_draws}
+
+
+def draw_alias(items: List[Dict[str, Any]], draws: int, rng: np.random.Generator) -> np.ndarray:
+    sampler = AliasSampler(items)
+    prob = np.asarray(sampler.prob)
+    alias = np.asarray(sampler.alias)
+    n = sampler.n
+    counts = np.zeros(n, dtype=np.int64)
+    for start in range(0, draws, CHUNK):
+        u = rng.random(min(CHUNK, draws - start)) * n
+        i = np.minimum(u.astype(np.int64), n - 1)
+        picked = np.where(u - i < prob[i], i, alias[i])
+        counts += np.bincount(picked, minlength=n)
+    return counts
+
+
+def draw_reference(items: List[Dict[str, Any]], draws: int, rng: np.random.Generator) -> np.ndarray:
+    weights = np.asarray([float(item['drop_chance']) for item in items])
+    total = weights.sum()
+    n = len(items)
+    counts = np.zeros(n, dtype=np.int64)
+    cumulative = np.cumsum(weights)
+    for start in range(0, draws, CHUNK):
+        size = min(CHUNK, draws - start)
+        if total <= 0:
+            picked = rng.integers(0, n, size)
+        else:
+            picked = np.minimum(np.searchsorted(cumulative, rng.uniform(0, total, size), side='right'), n - 1)
+        counts += np.bincount(picked, minlength=n)
+    return counts
+
+
+SAMPLERS = {'alias': draw_alias, 'reference': draw_reference}
+
+
+def market_values(cursor) -> Dict[int, float]:
+    cursor.execute("""
+        SELECT p.item_id, percentile_cont(0.5) WITHIN GROUP (ORDER BY m.price) AS median_price
+        FROM marketplace m
+        JOIN promocodes p ON p.id = m.promo_id
+        WHERE m.is_sold = TRUE
+        GROUP BY p.item_id
+    """)
+    return {row['item_id']: float(row['median_price']) for row in cursor.fetchall()}
+
+
+def audit_case(case: Dict[str, Any], items: List[Dict[str, Any]], values: Dict[int, float],
+               args, rng: np.random.Generator) -> Dict[str, Any]:
+    declared_sum = sum((Decimal(item['drop_chance'] or 0) for item in items), Decimal(0))
+    weights = np.asarray([max(float(item['drop_chance'] or 0), 0.0) for item in items])
+    effective = weights / weights.sum() if weights.sum() > 0 else np.full(len(items), 1 / len(items))
+
+    started = time.perf_counter()
+    counts = SAMPLERS[args.sampler](items, args.draws, rng)
+    elapsed = time.perf_counter() - started
+    observed = counts / args.draws
+    test = chi_square(counts.astype(float), effective * args.draws)
+
+    price = float(case['price'])
+    priced = [i for i, item in enumerate(items) if item['id'] in values]
+    coverage = float(effective[priced].sum()) if priced else 0.0
+    market_ev: Optional[float] = None
+    if priced:
+        market_ev = float(sum(effective[i] * values[items[i]['id']] for i in priced) / coverage)
+
+    flags = []
+    if declared_sum != 100:
+        flags.append(f'drop_chance sums to {declared_sum}, not 100')
+    if test['p_value'] < args.alpha:
+        flags.append(f"observed frequencies differ from drop_chance (p={test['p_value']:.2e})")
+    if test['impossible_draws']:
+        flags.append(f"{test['impossible_draws']} draws of zero-chance items")
+
+    return {
+        'case_id': case['id'],
+        'name': case['name'],
+        'price': price,
+        'draws': args.draws,
+        'draw_seconds': round(elapsed, 3),
+        'declared_sum': str(declared_sum),
+        'chi_square': test,
+        'sell_back_ev': price * SELL_BACK_RATE,
+        'sell_back_house_edge': 1 - SELL_BACK_RATE,
+        'market_ev': market_ev,
+        'market_house_edge': (1 - market_ev / price) if market_ev is not None and price else None,
+        'market_coverage': round(coverage, 4),
+        'items': [
+            {
+                'id': item['id'],
+                'name': item['name'],
+                'rarity': item['rarity'],
+                'declared_pct': float(item['drop_chance'] or 0),
+                'effective_pct': round(float(effective[i]) * 100, 6),
+                'observed_pct': round(float(observed[i]) * 100, 6),
+                'market_value': values.get(item['id'])
+            }
+            for i, item in enumerate(items)
+        ],
+        'flags': flags
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n#{report['case_id']} {report['name']}  price={report['price']:.2f}  "
+          f"draws={report['draws']:,} in {report['draw_seconds']:.2f}s")
+    print(f"  {'item':<32} {'declared%':>10} {'effective%':>11} {'observed%':>11} {'value':>9}")
+    for item in report['items']:
+        value = '-' if item['market_value'] is None else f"{item['market_value']:.2f}"
+        print(f"  {item['name'][:32]:<32} {item['declared_pct']:>10.4f} {item['effective_pct']:>11.4f} "
+              f"{item['observed_pct']:>11.4f} {value:>9}")
+    test = report['chi_square']
+    print(f"  chi2={test['chi2']} df={test['df']} p={test['p_value']:.4g}")
+    print(f"  sell-back EV={report['sell_back_ev']:.2f} house edge={report['sell_back_house_edge']:.1%}")
+    if report['market_ev'] is not None:
+        print(f"  market EV={report['market_ev']:.2f} house edge={report['market_house_edge']:.1%} "
+              f"(priced items cover {report['market_coverage']:.1%} of drops)")
+    for flag in report['flags']:
+        print(f'  FLAG {flag}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--draws', type=int, default=20_000_000, help='выборок на кейс')
+    parser.add_argument('--sampler', choices=list(SAMPLERS), default='alias')
+    parser.add_argument('--alpha', type=float, default=0.001, help='порог p-значения для флага')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--case-id', type=int, action='append', help='только эти кейсы')
+    parser.add_argument('--json', help='сохранить отчёт в JSON')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("SELECT id, name, price FROM cases ORDER BY id")
+    cases = [c for c in cursor.fetchall() if not args.case_id or c['id'] in args.case_id]
+    cursor.execute("""
+        SELECT id, case_id, name, rarity, drop_chance
+        FROM case_items
+        ORDER BY case_id, id
+    """)
+    items_by_case: Dict[int, List[Dict[str, Any]]] = {}
+    for item in cursor.fetchall():
+        items_by_case.setdefault(item['case_id'], []).append(dict(item))
+    values = market_values(cursor)
+    conn.close()
+
+    rng = np.random.default_rng(args.seed)
+    reports = []
+    for case in cases:
+        items = items_by_case.get(case['id'])
+        if not items:
+            print(f"\n#{case['id']} {case['name']}\n  FLAG case has no items")
+            reports.append({'case_id': case['id'], 'name': case['name'], 'flags': ['case has no items']})
+            continue
+        report = audit_case(case, items, values, args, rng)
+        print_report(report)
+        reports.append(report)
+
+    flagged = [r for r in reports if r['flags']]
+    print(f'\n{len(reports)} cases audited, {len(flagged)} flagged')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'sampler': args.sampler, 'seed': args.seed, 'cases': reports}, f, indent=2, ensure_ascii=False)
+
+    if flagged:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+'''
+Business: Повторы открытия кейса с Idempotency-Key — сохранённый ответ, 422 при другом теле, одновременные дубли, повтор сверх лимита
+Args: DATABASE_URL из окружения, --duplicates, --replays, --case-id
+Returns: задержка и число запросов к БД у первого запроса и у повтора, проверка, что каждый ключ списал деньги один раз
+'''
+import argparse
+import os
+import re
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from functions import auth_headers, load_handler, make_event, percentile
+
+SERVER_TIMING_QUERIES = re.compile(r'(?:^|,)\s*db;[^,]*desc="(\d+) queries"')
+
+
+def queries(response) -> int:
+    match = SERVER_TIMING_QUERIES.search(response['headers'].get('Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duplicates', type=int, default=16, help='сколько одинаковых запросов отправить одновременно')
+    parser.add_argument('--replays', type=int, default=50, help='сколько повторов замерить')
+    parser.add_argument('--case-id', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='не удалять тестовых пользователей')
+    args = parser.parse_args()
+
+    dsn = os.environ['DATABASE_URL']
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT price FROM cases WHERE id = %s", (args.case_id,))
+    price = cursor.fetchone()[0]
+    start_balance = price * 10
+
+    def create_user() -> int:
+        username = f'bench_{uuid.uuid4().hex[:12]}'
+        cursor.execute(
+            "INSERT INTO users (username, password_hash, email, balance) VALUES (%s, 'x', %s, %s) RETURNING id",
+            (username, f'{username}@bench.local', start_balance)
+        )
+        return cursor.fetchone()[0]
+
+    def charged(user_id: int) -> int:
+        cursor.execute("SELECT COUNT(*) FROM promocodes WHERE user_id = %s", (user_id,))
+        return cursor.fetchone()[0]
+
+    # Запас корзины покрывает замер повторов и одновременные дубли, а последняя проверка его исчерпывает
+    burst = max(args.duplicates, args.replays) + 4
+    os.environ['RATE_LIMITS'] = f'open_case.user=0.001/{burst}'
+    os.environ.setdefault('DB_POOL_SIZE', str(args.duplicates))
+    handler = load_handler('open-case')
+    body = {'case_id': args.case_id}
+
+    def open_case(user_id: int, key: str, request_body=body):
+        headers = {**auth_headers(user_id), 'Idempotency-Key': key}
+        started = time.perf_counter()
+        response = handler(make_event('POST', request_body, headers=headers), None)
+        return time.perf_counter() - started, response
+
+    users = []
+
+    # 1. Повтор получает тот же ответ без второго списания
+    user_id = create_user()
+    users.append(user_id)
+    key = uuid.uuid4().hex
+    original_time, original = open_case(user_id, key)
+    replays = [open_case(user_id, key) for _ in range(args.replays)]
+    replay_times = [elapsed for elapsed, _ in replays]
+    replayed = all(
+        r['statusCode'] == original['statusCode'] and r['body'] == original['body']
+        and r['headers'].get('Idempotent-Replayed') == 'true'
+        for _, r in replays
+    )
+    replay_charged = charged(user_id)
+
+    # 2. Тот же ключ с другим телом
+    _, mismatch = open_case(user_id, key, {'case_id': args.case_id, 'count': 2})
+    mismatch_charged = charged(user_id)
+
+    # 3. Одновременные дубли ждут первого запроса и получают его ответ
+    user_id = create_user()
+    users.append(user_id)
+    key = uuid.uuid4().hex
+    with ThreadPoolExecutor(max_workers=args.duplicates) as pool:
+        duplicates = list(pool.map(lambda _: open_case(user_id, key)[1], range(args.duplicates)))
+    duplicate_bodies = {r['body'] for r in duplicates}
+    duplicate_replays = sum(1 for r in duplicates if r['headers'].get('Idempotent-Replayed') == 'true')
+    duplicate_charged = charged(user_id)
+
+    # 4. Повтор сверх лимита частоты всё равно получает сохранённый ответ, а новый ключ — 429
+    user_id = create_user()
+    users.append(user_id)
+    key = uuid.uuid4().hex
+    _, first = open_case(user_id, key)
+    limited_replays = [open_case(user_id, key)[1] for _ in range(burst + 2)]
+    _, fresh = open_case(user_id, uuid.uuid4().hex)
+    limited_charged = charged(user_id)
+
+    cursor.execute("SELECT COUNT(*) FROM verify_balances() WHERE user_id = ANY(%s)", (users,))
+    ledger_problems = cursor.fetchone()[0]
+
+    print(f'original: {original_time * 1000:.1f} ms, {queries(original)} queries')
+    print(
+        f'replay: p50={percentile(replay_times, 50) * 1000:.1f} ms p95={percentile(replay_times, 95) * 1000:.1f} ms, '
+        f'{queries(replays[0][1])} queries'
+    )
+    print(f'duplicates={args.duplicates} replayed={duplicate_replays} distinct_bodies={len(duplicate_bodies)}')
+
+    checks = {
+        'first request succeeds': original['statusCode'] == 200,
+        'replay returns the stored response': replayed,
+        'replays do not charge again': replay_charged == 1,
+        'different body with the same key gets 422': mismatch['statusCode'] == 422 and mismatch_charged == 1,
+        'concurrent duplicates charge once': duplicate_charged == 1,
+        'concurrent duplicates get the same response': len(duplicate_bodies) == 1 and duplicates[0]['statusCode'] == 200,
+        'concurrent duplicates are marked as replays': duplicate_replays == args.duplicates - 1,
+        'replay over the rate limit gets the stored response': first['statusCode'] == 200 and all(
+            r['statusCode'] == 200 and r['body'] == first['body'] for r in limited_replays
+        ),
+        'new key over the rate limit gets 429': fresh['statusCode'] == 429 and limited_charged == 1,
+        'ledger agrees with snapshots': ledger_problems == 0
+    }
+    for name, ok in checks.items():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+
+    if not args.keep:
+        cursor.execute("DELETE FROM promocodes WHERE user_id = ANY(%s)", (users,))
+        cursor.execute("DELETE FROM users WHERE id = ANY(%s)", (users,))
+    conn.close()
+
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
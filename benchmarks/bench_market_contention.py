@@ -0,0 +1,127 @@
+'''
+Business: Сотни покупателей одновременно покупают один лот маркетплейса — пропускная способность и ровно одна продажа
+Args: DATABASE_URL из окружения, --buyers, --workers, --listings, --price
+Returns: p50/p95/p99 задержки, RPS, распределение ответов и проверка, что каждый лот продан один раз и деньги сошлись
+'''
+import argparse
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from functions import auth_headers, load_handler, make_event, percentile
+
+
+def create_user(cursor, balance) -> int:
+    username = f'bench_{uuid.uuid4().hex[:12]}'
+    cursor.execute(
+        "INSERT INTO users (username, password_hash, email, balance) VALUES (%s, 'x', %s, %s) RETURNING id",
+        (username, f'{username}@bench.local', balance)
+    )
+    return cursor.fetchone()[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--buyers', type=int, default=300, help='покупателей на каждый лот')
+    parser.add_argument('--workers', type=int, default=64)
+    parser.add_argument('--listings', type=int, default=5, help='сколько лотов разыграть подряд')
+    parser.add_argument('--price', type=float, default=100.0)
+    parser.add_argument('--keep', action='store_true', help='не удалять тестовые данные')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT id, case_id, name, rarity FROM case_items ORDER BY id LIMIT 1")
+    item_id, case_id, item_name, item_rarity = cursor.fetchone()
+
+    seller_id = create_user(cursor, 0)
+    buyer_ids = [create_user(cursor, args.price * 2) for _ in range(args.buyers)]
+    listings = []
+    for _ in range(args.listings):
+        cursor.execute("""
+            INSERT INTO promocodes (user_id, case_id, item_id, promo_code, item_name, item_rarity)
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+        """, (seller_id, case_id, item_id, f'B{uuid.uuid4().hex[:16].upper()}', item_name, item_rarity))
+        promo_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO marketplace (seller_id, promo_id, price, item_name, item_rarity)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+        """, (seller_id, promo_id, args.price, item_name, item_rarity))
+        listings.append((cursor.fetchone()[0], promo_id))
+
+    os.environ.setdefault('DB_POOL_SIZE', str(args.workers))
+    os.environ.setdefault('REQUEST_LOG', '0')
+    handler = load_handler('promocodes')
+    headers = {buyer_id: auth_headers(buyer_id) for buyer_id in buyer_ids}
+
+    def buy(market_id, buyer_id):
+        event = make_event('PUT', {'action': 'buy_market', 'market_id': market_id}, headers=headers[buyer_id])
+        started = time.perf_counter()
+        response = handler(event, None)
+        return time.perf_counter() - started, response['statusCode'], buyer_id
+
+    latencies = []
+    statuses: Counter = Counter()
+    winners = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for market_id, _ in listings:
+            results = list(pool.map(lambda b: buy(market_id, b), buyer_ids))
+            latencies.extend(r[0] for r in results)
+            statuses.update(r[1] for r in results)
+            winners[market_id] = [r[2] for r in results if r[1] == 200]
+    elapsed = time.perf_counter() - started
+    total = len(latencies)
+
+    print(f'listings={args.listings} buyers={args.buyers} workers={args.workers} '
+          f'elapsed={elapsed:.2f}s rps={total / elapsed:.1f}')
+    print('latency ms: ' + ' '.join(f'p{p}={percentile(latencies, p) * 1000:.1f}' for p in (50, 95, 99)))
+    print(f'statuses={dict(sorted(statuses.items()))}')
+
+    checks = {'one winner per listing': all(len(w) == 1 for w in winners.values())}
+    sold_owners_ok = True
+    for market_id, promo_id in listings:
+        cursor.execute("SELECT is_sold, buyer_id FROM marketplace WHERE id = %s", (market_id,))
+        is_sold, recorded_buyer = cursor.fetchone()
+        cursor.execute("SELECT user_id FROM promocodes WHERE id = %s", (promo_id,))
+        owner = cursor.fetchone()[0]
+        expected = winners[market_id][0] if len(winners[market_id]) == 1 else None
+        sold_owners_ok = sold_owners_ok and is_sold and recorded_buyer == expected and owner == expected
+    checks['listing and promocode belong to the winner'] = sold_owners_ok
+
+    cursor.execute("SELECT user_balance(%s)", (seller_id,))
+    seller_balance = float(cursor.fetchone()[0])
+    cursor.execute("SELECT SUM(user_balance(id)) FROM users WHERE id = ANY(%s)", (buyer_ids,))
+    buyers_balance = float(cursor.fetchone()[0])
+    sales = sum(len(w) for w in winners.values())
+    checks['seller credited once per listing'] = seller_balance == args.price * sales == args.price * args.listings
+    checks['buyers debited once per listing'] = buyers_balance == args.price * 2 * args.buyers - args.price * sales
+    cursor.execute("SELECT COUNT(*) FROM verify_balances() WHERE user_id = ANY(%s)", ([seller_id] + buyer_ids,))
+    checks['ledger agrees with snapshots'] = cursor.fetchone()[0] == 0
+    checks['losers rejected, no server errors'] = statuses[200] + statuses[409] + statuses[400] == total
+
+    for name, ok in checks.items():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+
+    if not args.keep:
+        all_users = [seller_id] + buyer_ids
+        cursor.execute("DELETE FROM marketplace WHERE seller_id = %s", (seller_id,))
+        cursor.execute("DELETE FROM promocodes WHERE user_id = ANY(%s)", (all_users,))
+        cursor.execute("DELETE FROM users WHERE id = ANY(%s)", (all_users,))
+    conn.close()
+
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
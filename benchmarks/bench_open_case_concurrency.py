@@ -0,0 +1,95 @@
+'''
+Business: Параллельные открытия кейса одним пользователем — задержка и отсутствие двойного списания
+Args: DATABASE_URL из окружения, --requests, --workers, --affordable, --case-id
+Returns: p50/p95/p99 задержки и проверка, что баланс не ушёл в минус и списан ровно за успешные открытия
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from functions import auth_headers, load_handler, make_event, percentile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--affordable', type=int, default=50, help='сколько открытий покрывает стартовый баланс')
+    parser.add_argument('--case-id', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='не удалять тестового пользователя')
+    args = parser.parse_args()
+
+    dsn = os.environ['DATABASE_URL']
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT price FROM cases WHERE id = %s", (args.case_id,))
+    price = cursor.fetchone()[0]
+    start_balance = price * args.affordable
+    username = f'bench_{uuid.uuid4().hex[:12]}'
+    cursor.execute(
+        "INSERT INTO users (username, password_hash, email, balance) VALUES (%s, 'x', %s, %s) RETURNING id",
+        (username, f'{username}@bench.local', start_balance)
+    )
+    user_id = cursor.fetchone()[0]
+
+    os.environ.setdefault('DB_POOL_SIZE', str(args.workers))
+    handler = load_handler('open-case')
+    event = make_event('POST', {'case_id': args.case_id}, headers=auth_headers(user_id))
+
+    def open_once():
+        started = time.perf_counter()
+        response = handler(event, None)
+        return time.perf_counter() - started, response['statusCode'], json.loads(response['body'])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda _: open_once(), range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [r[0] for r in results]
+    succeeded = sum(1 for r in results if r[1] == 200)
+    rejected = sum(1 for r in results if r[1] == 400 and r[2].get('error') == 'Insufficient balance')
+
+    cursor.execute("SELECT user_balance(%s)", (user_id,))
+    final_balance = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM promocodes WHERE user_id = %s", (user_id,))
+    issued = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM verify_balances() WHERE user_id = %s", (user_id,))
+    ledger_problems = cursor.fetchone()[0]
+
+    print(f'requests={args.requests} workers={args.workers} elapsed={elapsed:.2f}s rps={args.requests / elapsed:.1f}')
+    print('latency ms: ' + ' '.join(f'p{p}={percentile(latencies, p) * 1000:.1f}' for p in (50, 95, 99)))
+    print(f'succeeded={succeeded} rejected={rejected} issued={issued} final_balance={final_balance}')
+
+    checks = {
+        'balance never negative': final_balance >= 0,
+        'opens capped by balance': succeeded == min(args.affordable, args.requests),
+        'balance debited per open': final_balance == start_balance - price * succeeded,
+        'one promocode per open': issued == succeeded,
+        'ledger agrees with snapshots': ledger_problems == 0,
+        'no other failures': succeeded + rejected == args.requests
+    }
+    for name, ok in checks.items():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+
+    if not args.keep:
+        cursor.execute("DELETE FROM promocodes WHERE user_id = %s", (user_id,))
+        cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+    conn.close()
+
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Business: Бенчмарк ограничения частоты запросов — сколько стоит rate_limit.check() до обращения к БД
+Args: --calls (вызовов на сценарий), --users (разных ключей), --threads (для сценария с конкуренцией)
+Returns: нс на вызов для отключённых лимитов, разрешённых (затем списываются из rate_limit_buckets одним
+         запросом в check_shared) и отклонённых с 429, а также пропускная способность из нескольких потоков
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'open-case'))
+
+import rate_limit
+
+
+def event(ip: str) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'requestContext': {'identity': {'sourceIp': ip}}}
+
+
+def time_calls(calls: int, call: Callable[[int], Any]) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        call(i)
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def scenario(limits: Any, calls: int, call: Callable[[int], Any]) -> float:
+    rate_limit.LIMITS = limits
+    rate_limit._buckets.clear()
+    return time_calls(calls, call)
+
+
+def threaded(calls: int, users: int, threads: int) -> float:
+    rate_limit.LIMITS = {'open_case': {'user': (1e9, 1e9), 'ip': (1e9, 1e9)}}
+    rate_limit._buckets.clear()
+    per_thread = calls // threads
+
+    def worker(offset: int) -> None:
+        for i in range(per_thread):
+            rate_limit.check('open_case', event(f'10.0.{offset}.1'), (offset * per_thread + i) % users)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=500_000)
+    parser.add_argument('--users', type=int, default=5_000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    events = [event(f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}') for i in range(args.users)]
+    results = {
+        'off': scenario(None, args.calls, lambda i: rate_limit.check('open_case', events[i % args.users], i % args.users)),
+        'allowed': scenario(
+            {'open_case': {'user': (1e9, 1e9), 'ip': (1e9, 1e9)}}, args.calls,
+            lambda i: rate_limit.check('open_case', events[i % args.users], i % args.users)
+        ),
+        'rejected': scenario(
+            {'open_case': {'user': (1e-9, 1), 'ip': (1e-9, 1)}}, args.calls,
+            lambda i: rate_limit.check('open_case', events[0], 0)
+        )
+    }
+    for name, ns in results.items():
+        print(f'{name:<10} {ns:>8.0f} ns/call')
+    print(f'overhead of an allowed request over disabled limits: {results["allowed"] - results["off"]:.0f} ns')
+
+    rate = threaded(args.calls, args.users, args.threads)
+    print(f'{args.threads} threads, {args.users} users: {rate:,.0f} checks/s ({len(rate_limit._buckets)} local keys)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Business: Микробенчмарк выбора предмета — таблица алиасов против линейного взвешенного перебора
+Args: --draws (число выборок на замер), --seed
+Returns: таблица времени на одну выборку для кейсов из 4, 50 и 5000 предметов и проверка вероятностей
+'''
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'open-case'))
+
+from sampler import AliasSampler, select_item_by_chance
+
+CASE_SIZES = (4, 50, 5000)
+
+
+def make_items(size: int, rng: random.Random) -> list:
+    return [
+        {'id': i, 'name': f'item {i}', 'drop_chance': Decimal(rng.randint(1, 9999)) / 100}
+        for i in range(size)
+    ]
+
+
+def time_per_draw(draw, draws: int) -> float:
+    started = time.perf_counter()
+    for _ in range(draws):
+        draw()
+    return (time.perf_counter() - started) / draws
+
+
+def max_probability_error(sampler: AliasSampler, items: list) -> float:
+    n = sampler.n
+    implied = [0.0] * n
+    for i in range(n):
+        implied[i] += sampler.prob[i] / n
+        implied[sampler.alias[i]] += (1.0 - sampler.prob[i]) / n
+    weights = [float(item['drop_chance']) for item in items]
+    total = sum(weights)
+    if total <= 0:
+        weights, total = [1.0] * n, float(n)
+    return max(abs(implied[i] - weights[i] / total) for i in range(n))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--draws', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'items':>6} {'scan, us':>10} {'alias, us':>10} {'speedup':>8} {'build, ms':>10} {'max |dp|':>10}")
+    for size in CASE_SIZES:
+        items = make_items(size, rng)
+
+        started = time.perf_counter()
+        sampler = AliasSampler(items)
+        build = time.perf_counter() - started
+
+        scan = time_per_draw(lambda: select_item_by_chance(items), max(args.draws // max(size // 50, 1), 200))
+        alias = time_per_draw(sampler.sample, args.draws)
+        error = max_probability_error(sampler, items)
+        print(f'{size:>6} {scan * 1e6:>10.2f} {alias * 1e6:>10.2f} {scan / alias:>7.1f}x {build * 1e3:>10.2f} {error:>10.2e}')
+
+    zero = [{'id': i, 'drop_chance': Decimal(0)} for i in range(4)]
+    print(f'all-zero weights fall back to uniform: max |dp| = {max_probability_error(AliasSampler(zero), zero):.2e}')
+
+
+if __name__ == '__main__':
+    main()
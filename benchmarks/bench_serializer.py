@@ -0,0 +1,109 @@
+'''
+Business: Бенчмарк сериализации ответов маркетплейса и инвентаря на 10k и 100k строк
+Args: --rows (список размеров), --repeat
+Returns: время на ответ для старого пути (копия строк + float + json.dumps(default=str)),
+         serializer на стандартном json и serializer на orjson, если он установлен
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'promocodes'))
+
+import serializer
+
+RARITIES = ('common', 'rare', 'epic', 'legendary')
+
+
+def market_rows(count: int, rng: random.Random) -> list:
+    started = datetime(2026, 1, 1)
+    return [
+        {
+            'id': i,
+            'price': Decimal(rng.randint(100, 5000000)) / 100,
+            'item_name': f'Предмет {i}',
+            'item_rarity': rng.choice(RARITIES),
+            'item_description': 'Описание предмета для маркетплейса',
+            'created_at': started + timedelta(seconds=i),
+            'seller_name': f'player{i % 997}'
+        }
+        for i in range(count)
+    ]
+
+
+def inventory_rows(count: int, rng: random.Random) -> list:
+    started = datetime(2026, 1, 1)
+    return [
+        {
+            'id': i,
+            'promo_code': f'{i:012X}',
+            'item_name': f'Предмет {i}',
+            'is_used': rng.random() < 0.3,
+            'created_at': started + timedelta(seconds=i),
+            'rarity': rng.choice(RARITIES),
+            'description': 'Описание предмета',
+            'case_name': 'Стартовый кейс',
+            'case_price': Decimal('100.00')
+        }
+        for i in range(count)
+    ]
+
+
+def legacy_market(rows: list) -> str:
+    items = []
+    for item in rows:
+        item_dict = dict(item)
+        item_dict['price'] = float(item_dict['price'])
+        items.append(item_dict)
+    return json.dumps(items, default=str)
+
+
+def legacy_inventory(rows: list) -> str:
+    result = []
+    for promo in rows:
+        promo_dict = dict(promo)
+        promo_dict['case_price'] = float(promo_dict['case_price']) if promo_dict['case_price'] else 0
+        result.append(promo_dict)
+    return json.dumps(result, default=str)
+
+
+def best_of(fn, rows: list, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    encoders = [('serializer/json', serializer.encode_stdlib)]
+    if serializer.encode_orjson is not None:
+        encoders.append(('serializer/orjson', serializer.encode_orjson))
+    else:
+        print('orjson не установлен — замер только стандартного json')
+
+    for payload, make_rows, legacy in (('market', market_rows, legacy_market),
+                                       ('inventory', inventory_rows, legacy_inventory)):
+        for count in args.rows:
+            rows = make_rows(count, rng)
+            baseline = best_of(legacy, rows, args.repeat)
+            print(f'{payload:>9} {count:>7} rows  legacy {baseline * 1000:8.1f} ms')
+            for name, encode in encoders:
+                elapsed = best_of(encode, rows, args.repeat)
+                print(f'{"":>9} {"":>7}       {name:<17} {elapsed * 1000:8.1f} ms  {baseline / elapsed:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
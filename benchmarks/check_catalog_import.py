@@ -0,0 +1,112 @@
+'''
+Business: Проверка разбора каталога для импорта без БД — каждая ошибка находится и указывает на свою строку или поле
+Args: нет (каталоги собраны в CASES ниже)
+Returns: OK/FAIL по каждому случаю и код выхода 1, если хоть один не прошёл
+'''
+import os
+import sys
+from typing import Any, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'admin'))
+
+from catalog_import import CatalogError, parse_catalog
+
+CSV_HEADER = 'case_name,case_description,case_price,case_rarity,case_image_url,item_name,item_rarity,drop_chance\n'
+
+
+def json_case(name: str = 'Starter', price: Any = '100', chances=('60', '40'), names=('Pistol', 'Knife')):
+    return {'name': name, 'price': price, 'items': [
+        {'name': item, 'drop_chance': chance} for item, chance in zip(names, chances)
+    ]}
+
+
+def csv_rows(*rows: str) -> str:
+    return CSV_HEADER + ''.join(row + '\n' for row in rows)
+
+
+# (название, каталог, формат, подстрока ожидаемой ошибки или None, если каталог корректен)
+CASES = [
+    ('valid json', {'cases': [json_case(), json_case('Premium')]}, 'json', None),
+    ('valid csv with blank repeated case fields', csv_rows(
+        'Starter,Basic,100,common,,Pistol,common,60',
+        'Starter,,,,,Knife,rare,40'
+    ), 'csv', None),
+    ('csv price written differently', csv_rows(
+        'Starter,,100,common,,Pistol,common,60',
+        'Starter,,100.00,common,,Knife,rare,40'
+    ), 'csv', None),
+    ('empty catalog', {'cases': []}, 'json', 'catalog is empty'),
+    ('unknown format', {}, 'xml', 'format must be json or csv'),
+    ('case is not an object', ['Starter'], 'json', 'cases[0]: must be an object'),
+    ('chances below 100', [json_case(chances=('60', '39.99'))], 'json',
+     'cases[0]: drop_chance values sum to 99.99, expected 100'),
+    ('chances above 100', [json_case(chances=('60', '41'))], 'json',
+     'cases[0]: drop_chance values sum to 101, expected 100'),
+    ('chance precision', [json_case(chances=('60.001', '39.999'))], 'json',
+     'cases[0].items[0].drop_chance: must be from 0.01 to 100 with at most 2 decimal places'),
+    ('chance not a number', [json_case(chances=('sixty', '40'))], 'json',
+     'cases[0].items[0].drop_chance: must be from 0.01'),
+    ('chance is infinite', [json_case(chances=('Infinity', '40'))], 'json',
+     'cases[0].items[0].drop_chance: must be from 0.01'),
+    ('price precision', [json_case(price='9.999')], 'json',
+     'cases[0].price: must be a positive amount with at most 2 decimal places'),
+    ('price is a boolean', [json_case(price=True)], 'json', 'cases[0].price: must be a positive amount'),
+    ('price is zero', [json_case(price='0')], 'json', 'cases[0].price: must be a positive amount'),
+    ('duplicate case', [json_case(), json_case()], 'json', 'cases[1].name: duplicate case "Starter"'),
+    ('duplicate item', [json_case(chances=('50', '50'), names=('Pistol', 'Pistol'))], 'json',
+     'cases[0].items[1].name: duplicate item "Pistol" in case'),
+    ('unknown rarity', [dict(json_case(), rarity='mythic')], 'json', 'cases[0].rarity: must be one of'),
+    ('case without items', [{'name': 'Empty', 'price': '10', 'items': []}], 'json',
+     'cases[0].items: at least one item is required'),
+    ('csv is not a string', {'cases': []}, 'csv', 'CSV catalog must be a string'),
+    ('csv missing columns', 'case_name,item_name\nStarter,Pistol\n', 'csv',
+     'CSV is missing columns: case_price, drop_chance'),
+    ('csv chances by row', csv_rows(
+        'Starter,,100,common,,Pistol,common,60',
+        'Starter,,100,common,,Knife,rare,30'
+    ), 'csv', 'row 2: drop_chance values sum to 90, expected 100'),
+    ('csv bad chance points at its row', csv_rows(
+        'Starter,,100,common,,Pistol,common,60',
+        'Starter,,100,common,,Knife,rare,4O'
+    ), 'csv', 'row 3.drop_chance: must be from 0.01'),
+    ('csv conflicting price', csv_rows(
+        'Starter,,100,common,,Pistol,common,60',
+        'Starter,,120,common,,Knife,rare,40'
+    ), 'csv', 'row 3.case_price: "120" conflicts with "100" from row 2 for case "Starter"'),
+    ('csv conflicting rarity', csv_rows(
+        'Starter,,100,common,,Pistol,common,60',
+        'Starter,,100,common,,Knife,rare,20',
+        'Starter,,100,epic,,Rifle,rare,20'
+    ), 'csv', 'row 4.case_rarity: "epic" conflicts with "common" from row 2 for case "Starter"'),
+    ('csv conflicting description after a blank', csv_rows(
+        'Starter,,100,common,,Pistol,common,50',
+        'Starter,Basic,100,common,,Knife,rare,30',
+        'Starter,Advanced,100,common,,Rifle,rare,20'
+    ), 'csv', 'row 4.case_description: "Advanced" conflicts with "Basic" from row 3 for case "Starter"'),
+]
+
+
+def errors_of(catalog: Any, fmt: str) -> Optional[List[str]]:
+    try:
+        parse_catalog(catalog, fmt)
+    except CatalogError as e:
+        return e.errors
+    return None
+
+
+def main() -> None:
+    failed = 0
+    for name, catalog, fmt, expected in CASES:
+        errors = errors_of(catalog, fmt)
+        if expected is None:
+            ok = errors is None
+        else:
+            ok = errors is not None and any(expected in error for error in errors)
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}" + ('' if ok else f': {errors}'))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Business: Загрузка обработчиков облачных функций из backend/ в один процесс для бенчмарков
+Args: имя функции — имя каталога в backend/ (cases, open-case, ...)
+Returns: load_handler(), auth_headers() и вспомогательные функции для замеров
+'''
+import importlib
+import importlib.util
+import json
+import math
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+_loaded: Dict[str, Any] = {}
+
+
+def function_names() -> List[str]:
+    return sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py'))
+    )
+
+
+def load_module(function: str) -> Any:
+    if function in _loaded:
+        return _loaded[function]
+    os.environ.setdefault('PROMO_CODE_SECRET', 'bench-only-secret')
+    # Бенчмарки шлют сотни запросов от одного пользователя — без этого они мерили бы ответы 429
+    os.environ.setdefault('RATE_LIMITS', 'off')
+
+    function_dir = os.path.join(BACKEND_DIR, function)
+    local_names = {name[:-3] for name in os.listdir(function_dir) if name.endswith('.py')}
+    shadowed = {name: sys.modules.pop(name) for name in local_names if name in sys.modules}
+
+    sys.path.insert(0, function_dir)
+    try:
+        module = importlib.import_module('index')
+    finally:
+        sys.path.remove(function_dir)
+        for name in local_names:
+            sys.modules.pop(name, None)
+        sys.modules.update(shadowed)
+
+    _loaded[function] = module
+    return module
+
+
+def load_handler(function: str) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    return load_module(function).handler
+
+
+def auth_headers(user_id: int, is_admin: bool = False) -> Dict[str, str]:
+    os.environ.setdefault('TOKEN_SECRETS', 'bench:bench-only-secret')
+    if 'tokens' not in _loaded:
+        spec = importlib.util.spec_from_file_location('bench_tokens', os.path.join(BACKEND_DIR, 'auth', 'tokens.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded['tokens'] = module
+    return {'Authorization': f"Bearer {_loaded['tokens'].issue_token(user_id, is_admin)}"}
+
+
+def make_event(method: str, body: Optional[Dict[str, Any]] = None,
+               params: Optional[Dict[str, str]] = None,
+               headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'httpMethod': method,
+        'headers': headers or {},
+        'queryStringParameters': params or {},
+        'body': json.dumps(body) if body is not None else ''
+    }
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
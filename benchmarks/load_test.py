@@ -0,0 +1,409 @@
+'''
+Business: Нагрузочный тест всех действий бэкенда на данных из seed.py — задержки, пропускная способность, запросы к БД
+Args: DATABASE_URL из окружения, --scenarios, --concurrency, --duration, --requests, --url, --mode, --output, --compare,
+      --rate-limits
+Returns: p50/p95/p99, RPS и число SQL-запросов на вызов по каждому сценарию; результаты в JSON для сравнения коммитов
+'''
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from functions import auth_headers, load_handler, load_module, make_event, percentile
+from seed import LOAD_PASSWORD
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+SERVER_TIMING_QUERIES = re.compile(r'(?:^|,)\s*db;[^,]*desc="(\d+) queries"')
+
+Request = Tuple[str, Dict[str, Any]]
+
+
+class Fixtures:
+    def __init__(self, cursor):
+        cursor.execute("SELECT id FROM users WHERE username LIKE 'load\\_%%' AND NOT is_admin ORDER BY id")
+        self.user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM users WHERE username = 'load_admin'")
+        row = cursor.fetchone()
+        self.admin_id = row[0] if row else None
+        if not self.user_ids or self.admin_id is None:
+            raise SystemExit('No load_* users found, run benchmarks/seed.py first')
+
+        cursor.execute("SELECT DISTINCT case_id FROM case_items ORDER BY case_id")
+        self.case_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT p.user_id, p.id
+            FROM promocodes p
+            JOIN users u ON u.id = p.user_id
+            WHERE u.username LIKE 'load\\_%%' AND NOT u.is_admin AND p.is_used = FALSE
+              AND NOT EXISTS (SELECT 1 FROM marketplace m WHERE m.promo_id = p.id)
+        """)
+        self.promos = cursor.fetchall()
+        cursor.execute("""
+            SELECT m.seller_id, m.id
+            FROM marketplace m
+            JOIN users u ON u.id = m.seller_id
+            WHERE u.username LIKE 'load\\_%%' AND m.is_sold = FALSE
+        """)
+        self.listings = cursor.fetchall()
+        random.shuffle(self.promos)
+        random.shuffle(self.listings)
+
+        self._lock = threading.Lock()
+        self._headers: Dict[Tuple[int, bool], Dict[str, str]] = {}
+        self.headers(self.admin_id, True)
+
+    def headers(self, user_id: int, is_admin: bool = False) -> Dict[str, str]:
+        key = (user_id, is_admin)
+        if key not in self._headers:
+            self._headers[key] = auth_headers(user_id, is_admin)
+        return self._headers[key]
+
+    def user(self) -> int:
+        return random.choice(self.user_ids)
+
+    def take_promo(self) -> Tuple[int, int]:
+        with self._lock:
+            if not self.promos:
+                raise Exhausted('no unused promocodes left, reseed')
+            return self.promos.pop()
+
+    def take_listing(self) -> Tuple[int, int]:
+        with self._lock:
+            if not self.listings:
+                raise Exhausted('no unsold listings left, reseed')
+            return self.listings.pop()
+
+
+class Exhausted(Exception):
+    pass
+
+
+def cases_list(fx: Fixtures) -> Request:
+    return 'cases', make_event('GET')
+
+
+def case_details(fx: Fixtures) -> Request:
+    return 'cases', make_event('GET', params={'case_id': str(random.choice(fx.case_ids))})
+
+
+def login(fx: Fixtures) -> Request:
+    username = f'load_{random.randint(1, len(fx.user_ids))}'
+    return 'auth', make_event('POST', {'action': 'login', 'username': username, 'password': LOAD_PASSWORD})
+
+
+def register(fx: Fixtures) -> Request:
+    username = f'load_r{uuid.uuid4().hex[:12]}'
+    return 'auth', make_event('POST', {'action': 'register', 'username': username, 'password': LOAD_PASSWORD})
+
+
+def open_case(fx: Fixtures) -> Request:
+    user_id = fx.user()
+    return 'open-case', make_event('POST', {'case_id': random.choice(fx.case_ids)}, headers=fx.headers(user_id))
+
+
+def open_case_batch(fx: Fixtures) -> Request:
+    user_id = fx.user()
+    body = {'case_id': random.choice(fx.case_ids), 'count': 10}
+    return 'open-case', make_event('POST', body, headers=fx.headers(user_id))
+
+
+def inventory(fx: Fixtures) -> Request:
+    return 'promocodes', make_event('GET', headers=fx.headers(fx.user()))
+
+
+def market(fx: Fixtures) -> Request:
+    params = {'action': 'market', 'sort': random.choice(['newest', 'price_asc', 'price_desc'])}
+    if random.random() < 0.3:
+        params['rarity'] = random.choice(['common', 'rare', 'epic', 'legendary'])
+    return 'promocodes', make_event('GET', params=params)
+
+
+def sell(fx: Fixtures) -> Request:
+    user_id, promo_id = fx.take_promo()
+    return 'promocodes', make_event('POST', {'promo_id': promo_id}, headers=fx.headers(user_id))
+
+
+def list_market(fx: Fixtures) -> Request:
+    user_id, promo_id = fx.take_promo()
+    body = {'action': 'list_market', 'promo_id': promo_id, 'price': round(random.uniform(50, 5000), 2)}
+    return 'promocodes', make_event('PUT', body, headers=fx.headers(user_id))
+
+
+def buy_market(fx: Fixtures) -> Request:
+    seller_id, market_id = fx.take_listing()
+    buyer_id = fx.user()
+    while buyer_id == seller_id and len(fx.user_ids) > 1:
+        buyer_id = fx.user()
+    return 'promocodes', make_event('PUT', {'action': 'buy_market', 'market_id': market_id}, headers=fx.headers(buyer_id))
+
+
+def admin_users(fx: Fixtures) -> Request:
+    params = {'action': 'users', 'limit': '50'}
+    if random.random() < 0.5:
+        params['q'] = f'load_{random.randint(1, 99)}'
+    return 'admin', make_event('GET', params=params, headers=fx.headers(fx.admin_id, True))
+
+
+def admin_stats(fx: Fixtures) -> Request:
+    return 'admin', make_event('GET', params={'action': 'stats'}, headers=fx.headers(fx.admin_id, True))
+
+
+def admin_update_balance(fx: Fixtures) -> Request:
+    body = {'action': 'update_balance', 'user_id': fx.user(), 'balance': 1000000}
+    return 'admin', make_event('POST', body, headers=fx.headers(fx.admin_id, True))
+
+
+SCENARIOS: Dict[str, Callable[[Fixtures], Request]] = {
+    'cases_list': cases_list,
+    'case_details': case_details,
+    'login': login,
+    'register': register,
+    'open_case': open_case,
+    'open_case_x10': open_case_batch,
+    'inventory': inventory,
+    'market': market,
+    'sell': sell,
+    'list_market': list_market,
+    'buy_market': buy_market,
+    'admin_users': admin_users,
+    'admin_stats': admin_stats,
+    'admin_update_balance': admin_update_balance
+}
+
+
+class InProcessTransport:
+    name = 'in-process'
+
+    def __init__(self):
+        self._handlers = {name: load_handler(name) for name in ('auth', 'cases', 'open-case', 'promocodes', 'admin')}
+
+    def __call__(self, function: str, event: Dict[str, Any]) -> Tuple[int, Dict[str, str]]:
+        response = self._handlers[function](event, None)
+        return int(response['statusCode']), response.get('headers') or {}
+
+
+class AsyncInProcessTransport:
+    name = 'in-process-async'
+
+    # Потоки нагрузки только ждут результата, а обработчики выполняются в одном event loop, как в local_server.py --mode async
+    def __init__(self):
+        self._handlers = {
+            name: load_module(name).handler_async for name in ('auth', 'cases', 'open-case', 'promocodes', 'admin')
+        }
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='load-test-loop', daemon=True).start()
+
+    def __call__(self, function: str, event: Dict[str, Any]) -> Tuple[int, Dict[str, str]]:
+        response = asyncio.run_coroutine_threadsafe(self._handlers[function](event, None), self._loop).result()
+        return int(response['statusCode']), response.get('headers') or {}
+
+
+class HTTPTransport:
+    name = 'http'
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host, self.port, self.prefix = parts.hostname, parts.port or 80, parts.path.rstrip('/')
+        self._local = threading.local()
+
+    def __call__(self, function: str, event: Dict[str, Any]) -> Tuple[int, Dict[str, str]]:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        path = f'{self.prefix}/{function}'
+        if event['queryStringParameters']:
+            path += '?' + urlencode(event['queryStringParameters'])
+        headers = dict(event['headers'], **{'Content-Type': 'application/json'})
+        try:
+            conn.request(event['httpMethod'], path, body=event['body'] or None, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+        return response.status, dict(response.getheaders())
+
+
+def query_count(headers: Dict[str, str]) -> Optional[int]:
+    for name, value in headers.items():
+        if name.lower() == 'server-timing':
+            match = SERVER_TIMING_QUERIES.search(value)
+            return int(match.group(1)) if match else None
+    return None
+
+
+def run_scenario(name: str, fx: Fixtures, transport, args) -> Dict[str, Any]:
+    build = SCENARIOS[name]
+    latencies: List[float] = []
+    queries: List[int] = []
+    statuses: Counter = Counter()
+    errors: Counter = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    remaining = [args.requests]
+
+    def take_slot() -> bool:
+        with lock:
+            if args.requests:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+                return True
+        return time.perf_counter() < deadline
+
+    def worker() -> None:
+        while take_slot():
+            try:
+                function, event = build(fx)
+            except Exhausted as e:
+                with lock:
+                    errors[str(e)] += 1
+                return
+            started = time.perf_counter()
+            try:
+                status, headers = transport(function, event)
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+                count = query_count(headers)
+                if count is not None:
+                    queries.append(count)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+    completed = len(latencies)
+
+    return {
+        'requests': completed,
+        'errors': dict(errors),
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'wall_s': round(wall, 3),
+        'rps': round(completed / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(current: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline.get('commit')}, {baseline.get('transport')}):")
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            if before.get(key):
+                deltas.append(f'{key}={(result[key] - before[key]) / before[key] * 100:+.1f}%')
+        # Те же сценарии в другом режиме должны давать те же коды ответов
+        if set(result['statuses']) != set(before.get('statuses', {})):
+            deltas.append(f"statuses {before.get('statuses')} -> {result['statuses']}")
+        print(f"{name:<22} {' '.join(deltas)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='секунд на сценарий')
+    parser.add_argument('--requests', type=int, default=0, help='фиксированное число вызовов вместо --duration')
+    parser.add_argument('--url', help='адрес local_server.py, например http://127.0.0.1:8000; по умолчанию вызов в процессе')
+    parser.add_argument('--mode', choices=('threads', 'async'), default='threads',
+                        help='вызывать handler из потоков или handler_async в event loop; с --url режим задаёт local_server.py')
+    parser.add_argument('--output', help='файл для JSON с результатами (по умолчанию benchmarks/results/)')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='не отключать rate_limit при вызове в процессе (сравнить с прогоном без флага)')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_POOL_SIZE', str(args.concurrency))
+    os.environ.setdefault('REQUEST_LOG', '0')
+    # Пустое значение — лимиты по умолчанию; без него load_module() отключает лимиты для бенчмарков
+    os.environ.setdefault('RATE_LIMITS', '' if args.rate_limits else 'off')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cursor = conn.cursor()
+    fx = Fixtures(cursor)
+    if args.url:
+        transport = HTTPTransport(args.url)
+    elif args.mode == 'async':
+        transport = AsyncInProcessTransport()
+    else:
+        transport = InProcessTransport()
+
+    report: Dict[str, Any] = {
+        'commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'transport': transport.name,
+        'concurrency': args.concurrency,
+        'rate_limits': os.environ.get('RATE_LIMITS') != 'off',
+        'dataset': {'users': len(fx.user_ids), 'promocodes': len(fx.promos), 'listings': len(fx.listings)},
+        'scenarios': {}
+    }
+
+    print(f"{'scenario':<22} {'reqs':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'q/req':>6}  statuses")
+    for name in args.scenarios:
+        result = run_scenario(name, fx, transport, args)
+        report['scenarios'][name] = result
+        qpr = '-' if result['queries_per_request'] is None else f"{result['queries_per_request']:.1f}"
+        print(f"{name:<22} {result['requests']:>7} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {qpr:>6}  {result['statuses']} {result['errors'] or ''}")
+
+    cursor.execute("DELETE FROM users WHERE username LIKE 'load\\_r%%'")
+    conn.close()
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"load-{stamp}-{report['commit'] or 'nogit'}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nresults written to {output}')
+
+    if args.compare:
+        print_comparison(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+'''
+Business: Локальный HTTP-хост для всех облачных функций из backend/ в одном процессе
+Args: --host, --port, --mode (threads/async), --workers, --functions; DATABASE_URL и прочие переменные окружения функций
+Returns: HTTP-сервер: /<функция>?... вызывает handler(event, context) из пула потоков
+         или handler_async(event, context) в одном event loop
+'''
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from functions import function_names, load_module
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+
+class FunctionContext:
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.request_id = uuid.uuid4().hex
+        self.memory_limit_in_mb = 128
+
+
+def build_event(method: str, path: str, query: str, headers: Dict[str, str], raw: bytes, client_ip: str) -> Dict[str, Any]:
+    try:
+        body, is_base64 = raw.decode(), False
+    except UnicodeDecodeError:
+        body, is_base64 = base64.b64encode(raw).decode(), True
+    return {
+        'httpMethod': method,
+        'path': path,
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(query, keep_blank_values=True)),
+        'body': body,
+        'isBase64Encoded': is_base64,
+        'requestContext': {
+            'requestId': uuid.uuid4().hex,
+            'identity': {'sourceIp': client_ip}
+        }
+    }
+
+
+def json_response(status: int, payload: Any) -> Response:
+    return status, {'Content-Type': 'application/json'}, json.dumps(payload).encode()
+
+
+def function_response(response: Dict[str, Any]) -> Response:
+    body: Optional[str] = response.get('body') or ''
+    data = base64.b64decode(body) if response.get('isBase64Encoded') else body.encode()
+    return int(response.get('statusCode', 200)), response.get('headers') or {}, data
+
+
+def route(modules: Dict[str, Any], path: str, pool_stats: str) -> Tuple[str, Any, Optional[Response]]:
+    segments = [s for s in path.split('/') if s]
+    if segments == ['_stats']:
+        return '', None, json_response(200, {
+            name: getattr(module, pool_stats).stats() for name, module in modules.items() if hasattr(module, 'db')
+        })
+    module = modules.get(segments[0]) if segments else None
+    if module is None:
+        return '', None, json_response(404, {'error': f'Unknown function, expected one of: {", ".join(modules)}'})
+    return segments[0], module, None
+
+
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, address, handler_class, workers: int, modules: Dict[str, Any]):
+        super().__init__(address, handler_class)
+        self.modules = modules
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_in_worker, request, client_address)
+
+    def _process_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class FunctionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+    server: PooledHTTPServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if os.environ.get('LOCAL_SERVER_ACCESS_LOG'):
+            super().log_message(format, *args)
+
+    def _send(self, status: int, headers: Dict[str, str], body: bytes) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            if name.lower() not in ('content-length', 'connection'):
+                self.send_header(name, str(value))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _dispatch(self) -> None:
+        parts = urlsplit(self.path)
+        name, module, response = route(self.server.modules, parts.path, 'db')
+        if response is not None:
+            self._send(*response)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        event = build_event(self.command, parts.path, parts.query, dict(self.headers.items()), raw, self.client_address[0])
+        try:
+            self._send(*function_response(module.handler(event, FunctionContext(name))))
+        except Exception:
+            traceback.print_exc()
+            self._send(*json_response(500, {'error': 'Internal server error'}))
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_OPTIONS = do_HEAD = _dispatch
+
+
+async def _serve_async_connection(modules: Dict[str, Any], reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    client_ip = (writer.get_extra_info('peername') or ('',))[0]
+    try:
+        while True:
+            request_line = await asyncio.wait_for(reader.readline(), FunctionRequestHandler.timeout)
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers: Dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip()] = value.strip()
+            lowered = {name.lower(): value for name, value in headers.items()}
+            length = int(lowered.get('content-length') or 0)
+            raw = await reader.readexactly(length) if length else b''
+
+            parts = urlsplit(target)
+            name, module, response = route(modules, parts.path, 'db_async')
+            if response is None:
+                event = build_event(method, parts.path, parts.query, headers, raw, client_ip)
+                try:
+                    response = function_response(await module.handler_async(event, FunctionContext(name)))
+                except Exception:
+                    traceback.print_exc()
+                    response = json_response(500, {'error': 'Internal server error'})
+
+            status, response_headers, body = response
+            reason = HTTPStatus(status).phrase if status in HTTPStatus._value2member_map_ else ''
+            lines = [f'HTTP/1.1 {status} {reason}']
+            lines.extend(
+                f'{name}: {value}' for name, value in response_headers.items()
+                if name.lower() not in ('content-length', 'connection')
+            )
+            lines.append(f'Content-Length: {len(body)}')
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body if method != 'HEAD' else b''))
+            await writer.drain()
+
+            if version != 'HTTP/1.1' or lowered.get('connection', '').lower() == 'close':
+                break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_async(host: str, port: int, modules: Dict[str, Any]) -> None:
+    server = await asyncio.start_server(
+        lambda reader, writer: _serve_async_connection(modules, reader, writer), host, port, backlog=1024
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--mode', choices=('threads', 'async'), default='threads')
+    parser.add_argument('--workers', type=int, default=32, help='рабочих потоков (threads) или соединений в пуле (async)')
+    parser.add_argument('--functions', nargs='+', default=function_names())
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_POOL_SIZE', str(args.workers))
+    modules = {name: load_module(name) for name in args.functions}
+
+    print(f'Serving {", ".join(modules)} on http://{args.host}:{args.port}/<function> '
+          f'({args.mode}, {args.workers} {"workers" if args.mode == "threads" else "pooled connections"})')
+    if args.mode == 'async':
+        try:
+            asyncio.run(serve_async(args.host, args.port, modules))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    server = PooledHTTPServer((args.host, args.port), FunctionRequestHandler, args.workers, modules)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Business: Наполнение локальной БД данными для нагрузочных тестов (пользователи load_*, промокоды, лоты маркетплейса)
+Args: DATABASE_URL из окружения, --users, --promos-per-user, --listings, --reset
+Returns: готовый набор данных; пароль всех пользователей load_* — LOAD_PASSWORD, load_admin — администратор
+'''
+import argparse
+import hashlib
+import os
+import time
+
+import psycopg2
+
+LOAD_PREFIX = 'load_'
+LOAD_PASSWORD = 'loadpass123'
+
+
+def reset(cursor) -> None:
+    cursor.execute("""
+        DELETE FROM marketplace
+        WHERE seller_id IN (SELECT id FROM users WHERE username LIKE 'load\\_%%')
+           OR buyer_id IN (SELECT id FROM users WHERE username LIKE 'load\\_%%')
+    """)
+    cursor.execute("DELETE FROM promocodes WHERE user_id IN (SELECT id FROM users WHERE username LIKE 'load\\_%%')")
+    cursor.execute("DELETE FROM users WHERE username LIKE 'load\\_%%'")
+
+
+def seed(cursor, users: int, promos_per_user: int, listings: int) -> None:
+    password_hash = hashlib.sha256(LOAD_PASSWORD.encode()).hexdigest()
+    cursor.execute("""
+        INSERT INTO users (username, password_hash, email, balance)
+        SELECT %(prefix)s || g, %(hash)s, %(prefix)s || g || '@bench.local', 1000000.00
+        FROM generate_series(1, %(users)s) g
+        ON CONFLICT (username) DO NOTHING
+    """, {'prefix': LOAD_PREFIX, 'hash': password_hash, 'users': users})
+
+    cursor.execute("""
+        WITH items AS (
+            SELECT array_agg(id ORDER BY id) AS ids FROM case_items
+        ), picks AS (
+            SELECT u.id AS user_id, g,
+                   (SELECT ids[1 + floor(random() * array_length(ids, 1))::int] FROM items) AS item_id
+            FROM users u
+            CROSS JOIN generate_series(1, %(per_user)s) g
+            WHERE u.username LIKE 'load\\_%%'
+        )
+        INSERT INTO promocodes (user_id, case_id, item_id, promo_code, item_name, item_rarity, is_used, created_at)
+        SELECT p.user_id, ci.case_id, ci.id,
+               'L' || upper(substr(md5(p.user_id || ':' || p.g || ':' || random()), 1, 18)),
+               ci.name, ci.rarity, random() < 0.2,
+               CURRENT_TIMESTAMP - random() * INTERVAL '90 days'
+        FROM picks p
+        JOIN case_items ci ON ci.id = p.item_id
+    """, {'per_user': promos_per_user})
+
+    cursor.execute("""
+        INSERT INTO marketplace (seller_id, promo_id, price, item_name, item_rarity, item_description, created_at)
+        SELECT p.user_id, p.id, round((50 + random() * 5000)::numeric, 2), p.item_name,
+               COALESCE(p.item_rarity, 'common'), NULL, p.created_at
+        FROM promocodes p
+        JOIN users u ON u.id = p.user_id
+        WHERE u.username LIKE 'load\\_%%'
+          AND p.is_used = FALSE
+          AND NOT EXISTS (SELECT 1 FROM marketplace m WHERE m.promo_id = p.id)
+        ORDER BY random()
+        LIMIT %(listings)s
+    """, {'listings': listings})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--promos-per-user', type=int, default=50)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--reset', action='store_true', help='удалить прежние данные load_* перед наполнением')
+    parser.add_argument('--reset-only', action='store_true', help='только удалить данные load_*')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    if args.reset or args.reset_only:
+        reset(cursor)
+    if not args.reset_only:
+        seed(cursor, args.users, args.promos_per_user, args.listings)
+    cursor.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    print(f'done in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+-- Версия каталога кейсов: увеличивается при каждом изменении cases/case_items из админки,
+-- по ней тёплые контейнеры функций сбрасывают закэшированные ответы
+CREATE TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.catalog_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p36789279_gta_cases_portal.catalog_version (id, version) VALUES (1, 1)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,24 @@
+-- Частичные индексы по активным (непроданным) лотам маркетплейса под курсорную пагинацию:
+-- сортировка по дате и по цене, фильтр по редкости и поиск по началу названия
+CREATE INDEX IF NOT EXISTS idx_marketplace_active_created
+    ON t_p36789279_gta_cases_portal.marketplace (created_at DESC, id DESC)
+    WHERE is_sold = FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_marketplace_active_price
+    ON t_p36789279_gta_cases_portal.marketplace (price, id)
+    WHERE is_sold = FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_marketplace_active_rarity_created
+    ON t_p36789279_gta_cases_portal.marketplace (item_rarity, created_at DESC, id DESC)
+    WHERE is_sold = FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_marketplace_active_rarity_price
+    ON t_p36789279_gta_cases_portal.marketplace (item_rarity, price, id)
+    WHERE is_sold = FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_marketplace_active_name
+    ON t_p36789279_gta_cases_portal.marketplace (lower(item_name) text_pattern_ops)
+    WHERE is_sold = FALSE;
+
+-- Индекс по одному булевому флагу не избирателен и теперь полностью перекрыт частичными
+DROP INDEX IF EXISTS t_p36789279_gta_cases_portal.idx_marketplace_is_sold;
@@ -0,0 +1,20 @@
+-- Редкость предмета хранится прямо в промокоде, чтобы инвентарь фильтровался и отдавался без JOIN с case_items
+ALTER TABLE t_p36789279_gta_cases_portal.promocodes ADD COLUMN IF NOT EXISTS item_rarity VARCHAR(20);
+
+UPDATE t_p36789279_gta_cases_portal.promocodes p
+SET item_rarity = ci.rarity
+FROM t_p36789279_gta_cases_portal.case_items ci
+WHERE p.item_id = ci.id AND p.item_rarity IS NULL;
+
+-- Курсорная пагинация инвентаря: свежие промокоды пользователя первыми, отдельно по флагу is_used
+CREATE INDEX IF NOT EXISTS idx_promocodes_user_created
+    ON t_p36789279_gta_cases_portal.promocodes (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_promocodes_user_used_created
+    ON t_p36789279_gta_cases_portal.promocodes (user_id, is_used, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_promocodes_user_rarity_created
+    ON t_p36789279_gta_cases_portal.promocodes (user_id, item_rarity, created_at DESC, id DESC);
+
+-- Перекрыт составным индексом idx_promocodes_user_created
+DROP INDEX IF EXISTS t_p36789279_gta_cases_portal.idx_promocodes_user_id;
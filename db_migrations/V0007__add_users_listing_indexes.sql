@@ -0,0 +1,7 @@
+-- Постраничный список пользователей в админке: по дате регистрации и поиск по началу имени.
+-- COLLATE "C" позволяет одному индексу обслуживать и LIKE 'prefix%', и сортировку по имени
+CREATE INDEX IF NOT EXISTS idx_users_created
+    ON t_p36789279_gta_cases_portal.users (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_users_username_lower
+    ON t_p36789279_gta_cases_portal.users ((lower(username) COLLATE "C"), id);
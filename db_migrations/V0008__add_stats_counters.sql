@@ -0,0 +1,150 @@
+-- Счётчики для дашборда админки вместо COUNT(*)/SUM(balance) по полным таблицам.
+-- Каждый счётчик разбит на 16 шардов по pg_backend_pid(), чтобы параллельные
+-- открытия кейсов не выстраивались в очередь за блокировкой одной строки
+CREATE TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.stats_counters (
+    name VARCHAR(32) NOT NULL,
+    shard SMALLINT NOT NULL,
+    value NUMERIC(20, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, shard)
+);
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.bump_stat(p_name VARCHAR, p_delta NUMERIC)
+RETURNS VOID AS $$
+BEGIN
+    IF p_delta IS NULL OR p_delta = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO t_p36789279_gta_cases_portal.stats_counters (name, shard, value)
+    VALUES (p_name, pg_backend_pid() % 16, p_delta)
+    ON CONFLICT (name, shard) DO UPDATE
+    SET value = t_p36789279_gta_cases_portal.stats_counters.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: массовая вставка промокодов (мультиоткрытие) даёт одно обновление счётчика
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_users_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_users', (SELECT COUNT(*) FROM new_rows));
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_balance', (SELECT SUM(balance) FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_users_delete() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_users', -(SELECT COUNT(*) FROM old_rows));
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_balance', -(SELECT SUM(balance) FROM old_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_users_update() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat(
+        'total_balance',
+        COALESCE((SELECT SUM(balance) FROM new_rows), 0) - COALESCE((SELECT SUM(balance) FROM old_rows), 0)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_count_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat(TG_ARGV[0], (SELECT COUNT(*) FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_count_delete() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat(TG_ARGV[0], -(SELECT COUNT(*) FROM old_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_stats_users_insert ON t_p36789279_gta_cases_portal.users;
+CREATE TRIGGER trg_stats_users_insert
+    AFTER INSERT ON t_p36789279_gta_cases_portal.users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_users_insert();
+
+DROP TRIGGER IF EXISTS trg_stats_users_delete ON t_p36789279_gta_cases_portal.users;
+CREATE TRIGGER trg_stats_users_delete
+    AFTER DELETE ON t_p36789279_gta_cases_portal.users
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_users_delete();
+
+DROP TRIGGER IF EXISTS trg_stats_users_update ON t_p36789279_gta_cases_portal.users;
+CREATE TRIGGER trg_stats_users_update
+    AFTER UPDATE ON t_p36789279_gta_cases_portal.users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_users_update();
+
+DROP TRIGGER IF EXISTS trg_stats_cases_insert ON t_p36789279_gta_cases_portal.cases;
+CREATE TRIGGER trg_stats_cases_insert
+    AFTER INSERT ON t_p36789279_gta_cases_portal.cases
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_count_insert('total_cases');
+
+DROP TRIGGER IF EXISTS trg_stats_cases_delete ON t_p36789279_gta_cases_portal.cases;
+CREATE TRIGGER trg_stats_cases_delete
+    AFTER DELETE ON t_p36789279_gta_cases_portal.cases
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_count_delete('total_cases');
+
+DROP TRIGGER IF EXISTS trg_stats_promocodes_insert ON t_p36789279_gta_cases_portal.promocodes;
+CREATE TRIGGER trg_stats_promocodes_insert
+    AFTER INSERT ON t_p36789279_gta_cases_portal.promocodes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_count_insert('total_promocodes');
+
+DROP TRIGGER IF EXISTS trg_stats_promocodes_delete ON t_p36789279_gta_cases_portal.promocodes;
+CREATE TRIGGER trg_stats_promocodes_delete
+    AFTER DELETE ON t_p36789279_gta_cases_portal.promocodes
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_count_delete('total_promocodes');
+
+-- Сверка: точный пересчёт по таблицам, отчёт о расхождении и (при p_apply) перезапись счётчиков.
+-- Блокировка stats_counters дожидается незавершённых транзакций, уже успевших изменить счётчики,
+-- и не даёт новым изменениям проскочить между подсчётом и перезаписью
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.reconcile_stats(p_apply BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (name VARCHAR, counted NUMERIC, actual NUMERIC, drift NUMERIC) AS $$
+#variable_conflict use_column
+BEGIN
+    IF p_apply THEN
+        LOCK TABLE t_p36789279_gta_cases_portal.stats_counters IN EXCLUSIVE MODE;
+    END IF;
+
+    RETURN QUERY
+    WITH actual_values (name, actual) AS (
+        SELECT 'total_users'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_balance'::VARCHAR, COALESCE(SUM(balance), 0)::NUMERIC FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_cases'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.cases
+        UNION ALL
+        SELECT 'total_promocodes'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.promocodes
+    ), counted_values AS (
+        SELECT sc.name, SUM(sc.value) AS counted
+        FROM t_p36789279_gta_cases_portal.stats_counters sc
+        GROUP BY sc.name
+    )
+    SELECT a.name, COALESCE(c.counted, 0), a.actual, a.actual - COALESCE(c.counted, 0)
+    FROM actual_values a
+    LEFT JOIN counted_values c ON c.name = a.name;
+
+    IF p_apply THEN
+        DELETE FROM t_p36789279_gta_cases_portal.stats_counters;
+        INSERT INTO t_p36789279_gta_cases_portal.stats_counters (name, shard, value)
+        SELECT 'total_users', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_balance', 0, COALESCE(SUM(balance), 0) FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_cases', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.cases
+        UNION ALL
+        SELECT 'total_promocodes', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.promocodes;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT * FROM t_p36789279_gta_cases_portal.reconcile_stats(TRUE);
@@ -0,0 +1,320 @@
+-- Журнал движений баланса вместо UPDATE users SET balance = balance ± x.
+-- Каждое движение — строка в balance_ledger (только вставка) с причиной и ссылкой на объект.
+-- Текущий баланс = снимок из balance_snapshots + движения после горизонта снимка.
+-- Горизонт — xmin снимка транзакций на момент сжатия: всё, что записано транзакциями
+-- с txid ниже горизонта, уже завершено и попадает в снимок, остальное читается из журнала.
+-- Зачисления (продажа, выручка продавца) не блокируют ничего; списания блокируют только
+-- строку снимка списывающего пользователя, чтобы проверка достаточности баланса была точной.
+-- users.balance после этой миграции — баланс на момент последнего сжатия, для отчётов;
+-- живой баланс возвращает user_balance()
+CREATE TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.balance_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    delta NUMERIC(12, 2) NOT NULL,
+    reason VARCHAR(32) NOT NULL,
+    ref_type VARCHAR(16),
+    ref_id BIGINT,
+    txid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_user_txid
+    ON t_p36789279_gta_cases_portal.balance_ledger (user_id, txid);
+
+CREATE TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.balance_snapshots (
+    user_id INTEGER PRIMARY KEY REFERENCES t_p36789279_gta_cases_portal.users(id) ON DELETE CASCADE,
+    balance NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    horizon xid8 NOT NULL,
+    taken_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Журнал только дополняется
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.balance_ledger_append_only() RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'balance_ledger is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_balance_ledger_append_only ON t_p36789279_gta_cases_portal.balance_ledger;
+CREATE TRIGGER trg_balance_ledger_append_only
+    BEFORE UPDATE OR DELETE ON t_p36789279_gta_cases_portal.balance_ledger
+    FOR EACH ROW EXECUTE FUNCTION t_p36789279_gta_cases_portal.balance_ledger_append_only();
+
+DROP TRIGGER IF EXISTS trg_balance_ledger_no_truncate ON t_p36789279_gta_cases_portal.balance_ledger;
+CREATE TRIGGER trg_balance_ledger_no_truncate
+    BEFORE TRUNCATE ON t_p36789279_gta_cases_portal.balance_ledger
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.balance_ledger_append_only();
+
+-- Перенос текущих балансов: пустой снимок и начальная запись в журнале
+INSERT INTO t_p36789279_gta_cases_portal.balance_snapshots (user_id, balance, horizon)
+SELECT id, 0, pg_current_xact_id() FROM t_p36789279_gta_cases_portal.users
+ON CONFLICT (user_id) DO NOTHING;
+
+INSERT INTO t_p36789279_gta_cases_portal.balance_ledger (user_id, delta, reason)
+SELECT id, balance, 'opening' FROM t_p36789279_gta_cases_portal.users
+WHERE COALESCE(balance, 0) <> 0;
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.user_balance(p_user_id INTEGER)
+RETURNS NUMERIC AS $$
+    SELECT s.balance + COALESCE((
+        SELECT SUM(l.delta)
+        FROM t_p36789279_gta_cases_portal.balance_ledger l
+        WHERE l.user_id = s.user_id AND l.txid >= s.horizon
+    ), 0)
+    FROM t_p36789279_gta_cases_portal.balance_snapshots s
+    WHERE s.user_id = p_user_id;
+$$ LANGUAGE sql STABLE;
+
+-- Сжатие одного пользователя по ходу работы, чтобы хвост журнала за снимком (его читает каждый
+-- user_balance) не рос между запусками compact_balances. Вызывающий держит блокировку строки снимка.
+-- Пока идёт compact_balances, пропускается: её перенос посчитан по старому горизонту
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.compact_user_balance(
+    p_user_id INTEGER, p_min_rows INTEGER DEFAULT 64
+) RETURNS BOOLEAN AS $$
+DECLARE
+    v_horizon xid8 := pg_snapshot_xmin(pg_current_snapshot());
+    v_delta NUMERIC;
+    v_rows INTEGER;
+BEGIN
+    SELECT COALESCE(SUM(l.delta), 0), COUNT(*) INTO v_delta, v_rows
+    FROM t_p36789279_gta_cases_portal.balance_ledger l
+    JOIN t_p36789279_gta_cases_portal.balance_snapshots s ON s.user_id = l.user_id
+    WHERE l.user_id = p_user_id AND l.txid >= s.horizon AND l.txid < v_horizon;
+
+    IF v_rows < p_min_rows OR NOT pg_try_advisory_xact_lock_shared(hashtext('compact_balances')) THEN
+        RETURN FALSE;
+    END IF;
+
+    UPDATE t_p36789279_gta_cases_portal.balance_snapshots
+    SET balance = balance + v_delta, horizon = v_horizon, taken_at = CURRENT_TIMESTAMP
+    WHERE user_id = p_user_id AND horizon < v_horizon;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Списание: NULL, если пользователя нет или баланса не хватает
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.ledger_debit(
+    p_user_id INTEGER, p_amount NUMERIC, p_reason VARCHAR, p_ref_type VARCHAR DEFAULT NULL, p_ref_id BIGINT DEFAULT NULL
+) RETURNS NUMERIC AS $$
+DECLARE
+    v_balance NUMERIC;
+BEGIN
+    PERFORM 1 FROM t_p36789279_gta_cases_portal.balance_snapshots WHERE user_id = p_user_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    PERFORM t_p36789279_gta_cases_portal.compact_user_balance(p_user_id);
+    v_balance := t_p36789279_gta_cases_portal.user_balance(p_user_id);
+    IF v_balance < p_amount THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO t_p36789279_gta_cases_portal.balance_ledger (user_id, delta, reason, ref_type, ref_id)
+    VALUES (p_user_id, -p_amount, p_reason, p_ref_type, p_ref_id);
+    RETURN v_balance - p_amount;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Зачисление без блокировок: возвращает баланс с учётом своей записи. Строка снимка блокируется
+-- (без ожидания) только для сжатия, когда за снимком накопился длинный хвост
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.ledger_credit(
+    p_user_id INTEGER, p_amount NUMERIC, p_reason VARCHAR, p_ref_type VARCHAR DEFAULT NULL, p_ref_id BIGINT DEFAULT NULL
+) RETURNS NUMERIC AS $$
+BEGIN
+    IF (SELECT COUNT(*) FROM t_p36789279_gta_cases_portal.balance_ledger l
+        JOIN t_p36789279_gta_cases_portal.balance_snapshots s ON s.user_id = l.user_id
+        WHERE l.user_id = p_user_id AND l.txid >= s.horizon) >= 64 THEN
+        PERFORM 1 FROM t_p36789279_gta_cases_portal.balance_snapshots
+        WHERE user_id = p_user_id FOR UPDATE SKIP LOCKED;
+        IF FOUND THEN
+            PERFORM t_p36789279_gta_cases_portal.compact_user_balance(p_user_id);
+        END IF;
+    END IF;
+    INSERT INTO t_p36789279_gta_cases_portal.balance_ledger (user_id, delta, reason, ref_type, ref_id)
+    VALUES (p_user_id, p_amount, p_reason, p_ref_type, p_ref_id);
+    RETURN t_p36789279_gta_cases_portal.user_balance(p_user_id);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Установка баланса администратором записывается как корректировка на разницу
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.ledger_set_balance(
+    p_user_id INTEGER, p_balance NUMERIC, p_reason VARCHAR, p_ref_type VARCHAR DEFAULT NULL, p_ref_id BIGINT DEFAULT NULL
+) RETURNS NUMERIC AS $$
+DECLARE
+    v_balance NUMERIC;
+BEGIN
+    PERFORM 1 FROM t_p36789279_gta_cases_portal.balance_snapshots WHERE user_id = p_user_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    PERFORM t_p36789279_gta_cases_portal.compact_user_balance(p_user_id);
+    v_balance := t_p36789279_gta_cases_portal.user_balance(p_user_id);
+    IF v_balance <> p_balance THEN
+        INSERT INTO t_p36789279_gta_cases_portal.balance_ledger (user_id, delta, reason, ref_type, ref_id)
+        VALUES (p_user_id, p_balance - v_balance, p_reason, p_ref_type, p_ref_id);
+    END IF;
+    RETURN p_balance;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Новый пользователь: пустой снимок и стартовый баланс записью в журнале
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.ledger_users_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO t_p36789279_gta_cases_portal.balance_snapshots (user_id, balance, horizon)
+    SELECT id, 0, pg_current_xact_id() FROM new_rows;
+    INSERT INTO t_p36789279_gta_cases_portal.balance_ledger (user_id, delta, reason)
+    SELECT id, balance, 'opening' FROM new_rows WHERE COALESCE(balance, 0) <> 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ledger_users_insert ON t_p36789279_gta_cases_portal.users;
+CREATE TRIGGER trg_ledger_users_insert
+    AFTER INSERT ON t_p36789279_gta_cases_portal.users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.ledger_users_insert();
+
+-- Сжатие: переносит завершённые движения в снимки и обновляет users.balance для отчётов.
+-- Списания того же пользователя на время переноса ждут блокировку строки снимка
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.compact_balances()
+RETURNS INTEGER AS $$
+DECLARE
+    v_horizon xid8 := pg_snapshot_xmin(pg_current_snapshot());
+    v_count INTEGER;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('compact_balances'));
+
+    WITH folded AS (
+        SELECT l.user_id, SUM(l.delta) AS delta
+        FROM t_p36789279_gta_cases_portal.balance_ledger l
+        JOIN t_p36789279_gta_cases_portal.balance_snapshots s ON s.user_id = l.user_id
+        WHERE l.txid >= s.horizon AND l.txid < v_horizon
+        GROUP BY l.user_id
+    ), compacted AS (
+        UPDATE t_p36789279_gta_cases_portal.balance_snapshots s
+        SET balance = s.balance + f.delta, horizon = v_horizon, taken_at = CURRENT_TIMESTAMP
+        FROM folded f
+        WHERE s.user_id = f.user_id AND s.horizon < v_horizon
+        RETURNING s.user_id, s.balance
+    ), synced AS (
+        UPDATE t_p36789279_gta_cases_portal.users u
+        SET balance = c.balance
+        FROM compacted c
+        WHERE u.id = c.user_id
+        RETURNING u.id
+    )
+    SELECT COUNT(*) INTO v_count FROM synced;
+
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Проверка: снимок равен сумме журнала ниже горизонта, живой баланс не отрицателен,
+-- у каждого пользователя есть снимок. Возвращает только найденные расхождения
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.verify_balances()
+RETURNS TABLE (user_id INTEGER, problem VARCHAR, snapshot_balance NUMERIC, ledger_balance NUMERIC) AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH totals AS (
+        SELECT
+            s.user_id,
+            s.balance,
+            COALESCE(SUM(l.delta) FILTER (WHERE l.txid < s.horizon), 0) AS below_horizon,
+            COALESCE(SUM(l.delta), 0) AS total
+        FROM t_p36789279_gta_cases_portal.balance_snapshots s
+        LEFT JOIN t_p36789279_gta_cases_portal.balance_ledger l ON l.user_id = s.user_id
+        GROUP BY s.user_id, s.balance
+    )
+    SELECT t.user_id, 'snapshot_mismatch'::VARCHAR, t.balance, t.below_horizon
+    FROM totals t WHERE t.balance <> t.below_horizon
+    UNION ALL
+    SELECT t.user_id, 'negative_balance'::VARCHAR, t.balance, t.total
+    FROM totals t WHERE t.total < 0
+    UNION ALL
+    SELECT u.id, 'missing_snapshot'::VARCHAR, NULL::NUMERIC, NULL::NUMERIC
+    FROM t_p36789279_gta_cases_portal.users u
+    WHERE NOT EXISTS (SELECT 1 FROM t_p36789279_gta_cases_portal.balance_snapshots s WHERE s.user_id = u.id);
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Счётчик total_balance теперь ведётся по журналу, а не по users.balance
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_ledger_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_balance', (SELECT SUM(delta) FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_stats_ledger_insert ON t_p36789279_gta_cases_portal.balance_ledger;
+CREATE TRIGGER trg_stats_ledger_insert
+    AFTER INSERT ON t_p36789279_gta_cases_portal.balance_ledger
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_ledger_insert();
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_users_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_users', (SELECT COUNT(*) FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.stats_users_delete() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_users', -(SELECT COUNT(*) FROM old_rows));
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_balance', -(
+        SELECT SUM(l.delta)
+        FROM t_p36789279_gta_cases_portal.balance_ledger l
+        WHERE l.user_id IN (SELECT id FROM old_rows)
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_stats_users_update ON t_p36789279_gta_cases_portal.users;
+DROP FUNCTION IF EXISTS t_p36789279_gta_cases_portal.stats_users_update();
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.reconcile_stats(p_apply BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (name VARCHAR, counted NUMERIC, actual NUMERIC, drift NUMERIC) AS $$
+#variable_conflict use_column
+BEGIN
+    IF p_apply THEN
+        LOCK TABLE t_p36789279_gta_cases_portal.stats_counters IN EXCLUSIVE MODE;
+    END IF;
+
+    RETURN QUERY
+    WITH actual_values (name, actual) AS (
+        SELECT 'total_users'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_balance'::VARCHAR, COALESCE(SUM(l.delta), 0)::NUMERIC
+        FROM t_p36789279_gta_cases_portal.balance_ledger l
+        JOIN t_p36789279_gta_cases_portal.users u ON u.id = l.user_id
+        UNION ALL
+        SELECT 'total_cases'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.cases
+        UNION ALL
+        SELECT 'total_promocodes'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.promocodes
+    ), counted_values AS (
+        SELECT sc.name, SUM(sc.value) AS counted
+        FROM t_p36789279_gta_cases_portal.stats_counters sc
+        GROUP BY sc.name
+    )
+    SELECT a.name, COALESCE(c.counted, 0), a.actual, a.actual - COALESCE(c.counted, 0)
+    FROM actual_values a
+    LEFT JOIN counted_values c ON c.name = a.name;
+
+    IF p_apply THEN
+        DELETE FROM t_p36789279_gta_cases_portal.stats_counters;
+        INSERT INTO t_p36789279_gta_cases_portal.stats_counters (name, shard, value)
+        SELECT 'total_users', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_balance', 0, COALESCE(SUM(l.delta), 0)
+        FROM t_p36789279_gta_cases_portal.balance_ledger l
+        JOIN t_p36789279_gta_cases_portal.users u ON u.id = l.user_id
+        UNION ALL
+        SELECT 'total_cases', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.cases
+        UNION ALL
+        SELECT 'total_promocodes', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.promocodes;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT * FROM t_p36789279_gta_cases_portal.reconcile_stats(TRUE);
@@ -0,0 +1,9 @@
+-- Номера для промокодов: open-case берёт номер блока из 1000 кодов и шифрует каждый номер
+-- ключевой перестановкой (promo_code.py), поэтому коды не повторяются и не угадываются.
+-- Последовательность нельзя сбрасывать — повторно выданный номер даст уже существующий код
+CREATE SEQUENCE IF NOT EXISTS t_p36789279_gta_cases_portal.promo_code_seq
+    AS BIGINT
+    MINVALUE 0
+    START WITH 0
+    MAXVALUE 4611686018427386
+    NO CYCLE;
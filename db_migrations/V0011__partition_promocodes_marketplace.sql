@@ -0,0 +1,268 @@
+-- Помесячное секционирование promocodes и marketplace по created_at и архив для старых строк.
+-- Первичные ключи секционированной таблицы обязаны включать ключ секционирования, поэтому
+-- PRIMARY KEY становится (id, created_at), а глобальные UNIQUE на promo_code и marketplace.promo_id
+-- и внешний ключ marketplace.promo_id -> promocodes(id) пропадают:
+--   * promo_code уникален по построению (V0010, promo_code.py), остаётся обычный индекс;
+--   * один активный лот на промокод гарантирует list_market под блокировкой строки промокода.
+-- Запросы обработчиков не меняются: поиск по id идёт по индексам секций. Условие на created_at
+-- есть только у страниц курсора (сортировка newest на рынке и инвентарь), они пропускают более
+-- новые секции; первая страница и сортировки по цене читают индексы всех секций
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.ensure_monthly_partitions(
+    p_table TEXT, p_from DATE, p_to DATE
+) RETURNS INTEGER AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::DATE;
+    v_next DATE;
+    v_name TEXT;
+    v_default TEXT := format('t_p36789279_gta_cases_portal.%I', p_table || '_default');
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= p_to LOOP
+        v_next := (v_month + INTERVAL '1 month')::DATE;
+        v_name := format('%s_y%sm%s', p_table, to_char(v_month, 'YYYY'), to_char(v_month, 'MM'));
+        IF to_regclass(format('t_p36789279_gta_cases_portal.%I', v_name)) IS NULL THEN
+            -- Если обслуживание запаздывало, строки этого месяца уже лежат в секции по умолчанию,
+            -- и PARTITION OF не пройдёт проверку. Секция создаётся отдельно, строки переносятся в неё
+            -- из default под блокировкой (новые строки месяца ждут), затем секция подключается
+            EXECUTE format('LOCK TABLE %s IN EXCLUSIVE MODE', v_default);
+            EXECUTE format(
+                'CREATE TABLE t_p36789279_gta_cases_portal.%I '
+                '(LIKE t_p36789279_gta_cases_portal.%I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                v_name, p_table
+            );
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM %s WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                'INSERT INTO t_p36789279_gta_cases_portal.%I SELECT * FROM moved',
+                v_default, v_month, v_next, v_name
+            );
+            EXECUTE format(
+                'ALTER TABLE t_p36789279_gta_cases_portal.%I ATTACH PARTITION t_p36789279_gta_cases_portal.%I '
+                'FOR VALUES FROM (%L) TO (%L)',
+                p_table, v_name, v_month, v_next
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_month := v_next;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE t_p36789279_gta_cases_portal.marketplace RENAME TO marketplace_unpartitioned;
+ALTER TABLE t_p36789279_gta_cases_portal.promocodes RENAME TO promocodes_unpartitioned;
+ALTER SEQUENCE t_p36789279_gta_cases_portal.promocodes_id_seq OWNED BY NONE;
+ALTER SEQUENCE t_p36789279_gta_cases_portal.marketplace_id_seq OWNED BY NONE;
+
+CREATE TABLE t_p36789279_gta_cases_portal.promocodes (
+    id INTEGER NOT NULL DEFAULT nextval('t_p36789279_gta_cases_portal.promocodes_id_seq'),
+    user_id INTEGER REFERENCES t_p36789279_gta_cases_portal.users(id),
+    case_id INTEGER REFERENCES t_p36789279_gta_cases_portal.cases(id),
+    item_id INTEGER REFERENCES t_p36789279_gta_cases_portal.case_items(id),
+    promo_code VARCHAR(20) NOT NULL,
+    item_name VARCHAR(100) NOT NULL,
+    is_used BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    item_rarity VARCHAR(20),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE t_p36789279_gta_cases_portal.marketplace (
+    id INTEGER NOT NULL DEFAULT nextval('t_p36789279_gta_cases_portal.marketplace_id_seq'),
+    seller_id INTEGER REFERENCES t_p36789279_gta_cases_portal.users(id) NOT NULL,
+    promo_id INTEGER NOT NULL,
+    price DECIMAL(10, 2) NOT NULL,
+    item_name VARCHAR(100) NOT NULL,
+    item_rarity VARCHAR(20) NOT NULL,
+    item_description TEXT,
+    is_sold BOOLEAN DEFAULT FALSE,
+    buyer_id INTEGER REFERENCES t_p36789279_gta_cases_portal.users(id),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sold_at TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE t_p36789279_gta_cases_portal.promocodes_id_seq OWNED BY t_p36789279_gta_cases_portal.promocodes.id;
+ALTER SEQUENCE t_p36789279_gta_cases_portal.marketplace_id_seq OWNED BY t_p36789279_gta_cases_portal.marketplace.id;
+
+-- Строки вне созданных месяцев (если задача обслуживания давно не запускалась) попадают сюда
+CREATE TABLE t_p36789279_gta_cases_portal.promocodes_default
+    PARTITION OF t_p36789279_gta_cases_portal.promocodes DEFAULT;
+CREATE TABLE t_p36789279_gta_cases_portal.marketplace_default
+    PARTITION OF t_p36789279_gta_cases_portal.marketplace DEFAULT;
+
+SELECT t_p36789279_gta_cases_portal.ensure_monthly_partitions(
+    'promocodes',
+    COALESCE((SELECT MIN(created_at)::DATE FROM t_p36789279_gta_cases_portal.promocodes_unpartitioned), CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '3 months')::DATE
+);
+SELECT t_p36789279_gta_cases_portal.ensure_monthly_partitions(
+    'marketplace',
+    COALESCE((SELECT MIN(created_at)::DATE FROM t_p36789279_gta_cases_portal.marketplace_unpartitioned), CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '3 months')::DATE
+);
+
+INSERT INTO t_p36789279_gta_cases_portal.promocodes
+    (id, user_id, case_id, item_id, promo_code, item_name, is_used, created_at, item_rarity)
+SELECT id, user_id, case_id, item_id, promo_code, item_name, is_used, COALESCE(created_at, CURRENT_TIMESTAMP), item_rarity
+FROM t_p36789279_gta_cases_portal.promocodes_unpartitioned;
+
+INSERT INTO t_p36789279_gta_cases_portal.marketplace
+    (id, seller_id, promo_id, price, item_name, item_rarity, item_description, is_sold, buyer_id, created_at, sold_at)
+SELECT id, seller_id, promo_id, price, item_name, item_rarity, item_description, is_sold, buyer_id,
+       COALESCE(created_at, CURRENT_TIMESTAMP), sold_at
+FROM t_p36789279_gta_cases_portal.marketplace_unpartitioned;
+
+DROP TABLE t_p36789279_gta_cases_portal.marketplace_unpartitioned;
+DROP TABLE t_p36789279_gta_cases_portal.promocodes_unpartitioned;
+
+-- Индексы создаются на родительской таблице и наследуются всеми секциями
+CREATE INDEX idx_promocodes_promo_code ON t_p36789279_gta_cases_portal.promocodes (promo_code);
+CREATE INDEX idx_promocodes_user_created
+    ON t_p36789279_gta_cases_portal.promocodes (user_id, created_at DESC, id DESC);
+CREATE INDEX idx_promocodes_user_used_created
+    ON t_p36789279_gta_cases_portal.promocodes (user_id, is_used, created_at DESC, id DESC);
+CREATE INDEX idx_promocodes_user_rarity_created
+    ON t_p36789279_gta_cases_portal.promocodes (user_id, item_rarity, created_at DESC, id DESC);
+
+CREATE INDEX idx_marketplace_seller ON t_p36789279_gta_cases_portal.marketplace (seller_id);
+CREATE INDEX idx_marketplace_promo ON t_p36789279_gta_cases_portal.marketplace (promo_id);
+CREATE INDEX idx_marketplace_rarity ON t_p36789279_gta_cases_portal.marketplace (item_rarity);
+CREATE INDEX idx_marketplace_active_created
+    ON t_p36789279_gta_cases_portal.marketplace (created_at DESC, id DESC)
+    WHERE is_sold = FALSE;
+CREATE INDEX idx_marketplace_active_price
+    ON t_p36789279_gta_cases_portal.marketplace (price, id)
+    WHERE is_sold = FALSE;
+CREATE INDEX idx_marketplace_active_rarity_created
+    ON t_p36789279_gta_cases_portal.marketplace (item_rarity, created_at DESC, id DESC)
+    WHERE is_sold = FALSE;
+CREATE INDEX idx_marketplace_active_rarity_price
+    ON t_p36789279_gta_cases_portal.marketplace (item_rarity, price, id)
+    WHERE is_sold = FALSE;
+CREATE INDEX idx_marketplace_active_name
+    ON t_p36789279_gta_cases_portal.marketplace (lower(item_name) text_pattern_ops)
+    WHERE is_sold = FALSE;
+
+-- Триггеры счётчиков пропали вместе со старой таблицей; создаются после переноса строк,
+-- чтобы перенос не посчитался новыми промокодами
+CREATE TRIGGER trg_stats_promocodes_insert
+    AFTER INSERT ON t_p36789279_gta_cases_portal.promocodes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_count_insert('total_promocodes');
+
+CREATE TRIGGER trg_stats_promocodes_delete
+    AFTER DELETE ON t_p36789279_gta_cases_portal.promocodes
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p36789279_gta_cases_portal.stats_count_delete('total_promocodes');
+
+-- Холодный архив: использованные промокоды и проданные лоты старше срока хранения
+CREATE TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.promocodes_archive (
+    LIKE t_p36789279_gta_cases_portal.promocodes,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_promocodes_archive_user
+    ON t_p36789279_gta_cases_portal.promocodes_archive (user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.marketplace_archive (
+    LIKE t_p36789279_gta_cases_portal.marketplace,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_marketplace_archive_promo
+    ON t_p36789279_gta_cases_portal.marketplace_archive (promo_id);
+
+-- Задача обслуживания: секции на несколько месяцев вперёд и перенос старых строк в архив.
+-- Промокод, выставленный на непроданный лот, не архивируется. Перенесённые промокоды
+-- остаются в счётчике total_promocodes
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.archive_history(
+    p_retention INTERVAL DEFAULT INTERVAL '180 days', p_months_ahead INTEGER DEFAULT 3
+) RETURNS TABLE (partitions_created INTEGER, promocodes_archived BIGINT, listings_archived BIGINT) AS $$
+DECLARE
+    v_cutoff TIMESTAMP := CURRENT_TIMESTAMP - p_retention;
+    v_until DATE := (CURRENT_DATE + make_interval(months => p_months_ahead))::DATE;
+    v_partitions INTEGER;
+    v_listings BIGINT;
+    v_promocodes BIGINT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('archive_history'));
+
+    v_partitions := t_p36789279_gta_cases_portal.ensure_monthly_partitions('promocodes', CURRENT_DATE, v_until)
+        + t_p36789279_gta_cases_portal.ensure_monthly_partitions('marketplace', CURRENT_DATE, v_until);
+
+    WITH moved AS (
+        DELETE FROM t_p36789279_gta_cases_portal.marketplace
+        WHERE is_sold = TRUE AND created_at < v_cutoff AND sold_at < v_cutoff
+        RETURNING *
+    )
+    INSERT INTO t_p36789279_gta_cases_portal.marketplace_archive
+    SELECT moved.*, CURRENT_TIMESTAMP FROM moved;
+    GET DIAGNOSTICS v_listings = ROW_COUNT;
+
+    WITH moved AS (
+        DELETE FROM t_p36789279_gta_cases_portal.promocodes p
+        WHERE p.is_used = TRUE AND p.created_at < v_cutoff
+          AND NOT EXISTS (
+              SELECT 1 FROM t_p36789279_gta_cases_portal.marketplace m
+              WHERE m.promo_id = p.id AND m.is_sold = FALSE
+          )
+        RETURNING *
+    )
+    INSERT INTO t_p36789279_gta_cases_portal.promocodes_archive
+    SELECT moved.*, CURRENT_TIMESTAMP FROM moved;
+    GET DIAGNOSTICS v_promocodes = ROW_COUNT;
+
+    PERFORM t_p36789279_gta_cases_portal.bump_stat('total_promocodes', v_promocodes);
+
+    RETURN QUERY SELECT v_partitions, v_promocodes, v_listings;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p36789279_gta_cases_portal.reconcile_stats(p_apply BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (name VARCHAR, counted NUMERIC, actual NUMERIC, drift NUMERIC) AS $$
+#variable_conflict use_column
+BEGIN
+    IF p_apply THEN
+        LOCK TABLE t_p36789279_gta_cases_portal.stats_counters IN EXCLUSIVE MODE;
+    END IF;
+
+    RETURN QUERY
+    WITH actual_values (name, actual) AS (
+        SELECT 'total_users'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_balance'::VARCHAR, COALESCE(SUM(l.delta), 0)::NUMERIC
+        FROM t_p36789279_gta_cases_portal.balance_ledger l
+        JOIN t_p36789279_gta_cases_portal.users u ON u.id = l.user_id
+        UNION ALL
+        SELECT 'total_cases'::VARCHAR, COUNT(*)::NUMERIC FROM t_p36789279_gta_cases_portal.cases
+        UNION ALL
+        SELECT 'total_promocodes'::VARCHAR,
+               ((SELECT COUNT(*) FROM t_p36789279_gta_cases_portal.promocodes)
+                + (SELECT COUNT(*) FROM t_p36789279_gta_cases_portal.promocodes_archive))::NUMERIC
+    ), counted_values AS (
+        SELECT sc.name, SUM(sc.value) AS counted
+        FROM t_p36789279_gta_cases_portal.stats_counters sc
+        GROUP BY sc.name
+    )
+    SELECT a.name, COALESCE(c.counted, 0), a.actual, a.actual - COALESCE(c.counted, 0)
+    FROM actual_values a
+    LEFT JOIN counted_values c ON c.name = a.name;
+
+    IF p_apply THEN
+        DELETE FROM t_p36789279_gta_cases_portal.stats_counters;
+        INSERT INTO t_p36789279_gta_cases_portal.stats_counters (name, shard, value)
+        SELECT 'total_users', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.users
+        UNION ALL
+        SELECT 'total_balance', 0, COALESCE(SUM(l.delta), 0)
+        FROM t_p36789279_gta_cases_portal.balance_ledger l
+        JOIN t_p36789279_gta_cases_portal.users u ON u.id = l.user_id
+        UNION ALL
+        SELECT 'total_cases', 0, COUNT(*) FROM t_p36789279_gta_cases_portal.cases
+        UNION ALL
+        SELECT 'total_promocodes', 0,
+               (SELECT COUNT(*) FROM t_p36789279_gta_cases_portal.promocodes)
+               + (SELECT COUNT(*) FROM t_p36789279_gta_cases_portal.promocodes_archive);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+ANALYZE t_p36789279_gta_cases_portal.promocodes;
+ANALYZE t_p36789279_gta_cases_portal.marketplace;
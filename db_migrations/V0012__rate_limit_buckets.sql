@@ -0,0 +1,15 @@
+-- Общие корзины ограничения частоты запросов (rate_limit.py). Каждый экземпляр функции сначала
+-- считает запросы у себя и обращается сюда, только когда ключ израсходовал половину запаса.
+-- Таблица UNLOGGED: после сбоя она пустеет, и лимиты просто начинаются заново
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.rate_limit_buckets (
+    key TEXT PRIMARY KEY,
+    rate DOUBLE PRECISION NOT NULL,
+    burst DOUBLE PRECISION NOT NULL,
+    tokens DOUBLE PRECISION NOT NULL,
+    allowed BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+) WITH (fillfactor = 70);
+
+-- Для удаления ключей, которые давно не обновлялись
+CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated
+    ON t_p36789279_gta_cases_portal.rate_limit_buckets (updated_at);
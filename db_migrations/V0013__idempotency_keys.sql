@@ -0,0 +1,14 @@
+-- Ответы на запросы с заголовком Idempotency-Key (idempotency.py). Ключ и тело запроса хранятся
+-- 16-байтовыми хешами, ответ — кодом и JSON. Строка вставляется в той же транзакции, что и сама
+-- операция, поэтому повтор того же ключа ждёт её завершения на первичном ключе, а ответ сохраняется
+-- только вместе с зафиксированными изменениями. Истёкшие строки удаляет фоновая очистка функций
+CREATE TABLE IF NOT EXISTS t_p36789279_gta_cases_portal.idempotency_keys (
+    key_hash BYTEA PRIMARY KEY,
+    request_hash BYTEA NOT NULL,
+    status SMALLINT,
+    body TEXT,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires
+    ON t_p36789279_gta_cases_portal.idempotency_keys (expires_at);
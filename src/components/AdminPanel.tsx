@@ -8,6 +8,7 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@
 import Icon from '@/components/ui/icon'
 import { toast } from '@/hooks/use-toast'
 import { Textarea } from '@/components/ui/textarea'
+import { rememberDbPosition, dbPositionHeaders } from '@/lib/dbPosition'
 
 function ItemForm({ cases, onSubmit }: { cases: any[], onSubmit: (caseId: string, name: string, desc: string, rarity: string, chance: string) => Promise<boolean> }) {
   const [selectedCaseId, setSelectedCaseId] = useState('')
@@ -102,20 +103,26 @@ const API_CASES = 'https://functions.poehali.dev/a6cc4837-3e34-4908-895c-15f350d
 export default function AdminPanel({ userId }: AdminPanelProps) {
   const [stats, setStats] = useState<any>(null)
   const [users, setUsers] = useState<any[]>([])
+  const [usersCursor, setUsersCursor] = useState<string | null>(null)
+  const [userQuery, setUserQuery] = useState('')
   const [cases, setCases] = useState<any[]>([])
   const [selectedUser, setSelectedUser] = useState<any>(null)
   const [selectedCase, setSelectedCase] = useState<any>(null)
 
   useEffect(() => {
     loadStats()
-    loadUsers()
     loadCases()
   }, [])
 
+  useEffect(() => {
+    const timer = setTimeout(() => loadUsers(), 300)
+    return () => clearTimeout(timer)
+  }, [userQuery])
+
   const loadStats = async () => {
     try {
       const res = await fetch(`${API_ADMIN}?action=stats`, {
-        headers: { 'X-User-Id': userId.toString() }
+        headers: { 'Authorization': `Bearer ${localStorage.getItem('token') || ''}`, ...dbPositionHeaders() }
       })
       const data = await res.json()
       setStats(data)
@@ -124,13 +131,22 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
     }
   }
 
-  const loadUsers = async () => {
+  // Без cursor загружает первую страницу заново, с cursor — дописывает следующую
+  const loadUsers = async (cursor?: string) => {
+    const params = new URLSearchParams({ action: 'users' })
+    if (userQuery.trim()) params.set('q', userQuery.trim())
+    if (cursor) params.set('cursor', cursor)
     try {
-      const res = await fetch(`${API_ADMIN}?action=users`, {
-        headers: { 'X-User-Id': userId.toString() }
+      const res = await fetch(`${API_ADMIN}?${params}`, {
+        headers: { 'Authorization': `Bearer ${localStorage.getItem('token') || ''}`, ...dbPositionHeaders() }
       })
       const data = await res.json()
-      setUsers(data)
+      if (!res.ok) {
+        toast({ title: data.error || 'Ошибка загрузки пользователей', variant: 'destructive' })
+        return
+      }
+      setUsers(cursor ? (prev) => [...prev, ...data] : data)
+      setUsersCursor(res.headers.get('X-Next-Cursor'))
     } catch (error) {
       toast({ title: 'Ошибка загрузки пользователей', variant: 'destructive' })
     }
@@ -152,7 +168,7 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': userId.toString()
+          'Authorization': `Bearer ${localStorage.getItem('token') || ''}`
         },
         body: JSON.stringify({
           action: 'update_balance',
@@ -160,6 +176,7 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
           balance: newBalance
         })
       })
+      rememberDbPosition(res)
       const data = await res.json()
       if (data.success) {
         toast({ title: 'Баланс обновлен' })
@@ -180,7 +197,7 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': userId.toString()
+          'Authorization': `Bearer ${localStorage.getItem('token') || ''}`
         },
         body: JSON.stringify({
           action: 'create_case',
@@ -210,7 +227,7 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': userId.toString()
+          'Authorization': `Bearer ${localStorage.getItem('token') || ''}`
         },
         body: JSON.stringify({
           action: 'update_case',
@@ -238,7 +255,7 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': userId.toString()
+          'Authorization': `Bearer ${localStorage.getItem('token') || ''}`
         },
         body: JSON.stringify({
           action: 'create_item',
@@ -340,6 +357,12 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
               <CardTitle>Управление пользователями</CardTitle>
             </CardHeader>
             <CardContent>
+              <Input
+                value={userQuery}
+                onChange={(e) => setUserQuery(e.target.value)}
+                placeholder="Поиск по началу имени"
+                className="mb-4"
+              />
               <div className="space-y-3">
                 {users.map((u) => (
                   <div key={u.id} className="flex items-center justify-between p-4 bg-muted rounded-lg">
@@ -361,6 +384,11 @@ export default function AdminPanel({ userId }: AdminPanelProps) {
                   </div>
                 ))}
               </div>
+              {usersCursor && (
+                <Button variant="outline" className="w-full mt-4" onClick={() => loadUsers(usersCursor)}>
+                  Показать ещё
+                </Button>
+              )}
             </CardContent>
           </Card>
         </TabsContent>
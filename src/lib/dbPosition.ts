@@ -0,0 +1,22 @@
+const STORAGE_KEY = 'dbPosition'
+const HEADER = 'X-DB-Position'
+
+const toNumber = (position: string) => {
+  const [high, low] = position.split('/')
+  return parseInt(high, 16) * 2 ** 32 + parseInt(low, 16)
+}
+
+// Запоминает позицию записи из ответа, чтобы следующие чтения не ушли на отставшую реплику
+export function rememberDbPosition(res: Response) {
+  const position = res.headers.get(HEADER)
+  if (!position) return
+  const current = localStorage.getItem(STORAGE_KEY)
+  if (!current || toNumber(position) > toNumber(current)) {
+    localStorage.setItem(STORAGE_KEY, position)
+  }
+}
+
+export function dbPositionHeaders(): Record<string, string> {
+  const position = localStorage.getItem(STORAGE_KEY)
+  return position ? { [HEADER]: position } : {}
+}
@@ -0,0 +1,15 @@
+const HEADER = 'Idempotency-Key'
+const RETRIES = 2
+
+// Отправляет запрос с одним Idempotency-Key на все попытки: повтор после обрыва связи
+// получает сохранённый ответ первой попытки, а не списывает деньги второй раз
+export async function fetchIdempotent(url: string, init: RequestInit): Promise<Response> {
+  const headers = { ...(init.headers as Record<string, string>), [HEADER]: crypto.randomUUID() }
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await fetch(url, { ...init, headers })
+    } catch (error) {
+      if (attempt >= RETRIES) throw error
+    }
+  }
+}
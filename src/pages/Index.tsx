@@ -6,10 +6,13 @@ import { Input } from '@/components/ui/input'
 import { Label } from '@/components/ui/label'
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs'
 import { Badge } from '@/components/ui/badge'
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select'
 import Icon from '@/components/ui/icon'
 import { toast } from '@/hooks/use-toast'
 import AdminPanel from '@/components/AdminPanel'
 import CaseOpening from '@/components/CaseOpening'
+import { rememberDbPosition, dbPositionHeaders } from '@/lib/dbPosition'
+import { fetchIdempotent } from '@/lib/idempotency'
 
 interface User {
   id: number
@@ -65,6 +68,14 @@ const API = {
   admin: 'https://functions.poehali.dev/95f066f2-b22c-4926-97d8-63e7dbfcf506'
 }
 
+interface MarketFilters {
+  sort: string
+  rarity: string
+  q: string
+  min_price: string
+  max_price: string
+}
+
 const rarityColors = {
   common: 'bg-gray-500',
   rare: 'bg-blue-500',
@@ -77,6 +88,7 @@ export default function Index() {
   const [authOpen, setAuthOpen] = useState(false)
   const [cases, setCases] = useState<Case[]>([])
   const [promocodes, setPromocodes] = useState<Promocode[]>([])
+  const [promocodesCursor, setPromocodesCursor] = useState<string | null>(null)
   const [activeTab, setActiveTab] = useState('cases')
   const [adminTab, setAdminTab] = useState('dashboard')
   const [openingCase, setOpeningCase] = useState(false)
@@ -85,6 +97,10 @@ export default function Index() {
   const [allCaseItems, setAllCaseItems] = useState<CaseItem[]>([])
   const [openingCaseId, setOpeningCaseId] = useState<number | null>(null)
   const [marketItems, setMarketItems] = useState<MarketItem[]>([])
+  const [marketCursor, setMarketCursor] = useState<string | null>(null)
+  const [marketFilters, setMarketFilters] = useState<MarketFilters>({
+    sort: 'newest', rarity: 'all', q: '', min_price: '', max_price: ''
+  })
   const [sellDialogOpen, setSellDialogOpen] = useState(false)
   const [selectedPromoForSale, setSelectedPromoForSale] = useState<Promocode | null>(null)
   const [salePrice, setSalePrice] = useState('')
@@ -96,9 +112,13 @@ export default function Index() {
       setUser(JSON.parse(savedUser))
     }
     loadCases()
-    loadMarket()
   }, [])
 
+  useEffect(() => {
+    const timer = setTimeout(() => loadMarket(), 300)
+    return () => clearTimeout(timer)
+  }, [marketFilters])
+
   useEffect(() => {
     if (user) {
       loadPromocodes()
@@ -132,14 +152,26 @@ export default function Index() {
     }
   }
 
-  const loadPromocodes = async () => {
+  const authHeaders = () => ({
+    'Content-Type': 'application/json',
+    'Authorization': `Bearer ${localStorage.getItem('token') || ''}`,
+    ...dbPositionHeaders()
+  })
+
+  const loadPromocodes = async (cursor?: string) => {
     if (!user) return
+    const url = cursor ? `${API.promocodes}?${new URLSearchParams({ cursor })}` : API.promocodes
     try {
-      const res = await fetch(`${API.promocodes}?user_id=${user.id}`)
+      const res = await fetch(url, { headers: authHeaders() })
+      if (res.status === 401) {
+        logout()
+        return
+      }
       if (!res.ok) throw new Error('Network error')
       const data = await res.json()
       if (Array.isArray(data)) {
-        setPromocodes(data)
+        setPromocodes(cursor ? (prev) => [...prev, ...data] : data)
+        setPromocodesCursor(res.headers.get('X-Next-Cursor'))
       }
     } catch (error) {
       console.error('Error loading promocodes:', error)
@@ -217,11 +249,12 @@ export default function Index() {
     await loadCaseItems(caseId)
 
     try {
-      const res = await fetch(API.openCase, {
+      const res = await fetchIdempotent(API.openCase, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ user_id: user.id, case_id: caseId })
+        headers: authHeaders(),
+        body: JSON.stringify({ case_id: caseId })
       })
+      rememberDbPosition(res)
       const data = await res.json()
 
       if (data.success) {
@@ -244,11 +277,12 @@ export default function Index() {
     if (!user) return
     
     try {
-      const res = await fetch(API.promocodes, {
+      const res = await fetchIdempotent(API.promocodes, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ promo_id: promoId, user_id: user.id })
+        headers: authHeaders(),
+        body: JSON.stringify({ promo_id: promoId })
       })
+      rememberDbPosition(res)
       const data = await res.json()
       
       if (data.success) {
@@ -282,13 +316,27 @@ export default function Index() {
     toast({ title: 'Промокод скопирован!' })
   }
 
-  const loadMarket = async () => {
+  const updateMarketFilter = (name: keyof MarketFilters, value: string) => {
+    setMarketFilters((prev) => ({ ...prev, [name]: value }))
+  }
+
+  const loadMarket = async (cursor?: string) => {
+    const params = new URLSearchParams({ action: 'market', sort: marketFilters.sort })
+    if (marketFilters.rarity !== 'all') params.set('rarity', marketFilters.rarity)
+    if (marketFilters.q.trim()) params.set('q', marketFilters.q.trim())
+    if (marketFilters.min_price) params.set('min_price', marketFilters.min_price)
+    if (marketFilters.max_price) params.set('max_price', marketFilters.max_price)
+    if (cursor) params.set('cursor', cursor)
     try {
-      const res = await fetch(`${API.promocodes}?action=market`)
-      if (!res.ok) throw new Error('Network error')
+      const res = await fetch(`${API.promocodes}?${params}`, { headers: dbPositionHeaders() })
       const data = await res.json()
+      if (!res.ok) {
+        toast({ title: data.error || 'Ошибка загрузки маркета', variant: 'destructive' })
+        return
+      }
       if (Array.isArray(data)) {
-        setMarketItems(data)
+        setMarketItems(cursor ? (prev) => [...prev, ...data] : data)
+        setMarketCursor(res.headers.get('X-Next-Cursor'))
       }
     } catch (error) {
       console.error('Error loading market:', error)
@@ -301,14 +349,14 @@ export default function Index() {
     try {
       const res = await fetch(API.promocodes, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(),
         body: JSON.stringify({
           action: 'list_market',
           promo_id: selectedPromoForSale.id,
-          user_id: user.id,
           price
         })
       })
+      rememberDbPosition(res)
       const data = await res.json()
       
       if (data.success) {
@@ -331,15 +379,15 @@ export default function Index() {
     }
     
     try {
-      const res = await fetch(API.promocodes, {
+      const res = await fetchIdempotent(API.promocodes, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(),
         body: JSON.stringify({
           action: 'buy_market',
-          market_id: marketId,
-          user_id: user.id
+          market_id: marketId
         })
       })
+      rememberDbPosition(res)
       const data = await res.json()
       
       if (data.success) {
@@ -485,6 +533,53 @@ export default function Index() {
               <p className="text-lg text-muted-foreground relative z-10">Покупай предметы у других игроков</p>
             </div>
 
+            <div className="grid grid-cols-1 md:grid-cols-5 gap-3">
+              <Input
+                value={marketFilters.q}
+                onChange={(e) => updateMarketFilter('q', e.target.value)}
+                placeholder="Поиск по началу названия"
+                className="md:col-span-2"
+              />
+              <Select value={marketFilters.sort} onValueChange={(value) => updateMarketFilter('sort', value)}>
+                <SelectTrigger>
+                  <SelectValue />
+                </SelectTrigger>
+                <SelectContent>
+                  <SelectItem value="newest">Сначала новые</SelectItem>
+                  <SelectItem value="price_asc">Сначала дешёвые</SelectItem>
+                  <SelectItem value="price_desc">Сначала дорогие</SelectItem>
+                </SelectContent>
+              </Select>
+              <Select value={marketFilters.rarity} onValueChange={(value) => updateMarketFilter('rarity', value)}>
+                <SelectTrigger>
+                  <SelectValue />
+                </SelectTrigger>
+                <SelectContent>
+                  <SelectItem value="all">Любая редкость</SelectItem>
+                  <SelectItem value="common">Common</SelectItem>
+                  <SelectItem value="rare">Rare</SelectItem>
+                  <SelectItem value="epic">Epic</SelectItem>
+                  <SelectItem value="legendary">Legendary</SelectItem>
+                </SelectContent>
+              </Select>
+              <div className="flex gap-2">
+                <Input
+                  type="number"
+                  min="0"
+                  value={marketFilters.min_price}
+                  onChange={(e) => updateMarketFilter('min_price', e.target.value)}
+                  placeholder="Цена от"
+                />
+                <Input
+                  type="number"
+                  min="0"
+                  value={marketFilters.max_price}
+                  onChange={(e) => updateMarketFilter('max_price', e.target.value)}
+                  placeholder="до"
+                />
+              </div>
+            </div>
+
             {marketItems.length === 0 ? (
               <div className="text-center py-12">
                 <Icon name="Store" size={64} className="mx-auto mb-4 text-muted-foreground" />
@@ -530,6 +625,11 @@ export default function Index() {
                 ))}
               </div>
             )}
+            {marketCursor && (
+              <Button variant="outline" className="w-full" onClick={() => loadMarket(marketCursor)}>
+                Показать ещё
+              </Button>
+            )}
           </TabsContent>
 
           <TabsContent value="promocodes" className="space-y-6">
@@ -613,6 +713,11 @@ export default function Index() {
                 ))}
               </div>
             )}
+            {promocodesCursor && (
+              <Button variant="outline" className="w-full" onClick={() => loadPromocodes(promocodesCursor)}>
+                Показать ещё
+              </Button>
+            )}
           </TabsContent>
 
           {user?.is_admin && (